@@ -79,6 +79,7 @@ import cockpit.interfaces
 import cockpit.interfaces.channels
 import cockpit.interfaces.imager
 import cockpit.interfaces.stageMover
+import cockpit.util.sequencer
 import cockpit.util.userConfig
 
 
@@ -146,6 +147,12 @@ class CockpitApp(wx.App):
                 "global"
             ].getint("pyro-pickle-protocol")
 
+            sequencer_config = self.Config["sequencer"]
+            cockpit.util.sequencer.configure(
+                realtime=sequencer_config.getboolean("realtime-priority"),
+                spinTime=int(sequencer_config.getfloat("spin-time") * 1e6),
+            )
+
             depot_config = self.Config.depot_config
 
             self.Depot.initialize(depot_config)
@@ -195,6 +195,22 @@ def _default_cockpit_config():
         "joystick": {
             "speed": 0.01,
         },
+        "saving": {
+            "writer-threads": "4",
+            "memory-map": "no",
+            "queue-memory": "",
+            "spill-dir": "",
+            "spill-size": "16384",
+            "file-per-camera": "no",
+            "telemetry-log": "yes",
+        },
+        "experiment": {
+            "preflight-check": "yes",
+        },
+        "sequencer": {
+            "realtime-priority": "no",
+            "spin-time": "2",
+        },
     }
     return default
 
@@ -66,7 +66,6 @@ the menu bar.  Namely, this window provides:
 """
 
 import time
-from itertools import chain
 
 import numpy as np
 import Pyro4
@@ -107,6 +106,9 @@ class ExecutorDevice(device.Device):
         self.connection = None
         ## Set of all handlers we control.
         self.handlers = set()
+        ## Identifies the table that the remote was last given to run, for
+        # remotes that keep it, or None.  See CompiledTable.key.
+        self._loadedProfileKey = None
 
     ## Connect to the DSP computer.
     @cockpit.util.threads.locked
@@ -136,6 +138,7 @@ class ExecutorDevice(device.Device):
     ## User clicked the abort button.
     def onAbort(self):
         self.connection.Abort()
+        self._loadedProfileKey = None
         # Various threads could be waiting for a 'DSP done' event, preventing
         # new DSP actions from starting after an abort.
         events.publish(events.EXECUTOR_DONE % self.name)
@@ -164,6 +167,7 @@ class ExecutorDevice(device.Device):
             },
             dlines=self.config.get("dlines", 16),
             alines=self.config.get("alines", 4),
+            supportsRepeats=True,
         )
 
         result.append(h)
@@ -198,20 +202,34 @@ class ExecutorDevice(device.Device):
     ## Actually execute the events in an experiment ActionTable, starting at
     # startIndex and proceeding up to but not through stopIndex.
     def executeTable(self, table, startIndex, stopIndex, numReps, repDuration):
-        actions = actions_from_table(table, startIndex, stopIndex, repDuration)
+        self._prepareActions(
+            table, startIndex, stopIndex, numReps, repDuration
+        )
 
         events.publish(
             events.UPDATE_STATUS_LIGHT,
             "device waiting",
             "Waiting for DSP to finish",
         )
-        self.connection.PrepareActions(actions, numReps)
         events.executeAndWaitFor(
             events.EXECUTOR_DONE % self.name, self.connection.RunActions
         )
         events.publish(events.EXPERIMENT_EXECUTION)
         return
 
+    ## Send the entries of a CompiledTable from startIndex up to stopIndex
+    # to the remote, ready to run numReps times.
+    def _prepareActions(
+        self, table, startIndex, stopIndex, numReps, repDuration
+    ):
+        actions = self._adaptActions(table, startIndex, stopIndex, repDuration)
+        self.connection.PrepareActions(actions, numReps)
+
+    ## Convert the entries of a CompiledTable from startIndex up to
+    # stopIndex into the actions for our connection's PrepareActions.
+    def _adaptActions(self, table, startIndex, stopIndex, repDuration):
+        return actions_from_table(table, startIndex, stopIndex, repDuration)
+
         ## Debugging function: set the digital output for the DSP.
 
     def setDigital(self, value):
@@ -294,6 +312,7 @@ class LegacyDSP(ExecutorDevice):
             },
             dlines=16,
             alines=4,
+            supportsRepeats=True,
         )
 
         result.append(h)
@@ -321,96 +340,81 @@ class LegacyDSP(ExecutorDevice):
         #  - separate analogue and digital events into different lists;
         #  - generate a structure that describes the profile.
 
-        actions = actions_from_table(table, startIndex, stopIndex, repDuration)
-
-        # Profiles
-        analogs = [
-            [],
-            [],
-            [],
-            [],
-        ]  # A list of lists (one per channel) of tuples (ticks, (analog values))
-        digitals = []  # A list of tuples (ticks, digital state)
-        # Need to track time of last analog events to workaround a
-        # DSP bug later. Also used to detect when events exceed timing
-        # resolution
-        tLastA = None
+        times, digital, analog = arrays_from_table(
+            table, startIndex, stopIndex, repDuration
+        )
 
         # The DSP executes an analogue movement profile, which is defined using
         # offsets relative to a baseline at the time the profile was initialized.
         # These offsets are encoded as unsigned integers, so at profile
         # intialization, each analogue channel must be at or below the lowest
         # value it needs to reach in the profile.
-        lowestAnalogs = list(np.amin([x[1][1] for x in actions], axis=0))
+        lowestAnalogs = list(np.amin(analog, axis=0))
         for line, lowest in enumerate(lowestAnalogs):
             if lowest < self._lastAnalogs[line]:
                 self._lastAnalogs[line] = lowest
                 self.setAnalog(line, lowest)
 
-        for t, (darg, aargs) in actions:
-            # Convert t to ticks as int while rounding up. The rounding is
-            # necessary, otherwise e.g. 10.1 and 10.1999999... both result in 101.
-            ticks = int(float(t) * self.tickrate + 0.5)
-
-            # Digital actions - one at every time point.
-            if len(digitals) == 0:
-                digitals.append((ticks, darg))
-            elif ticks == digitals[-1][0]:
-                # Used to check for conflicts here, but that's not so trivial.
-                # We need to allow several bits to change at the same time point, but
-                # they may show up as multiple events in the actionTable. For now, just
-                # take the most recent state.
-                if darg != digitals[-1][1]:
-                    digitals[-1] = (ticks, darg)
-                else:
-                    pass
-            else:
-                digitals.append((ticks, darg))
-
-            # Analogue actions - only enter into profile on change.
-            # DSP uses offsets from value when the profile was loaded.
-            offsets = map(
-                lambda base, new: new - base, self._lastAnalogs, aargs
-            )
-            for offset, a in zip(offsets, analogs):
-                if (len(a) == 0) or (len(a) > 0 and offset != a[-1][1]):
-                    a.append((ticks, offset))
-                    tLastA = t
+        # The DSP keeps the last profile we downloaded, so if this one is the
+        # same, e.g. at the next site of a multi-site experiment, there is no
+        # need to make and download it again.
+        profileKey = (
+            table.key,
+            startIndex,
+            stopIndex,
+            repDuration,
+            tuple(self._lastAnalogs),
+        )
+        if table.key is None or profileKey != self._loadedProfileKey:
+            self._loadedProfileKey = None
+            self._loadProfile(times, digital, analog)
+            self._loadedProfileKey = profileKey
+
+        events.publish(
+            events.UPDATE_STATUS_LIGHT,
+            "device waiting",
+            "Waiting for DSP to finish",
+        )
+        self.connection.InitProfile(numReps)
+        events.executeAndWaitFor(
+            events.EXECUTOR_DONE % self.name, self.connection.trigCollect
+        )
+        events.publish(events.EXPERIMENT_EXECUTION)
+
+    ## Make a profile from the times and states of our lines, and download
+    # it to the DSP.
+    def _loadProfile(self, times, digital, analog):
+        # Convert t to ticks as int while rounding up. The rounding is
+        # necessary, otherwise e.g. 10.1 and 10.1999999... both result in 101.
+        ticks = np.floor(times * self.tickrate + 0.5).astype(np.int64)
+
+        # DSP uses offsets from value when the profile was loaded.
+        digitals, analogs = profile_from_arrays(
+            ticks, digital, analog - np.array(self._lastAnalogs)
+        )
 
         # Work around some DSP bugs:
         # * The action table needs at least two events to execute correctly.
         # * Last action must be digital --- if the last analog action is at the same
         #   time or after the last digital action, it will not be performed.
         # Both can be avoided by adding a digital action that does nothing.
-        if len(digitals) == 1 or tLastA >= digitals[-1][0]:
+        lastAnalogTicks = max(a[-1, 0] for a in analogs)
+        if len(digitals) == 1 or lastAnalogTicks >= digitals[-1, 0]:
             # Just duplicate the last digital action, one tick later.
-            digitals.append((digitals[-1][0] + 1, digitals[-1][1]))
+            digitals = np.append(
+                digitals, [[digitals[-1, 0] + 1, digitals[-1, 1]]], axis=0
+            )
 
         # Update records of last positions.
-        self._lastDigital = digitals[-1][1]
-        self._lastAnalogs = list(
-            map(lambda x, y: x - (y[-1:][1:] or 0), self._lastAnalogs, analogs)
-        )
+        self._lastDigital = int(digitals[-1, 1])
 
-        events.publish(
-            events.UPDATE_STATUS_LIGHT,
-            "device waiting",
-            "Waiting for DSP to finish",
-        )
         # Convert digitals to array of uints.
-        digitalsArr = np.array(digitals, dtype=np.uint32).reshape(-1, 2)
+        digitalsArr = digitals.astype(np.uint32)
         # Convert analogs to array of uints.
-        analogsArr = [
-            np.array(a, dtype=np.uint32).reshape(-1, 2) for a in analogs
-        ]
+        analogsArr = [a.astype(np.uint32) for a in analogs]
 
         # Create a description dict. Will be byte-packed by server-side code.
-        maxticks = max(
-            chain(
-                [d[0] for d in digitals],
-                [a[0] for a in chain.from_iterable(analogs)],
-            )
-        )
+        maxticks = max(int(a[-1, 0]) for a in [digitalsArr] + analogsArr)
         description = {}
         description["count"] = maxticks
         description["clock"] = 1000.0 / float(self.tickrate)
@@ -422,27 +426,46 @@ class LegacyDSP(ExecutorDevice):
 
         self.connection.profileSet(description, digitalsArr, *analogsArr)
         self.connection.DownloadProfile()
-        self.connection.InitProfile(numReps)
-        events.executeAndWaitFor(
-            events.EXECUTOR_DONE % self.name, self.connection.trigCollect
-        )
-        events.publish(events.EXPERIMENT_EXECUTION)
 
 
-def actions_from_table(table, startIndex, stopIndex, repDuration):
-    ## Take time and arguments (i.e. omit handler) from table to
-    ## generate actions.
-    t0 = float(table[startIndex][0])
-    actions = [
-        (float(row[0]) - t0,) + tuple(row[1:])
-        for row in table[startIndex:stopIndex]
-    ]
-
-    ## If there are repeats, add an extra action to wait until
+def arrays_from_table(table, startIndex, stopIndex, repDuration):
+    ## Take the times and states of the entries of a CompiledTable, with
+    ## times in ms from the first entry.
+    times = table.times[startIndex:stopIndex]
+    times = times - times[0]
+    digital = table.digital[startIndex:stopIndex]
+    analog = table.analog[startIndex:stopIndex]
+
+    ## If there are repeats, add an extra entry to wait until
     ## repDuration expired.
     if repDuration is not None:
         repDuration = float(repDuration)
-        if actions[-1][0] < repDuration:
-            ## Repeat the last event at t0 + repDuration
-            actions.append((t0 + repDuration,) + tuple(actions[-1][1:]))
-    return actions
+        if times[-1] < repDuration:
+            ## Repeat the last state at repDuration
+            times = np.append(times, repDuration)
+            digital = np.append(digital, digital[-1:])
+            analog = np.append(analog, analog[-1:], axis=0)
+    return times, digital, analog
+
+
+def actions_from_table(table, startIndex, stopIndex, repDuration):
+    ## Generate a list of (time, (digital state, analog states)) actions
+    ## from a CompiledTable, as executors take them.
+    times, digital, analog = arrays_from_table(
+        table, startIndex, stopIndex, repDuration
+    )
+    return list(zip(times.tolist(), zip(digital.tolist(), analog.tolist())))
+
+
+def profile_from_arrays(ticks, digital, analog):
+    ## Make the (ticks, state) arrays of a profile, from the entries at
+    ## the given ticks.  Digital lines are set once per tick, to the last
+    ## state at that tick.  Each analogue line gets its own array, with
+    ## only the entries where it changes.
+    isLastAtTick = np.append(ticks[1:] != ticks[:-1], True)
+    digitals = np.stack([ticks[isLastAtTick], digital[isLastAtTick]], axis=1)
+    analogs = []
+    for values in analog.T:
+        isChange = np.append(True, values[1:] != values[:-1])
+        analogs.append(np.stack([ticks[isChange], values[isChange]], axis=1))
+    return digitals, analogs
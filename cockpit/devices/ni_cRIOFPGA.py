@@ -53,13 +53,14 @@ receiveport = 6666
 tickrate = 100
 dLines = 24
 aLines = 4
+binaryUpload = no
 """
 
 import json
+import select
 import socket
 import threading
 import time
-from itertools import chain
 from time import sleep
 
 import numpy as np
@@ -80,7 +81,12 @@ FPGA_ABORTED_STATE = 4
 FPGA_HEARTBEAT_RATE = (
     0.1  # At which rate is the FPGA sending update status signals
 )
+# Seconds to wait for the FPGA to be idle on top of how long the loaded
+# profile takes to run.
+FPGA_IDLE_TIMEOUT_MARGIN = 10
 FPGA_HEARTBEAT_MAX_MSG_LEN = 2048
+# Maximum number of 64 bit words sent at a time in binary table uploads.
+TABLE_UPLOAD_CHUNK_WORDS = 8192
 MASTER_IP = "10.6.19.11"
 
 
@@ -92,6 +98,7 @@ class NIcRIO(executorDevices.ExecutorDevice):
         "tickrate": int,
         "alines": int,
         "dlines": int,
+        "binaryupload": lambda value: value.lower() in ["1", "true", "yes"],
     }
 
     def __init__(self, name, config):
@@ -118,6 +125,7 @@ class NIcRIO(executorDevices.ExecutorDevice):
             ipAddress=self.ipAddress,
             port=self.port,
             localIp=MASTER_IP,
+            binaryUpload=self.config.get("binaryupload", False),
         )
         self.connection.connect()
         self.connection.Abort()
@@ -160,72 +168,51 @@ class NIcRIO(executorDevices.ExecutorDevice):
     def takeImage(self):
         pass
 
-    def _adaptActions(self, actions):
+    def _prepareActions(
+        self, table, startIndex, stopIndex, numReps, repDuration
+    ):
+        """Send the tables to the cRIO, unless it already has them.
+
+        The cRIO keeps the last tables we sent, so if they are the same,
+        e.g. at the next site of a multi-site experiment, we only need to
+        set the number of repetitions.
+        """
+        profileKey = (table.key, startIndex, stopIndex, repDuration)
+        if table.key is not None and profileKey == self._loadedProfileKey:
+            self.connection.initProfile(numReps=numReps, repDuration=0)
+            return
+        self._loadedProfileKey = None
+        actions = self._adaptActions(table, startIndex, stopIndex, repDuration)
+        self.connection.PrepareActions(actions, numReps)
+        self._loadedProfileKey = profileKey
+
+    def _adaptActions(self, table, startIndex, stopIndex, repDuration):
         """Adapt tha actions table to the cRIO. We have to:
         - convert float in ms to integer clock ticks
         - separate analogue and digital events into different lists
         - generate a structure that describes the profile
         """
-        # Profiles
-        analogs = [
-            [] for x in range(self._alines)
-        ]  # A list of lists (one per channel) of tuples (ticks, (analog values))
-        digitals = list()  # A list of tuples (ticks, digital state)
-        # # Need to track time of last analog events
-        # t_last_analog = None
-
-        for t, (digital_args, analog_args) in actions:
-            # Convert t to ticks as int while rounding up. The rounding is
-            # necessary, otherwise e.g. 10.1 and 10.1999999... both result in 101.
-            ticks = int(float(t) * self.tickrate + 0.5)
-
-            # Digital actions - one at every time point.
-            if len(digitals) == 0:
-                digitals.append((ticks, digital_args))
-            elif (
-                ticks == digitals[-1][0]
-            ):  # TODO: verify if we need this for the FPGA
-                # Used to check for conflicts here, but that's not so trivial.
-                # We need to allow several bits to change at the same time point, but
-                # they may show up as multiple events in the actionTable. For now, just
-                # take the most recent state.
-                if digital_args != digitals[-1][1]:
-                    digitals[-1] = (ticks, digital_args)
-                else:
-                    pass
-            else:
-                digitals.append((ticks, digital_args))
-
-            # Analogue actions - only enter into profile on change.
-            # NI-cRIO uses absolute values.
-            for analog, analog_arg in zip(analogs, analog_args):
-                if len(analog) == 0:  # analogs list is empty
-                    analog.append((ticks, analog_arg))
-                elif analog[-1][1] != analog_arg:
-                    analog.append((ticks, analog_arg))
-                else:
-                    pass
+        times, digital, analog = executorDevices.arrays_from_table(
+            table, startIndex, stopIndex, repDuration
+        )
+        # Convert t to ticks as int while rounding up. The rounding is
+        # necessary, otherwise e.g. 10.1 and 10.1999999... both result in 101.
+        ticks = np.floor(times * self.tickrate + 0.5).astype(np.int64)
+        # NI-cRIO uses absolute analogue values.
+        digitals, analogs = executorDevices.profile_from_arrays(
+            ticks, digital, analog
+        )
 
         # Update records of last positions.
-        self._lastDigital = digitals[-1][1]
-        self._lastAnalogs = map(
-            lambda x, y: x - (y[-1:][1:] or 0), self._lastAnalogs, analogs
-        )
+        self._lastDigital = int(digitals[-1, 1])
 
         # Convert digitals to array of uints.
-        digitalsArr = np.array(digitals, dtype=np.uint32).reshape(-1, 2)
+        digitalsArr = digitals.astype(np.uint32)
         # Convert analogs to array of uints.
-        analogsArr = [
-            np.array(a, dtype=np.uint32).reshape(-1, 2) for a in analogs
-        ]
+        analogsArr = [a.astype(np.uint32) for a in analogs]
 
         # Create a description dict. Will be byte-packed by server-side code.
-        maxticks = max(
-            chain(
-                [d[0] for d in digitals],
-                [a[0] for a in chain.from_iterable(analogs)],
-            )
-        )
+        maxticks = max(int(a[-1, 0]) for a in [digitalsArr] + analogsArr)
 
         description = {
             "count": maxticks,
@@ -274,13 +261,16 @@ class NIcRIO(executorDevices.ExecutorDevice):
 class Connection:
     """This class handles the connection with NI's RT-ipAddress computer."""
 
-    def __init__(self, parent, ipAddress, port, localIp):
+    def __init__(self, parent, ipAddress, port, localIp, binaryUpload=False):
         self.parent = parent
         self.ipAddress = ipAddress
         self.port = port
         # Local IP address to use for communication, in the event that this
         # computer has multiple networks to choose from.
         self.localIp = localIp
+        # Whether the RT-ipAddress takes tables as raw binary, instead of
+        # as decimal strings.
+        self.binaryUpload = binaryUpload
         # ## Function to call when we get something from the camera.
         # self.callback = None
         self.connection = None
@@ -293,7 +283,9 @@ class Connection:
         # FPGA is idle.
         self.commandDict = {
             "sendDigitals": 100,
+            "sendDigitalsBinary": 150,
             "sendAnalogues": 200,
+            "sendAnaloguesBinary": 250,
             "abort": 301,
             "reInit": 302,
             "reInitHost": 303,
@@ -314,6 +306,11 @@ class Connection:
             "3": "Send error",
         }
         self.status = None
+        # Seconds that one repetition of the loaded profile takes, and
+        # how many repetitions it was initialised for, to know how long
+        # to wait for it to finish.
+        self.profileDuration = 0
+        self.profileReps = 1
 
     def receiveClient(self, URI):
         pass
@@ -332,6 +329,9 @@ class Connection:
         return self.connection is not None
 
     def disconnect(self):
+        if self.status is not None:
+            self.status.stop()
+            self.status = None
         if self.connection is not None:
             try:
                 self.connection.close()
@@ -424,14 +424,67 @@ class Connection:
             print("Receiving error.\n", msg)
         return
 
+    def runBinaryCommand(
+        self, command, words, chunkWords=TABLE_UPLOAD_CHUNK_WORDS
+    ):
+        """Send the RT-ipAddress a command with an array of 64 bit words.
+
+        The command is sent as a Json message, as with runCommand, but
+        with a "Chunk Length" and followed by the words as raw
+        little-endian bytes, in chunks of up to chunkWords words.  The
+        RT-ipAddress acknowledges each chunk with an error cluster before
+        the next is sent, so that an upload stops at the first error.
+        """
+        data = np.ascontiguousarray(words, dtype="<u8")
+        messageCluster = {
+            "Command": command,
+            "Message Length": data.itemsize,
+            "Number of Messages": len(data),
+            "Chunk Length": chunkWords,
+        }
+        self.connection.sendall(json.dumps(messageCluster).encode() + b"\r\n")
+        for start in range(0, len(data), chunkWords):
+            self.connection.sendall(data[start : start + chunkWords].tobytes())
+            try:
+                error = json.loads(self.connection.recv(1024))
+            except (socket.error, ValueError) as e:
+                raise RuntimeError(
+                    "No acknowledgement from the FPGA for command %d: %s"
+                    % (command, e)
+                )
+            if error["status"]:
+                raise RuntimeError(
+                    "There has been an FPGA error in command %d: %s"
+                    % (command, error)
+                )
+
     def writeParameter(self, parameter, value):
         """Writes parameter value to RT-ipAddress"""
         pass
 
-    def waitForIdle(self):
-        """Waits for the Idle status of the FPGA"""
-        while self.status.getStatus("FPGA Main State") != FPGA_IDLE_STATE:
-            time.sleep(0.1)
+    def waitForIdle(self, timeout=None):
+        """Waits for the Idle status of the FPGA
+
+        timeout -- seconds to wait for.  If None, wait for as long as
+        the loaded profile takes to run, plus FPGA_IDLE_TIMEOUT_MARGIN,
+        so that we do not wait forever if the RT host stops sending
+        its status.
+
+        Raises TimeoutError if the FPGA is not idle by then.
+        """
+        if timeout is None:
+            timeout = (
+                self.profileDuration * self.profileReps
+                + FPGA_IDLE_TIMEOUT_MARGIN
+            )
+        if not self.status.waitForStatus(
+            lambda status: status.get("FPGA Main State") == FPGA_IDLE_STATE,
+            timeout,
+        ):
+            raise TimeoutError(
+                "FPGA not idle after %.1f s; last status: %s"
+                % (timeout, self.status.getStatus())
+            )
 
     def Abort(self):
         """Sends abort experiment command to FPGA"""
@@ -475,39 +528,29 @@ class Connection:
         (0), (0,1), (0,1,2) or (0,1,2,3). If a table is missing a dummy table must be introduced
         msgLength is an int indicating the length of every digital table element as a decimal string
         """
-        # Convert the digitals numpy table into a list of messages for the TCP
-        digitalsList = list()
-
-        for (
-            t,
-            value,
-        ) in digitalsTable:  # TODO: Change this into a more efficient code
-            digitalsValue = int(
-                np.binary_repr(t, 32) + np.binary_repr(value, 32), 2
-            )
-            digitalsList.append(digitalsValue)
-
         # Send digitals after flushing the FPGA FIFOs
         self.runCommand(self.commandDict["flushFIFOs"])
-        self.runCommand(
-            self.commandDict["sendDigitals"], digitalsList, msgLength
-        )
+        self.sendTable("Digitals", 0, digitalsTable, msgLength)
 
         # Send Analogues
-        analogueChannel = 0
-        for analogueTable in analogueTables:
-            # Convert the analogues numpy table into a list of messages for the TCP
-            analogueList = list()
-
-            for t, value in analogueTable:  # TODO: optimize this
-                analogueValue = int(
-                    np.binary_repr(t, 32) + np.binary_repr(value, 32), 2
-                )
-                analogueList.append(analogueValue)
+        for analogueChannel, analogueTable in enumerate(analogueTables):
+            self.sendTable(
+                "Analogues", analogueChannel, analogueTable, msgLength
+            )
+
+    def sendTable(self, kind, channel, table, msgLength=20):
+        """Sends a digitals or analogues table of (ticks, value) rows.
 
-            command = int(self.commandDict["sendAnalogues"]) + analogueChannel
-            self.runCommand(command, analogueList, msgLength)
-            analogueChannel = analogueChannel + 1
+        kind is "Digitals" or "Analogues", and channel the analogue
+        channel, which is added to the command.
+        """
+        words = packTable(table)
+        if self.binaryUpload:
+            command = self.commandDict["send%sBinary" % kind] + channel
+            self.runBinaryCommand(command, words)
+        else:
+            command = self.commandDict["send%s" % kind] + channel
+            self.runCommand(command, words.tolist(), msgLength)
 
     def writeIndexes(
         self,
@@ -560,6 +603,10 @@ class Connection:
         It does not trigger the execution"""
         # We upload the tables to the cRIO
         self.sendTables(digitalsTable=actions[1], analogueTables=actions[2])
+        description = actions[0]
+        self.profileDuration = (
+            description["count"] * description["clock"] / 1000
+        )
 
         # Now we can send the Indexes.
         # The indexes will tell the FPGA where the table starts and ends.
@@ -677,6 +724,7 @@ class Connection:
         self.runCommand(
             self.commandDict["initProfile"], [numReps, repDuration], msgLength
         )
+        self.profileReps = numReps
 
     def getframedata(self):
         """Get the current frame"""
@@ -700,15 +748,37 @@ class Connection:
         self.runCommand(self.commandDict["runSequence"], sendList, msgLength)
 
 
+def packTable(table):
+    """Pack (ticks, value) rows into the FPGA's 64 bit table words.
+
+    The ticks go in the upper 32 bits and the value in the lower ones.
+    """
+    table = np.asarray(table, dtype=np.uint64).reshape(-1, 2)
+    return (table[:, 0] << np.uint64(32)) | (
+        table[:, 1] & np.uint64(0xFFFFFFFF)
+    )
+
+
 class FPGAStatus(threading.Thread):
+    """Thread that listens to the status datagrams of the RT-ipAddress.
+
+    The RT-ipAddress broadcasts its status every FPGA_HEARTBEAT_RATE
+    seconds and as soon as something happens, e.g. at the end of an
+    experiment.  This thread waits on the socket with select, so that
+    each datagram is handled the moment that it arrives, and still
+    wakes up regularly to check whether it should stop.
+    """
+
     def __init__(self, parent, host, port):
-        threading.Thread.__init__(self)
+        threading.Thread.__init__(self, daemon=True)
         self.parent = parent
         self.host = host
         self.port = port
         # Create a dictionary to store the FPGA status and a lock to access it
         self.currentFPGAStatus = {}
         self.FPGAStatusLock = threading.Lock()
+        # Notified every time that the status is updated.
+        self.statusUpdated = threading.Condition(self.FPGAStatusLock)
 
         # Create a socket
         self.socket = None
@@ -723,6 +793,8 @@ class FPGAStatus(threading.Thread):
 
         returns the bound socket
         """
+        if self.socket is not None:
+            self.socket.close()
         try:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         except socket.error as msg:
@@ -735,23 +807,42 @@ class FPGAStatus(threading.Thread):
 
     def getStatus(self, key=None):
         """Method to call from outside to get the status"""
-        if key and self.currentFPGAStatus is not None:
-            try:
-                return self.currentFPGAStatus[key]
-            except KeyError as e:
-                print(e)
-        else:
-            with self.FPGAStatusLock:
+        with self.FPGAStatusLock:
+            if key:
+                try:
+                    return self.currentFPGAStatus[key]
+                except KeyError as e:
+                    print(e)
+            else:
                 return self.currentFPGAStatus
 
+    def waitForStatus(self, predicate, timeout=None):
+        """Wait until predicate is true of the current status.
+
+        predicate is called with the status dictionary every time that
+        it is updated.  Returns whether it became true before timeout.
+        """
+        with self.statusUpdated:
+            return self.statusUpdated.wait_for(
+                lambda: predicate(self.currentFPGAStatus), timeout
+            )
+
     def getFPGAStatus(self):
-        """This method polls to a UDP socket and get the status information
-        of the RT-ipAddress and FPGA.
+        """This method receives a datagram from the UDP socket and parses
+        the status information of the RT-ipAddress and FPGA.
 
-        It will update the FPGAStatus dictionary.
+        Returns None if there is no valid status.
         """
         try:
             datagram = self.socket.recvfrom(FPGA_HEARTBEAT_MAX_MSG_LEN)[0]
+        except socket.error as e:
+            print("Could not receive status datagram: ", e)
+            return None
+        return self.parseFPGAStatus(datagram)
+
+    def parseFPGAStatus(self, datagram):
+        """Parses a status datagram into a dictionary, or None if invalid."""
+        try:
             status = json.loads(datagram)
         except json.JSONDecodeError as e:
             print("Could not serialize status datagram: ", datagram)
@@ -773,19 +864,32 @@ class FPGAStatus(threading.Thread):
 
         return the newStatus but with the status reset so not to publish multiple times
         """
-        if newStatus["Event"] in ["done", "FPGA done"]:
+        if newStatus.get("Event") in ["done", "FPGA done"]:
             self.parent.parent.experimentDone()
             newStatus["Event"] = ""
 
         return newStatus
 
+    def updateFPGAStatus(self, newStatus):
+        """Publish any interesting events and store the new status."""
+        # Events are published first, so that the end of an experiment
+        # does not wait on anyone reading the status.
+        newStatus = self.publishFPGAStatusChanges(newStatus)
+        with self.statusUpdated:
+            self.currentFPGAStatus = newStatus
+            self.statusUpdated.notify_all()
+
+    def stop(self):
+        """Stop the thread and close the socket."""
+        self.shouldRun = False
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
+        self.socket.close()
+
     def run(self):
-        self.currentFPGAStatus = self.getFPGAStatus()
-        update_rate = FPGA_HEARTBEAT_RATE / 2
         retries = 0
 
         while self.shouldRun:
-            newFPGAStatus = self.getFPGAStatus()
             if retries > 300:
                 # retrying to establish connection
                 try:
@@ -795,22 +899,18 @@ class FPGAStatus(threading.Thread):
                         f"The status UDP connection to the Executor is lost after {retries} retries"
                     )
                     raise e
+                retries = 0
+
+            # Wake up every heartbeat to check if we should stop.
+            readable = select.select(
+                [self.socket], [], [], FPGA_HEARTBEAT_RATE
+            )[0]
+            if not readable:
+                continue
 
+            newFPGAStatus = self.getFPGAStatus()
             if newFPGAStatus is None:
                 retries += 1
                 continue
-            # with self.FPGAStatusLock:
-            if (
-                newFPGAStatus["Event"] != self.currentFPGAStatus["Event"]
-                and newFPGAStatus["Event"] == "done"
-                and newFPGAStatus is not None
-            ):
-                # Publish any interesting events
-                self.currentFPGAStatus = self.publishFPGAStatusChanges(
-                    newStatus=newFPGAStatus
-                )
-            else:
-                self.currentFPGAStatus = newFPGAStatus
-
-            # wait for a period of half the broadcasting rate of the FPGA
-            time.sleep(update_rate)
+            retries = 0
+            self.updateFPGAStatus(newFPGAStatus)
@@ -45,6 +45,26 @@ For example::
     # camera handler and whether it has been enabled or disabled.
     events.publish(events.CAMERA_ENABLE, camera_handler, is_enabled)
 
+Subscribers are called in the thread that publishes the event, which
+waits for them all to return.  A slow subscriber to a frequent event,
+such as ``NEW_IMAGE``, would hold up whoever publishes it.  Such a
+subscriber can instead be subscribed asynchronously, with a bounded
+queue of events and its own thread to call it from::
+
+    # Only display the newest image, skipping any that arrive while
+    # the previous one is still being drawn.
+    events.subscribe(
+        events.NEW_IMAGE % camera.name,
+        obj.on_image,
+        queue_size=1,
+        overflow=events.OVERFLOW_LATEST_ONLY,
+    )
+
+To find which subscribers take the time, :func:`start_profiling`
+counts the events published and times each subscriber, until
+:func:`stop_profiling`.  There is also a "Profile events" item on the
+Windows menu to do this.
+
 Beware
 ======
 
@@ -120,6 +140,10 @@ the system expects.
 
 ``UPDATE_STATUS_LIGHT``
 
+``SAVE_STATUS``
+    Statistics on saving the images of the running experiment, as a
+    dict.  See :class:`cockpit.experiment.dataSaver.SaveTelemetry`.
+
 ``USER_ABORT``
     The user clicked on the "Abort" button.
 
@@ -169,9 +193,12 @@ the system expects.
 
 """
 
+import bisect
 import collections
+import logging
 import sys
 import threading
+import time
 import traceback
 import typing
 
@@ -183,6 +210,7 @@ DEVICE_STATUS = "device status"
 EXPERIMENT_EXECUTION = "experiment execution"
 EXPERIMENT_COMPLETE = "experiment complete"
 UPDATE_STATUS_LIGHT = "update status light"
+SAVE_STATUS = "save status"
 PREPARE_FOR_EXPERIMENT = "prepare for experiment"
 CLEANUP_AFTER_EXPERIMENT = "cleanup after experiment"
 LIGHT_SOURCE_ENABLE = "light source enable"
@@ -217,43 +245,306 @@ DIO_OUTPUT = "DIO output"
 DIO_INPUT = "DIO input"
 VALUELOGGER_INPUT = "ValueLogger input"
 
+_logger = logging.getLogger(__name__)
+
+
 _Subscriber = typing.Callable[..., None]
 
 
+# Overflow policies of asynchronous subscriptions, what to do when an
+# event is published and the subscriber's queue is full.
+
+## Discard the oldest queued event to make room for the new one.
+OVERFLOW_DROP_OLDEST = "drop oldest"
+## Only keep the newest event, i.e. a queue of size one.
+OVERFLOW_LATEST_ONLY = "latest only"
+## Block the publisher until there is room.
+OVERFLOW_BLOCK = "block"
+
+
+def _call_subscriber(func: _Subscriber, args, kwargs) -> None:
+    try:
+        func(*args, **kwargs)
+    except:
+        sys.stderr.write(
+            "Error in subscribed callable %s.%s().  %s"
+            % (func.__module__, func.__name__, traceback.format_exc())
+        )
+
+
+class _AsyncSubscriber:
+    """Calls a subscriber from its own thread, through a bounded queue.
+
+    Calling an instance queues the arguments for the subscriber and
+    returns straight away, unless the queue is full and the overflow
+    policy is to block.
+    """
+
+    def __init__(self, func: _Subscriber, queue_size: int, overflow: str):
+        if overflow == OVERFLOW_LATEST_ONLY:
+            queue_size = 1
+        elif overflow not in (OVERFLOW_DROP_OLDEST, OVERFLOW_BLOCK):
+            raise ValueError("unknown overflow policy '%s'" % overflow)
+        if queue_size < 1:
+            raise ValueError("queue size must be at least 1")
+        self.func = func
+        self.queue_size = queue_size
+        self.overflow = overflow
+        ## Number of events discarded because the queue was full.
+        self.num_dropped = 0
+        self._queue = collections.deque()
+        self._condition = threading.Condition(threading.Lock())
+        self._running = True
+        self._thread = threading.Thread(
+            target=self._run,
+            name="event subscriber %s" % getattr(func, "__name__", func),
+            daemon=True,
+        )
+        self._thread.start()
+
+    def __call__(self, *args, **kwargs) -> None:
+        with self._condition:
+            if len(self._queue) >= self.queue_size:
+                # Blocking the subscriber's own thread, e.g. if it
+                # publishes the event it subscribes to, would never
+                # end, so drop instead.
+                if (
+                    self.overflow == OVERFLOW_BLOCK
+                    and threading.current_thread() is not self._thread
+                ):
+                    self._condition.wait_for(
+                        lambda: len(self._queue) < self.queue_size
+                        or not self._running
+                    )
+                else:
+                    self._queue.popleft()
+                    self.num_dropped += 1
+            if self._running:
+                self._queue.append((args, kwargs))
+                self._condition.notify_all()
+
+    def __eq__(self, other) -> bool:
+        # So that unsubscribe finds it from the subscribed callable.
+        if isinstance(other, _AsyncSubscriber):
+            return self is other
+        return self.func == other
+
+    def __hash__(self) -> int:
+        return hash(self.func)
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                self._condition.wait_for(
+                    lambda: self._queue or not self._running
+                )
+                if not self._running:
+                    return
+                args, kwargs = self._queue.popleft()
+                self._condition.notify_all()
+            _call_subscriber(self.func, args, kwargs)
+
+    def stop(self) -> None:
+        """Discard any queued events and stop the thread."""
+        with self._condition:
+            self._running = False
+            self._queue.clear()
+            self._condition.notify_all()
+
+
+## Upper edges, in seconds, of the bins of the histogram of how long
+# subscribers take.  The last bin counts anything slower.
+PROFILE_BIN_EDGES = (
+    0.00001,
+    0.0001,
+    0.001,
+    0.01,
+    0.1,
+    1.0,
+)
+
+
+def _subscriber_name(func: _Subscriber) -> str:
+    func = getattr(func, "func", func)  # asynchronous subscribers
+    name = getattr(func, "__qualname__", None) or repr(func)
+    return "%s.%s" % (getattr(func, "__module__", "?"), name)
+
+
+class Profiler:
+    """Counts publications and times the subscribers of each event.
+
+    While a profiler is set on a :class:`Publisher`, every publication
+    is counted, and every call of a subscriber is timed and counted in
+    a histogram with the bins of :const:`PROFILE_BIN_EDGES`.  Calls
+    slower than `slow_threshold` seconds are logged as warnings.  For
+    asynchronous subscribers, it is the time to queue the event that
+    is measured, which is what the publisher waits for.
+    """
+
+    def __init__(self, slow_threshold: float = 0.1) -> None:
+        self.slow_threshold = slow_threshold
+        self.start_time = time.time()
+        self._lock = threading.Lock()
+        self._publish_counts = collections.Counter()
+        # Maps (event, subscriber name) to [calls, total time, max time,
+        # histogram counts], with times in seconds.
+        self._subscriber_stats = {}
+
+    def call_subscribers(self, event: str, subscribers, args, kwargs) -> None:
+        for func in subscribers:
+            start = time.perf_counter()
+            _call_subscriber(func, args, kwargs)
+            elapsed = time.perf_counter() - start
+            self._record(event, func, elapsed)
+
+    def count_publication(self, event: str) -> None:
+        with self._lock:
+            self._publish_counts[event] += 1
+
+    def _record(self, event: str, func: _Subscriber, elapsed: float) -> None:
+        name = _subscriber_name(func)
+        with self._lock:
+            stats = self._subscriber_stats.get((event, name))
+            if stats is None:
+                stats = [0, 0.0, 0.0, [0] * (len(PROFILE_BIN_EDGES) + 1)]
+                self._subscriber_stats[(event, name)] = stats
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] = max(stats[2], elapsed)
+            stats[3][bisect.bisect_left(PROFILE_BIN_EDGES, elapsed)] += 1
+        if elapsed > self.slow_threshold:
+            _logger.warning(
+                "subscriber %s to '%s' took %.1f ms",
+                name,
+                event,
+                elapsed * 1e3,
+            )
+
+    def snapshot(self) -> typing.Dict[str, typing.Any]:
+        """Return a dict of the statistics so far.
+
+        Subscribers are sorted by the total time spent in them, the top
+        offenders first.
+        """
+        with self._lock:
+            publish_counts = dict(self._publish_counts)
+            subscribers = [
+                {
+                    "event": event,
+                    "subscriber": name,
+                    "calls": calls,
+                    "total": total,
+                    "mean": total / calls,
+                    "max": max_time,
+                    "histogram": list(counts),
+                }
+                for (event, name), [calls, total, max_time, counts] in (
+                    self._subscriber_stats.items()
+                )
+            ]
+        subscribers.sort(key=lambda stats: stats["total"], reverse=True)
+        return {
+            "duration": time.time() - self.start_time,
+            "publish_counts": publish_counts,
+            "bin_edges": PROFILE_BIN_EDGES,
+            "subscribers": subscribers,
+        }
+
+    def format_report(self, num_subscribers: int = 20) -> str:
+        """Return a table of the subscribers that take the most time."""
+        snapshot = self.snapshot()
+        lines = [
+            "Profiled events for %.1f s, %d publications"
+            % (
+                snapshot["duration"],
+                sum(snapshot["publish_counts"].values()),
+            ),
+            "",
+            "%8s %10s %10s %10s  %s"
+            % ("calls", "total ms", "mean ms", "max ms", "event: subscriber"),
+        ]
+        for stats in snapshot["subscribers"][:num_subscribers]:
+            lines.append(
+                "%8d %10.1f %10.3f %10.1f  %s: %s"
+                % (
+                    stats["calls"],
+                    stats["total"] * 1e3,
+                    stats["mean"] * 1e3,
+                    stats["max"] * 1e3,
+                    stats["event"],
+                    stats["subscriber"],
+                )
+            )
+        return "\n".join(lines)
+
+
 class Publisher:
     def __init__(self) -> None:
-        # type: typing.Dict[str, typing.List[_Subscriber]]
-        self._subscriptions = collections.defaultdict(list)
+        # The subscriber lists are tuples, which are replaced and never
+        # modified, so that publishing does not need the lock.
+        self._subscriptions: typing.Dict[
+            str, typing.Tuple[_Subscriber, ...]
+        ] = {}
         self._lock = threading.Lock()
-
-    def subscribe(self, event: str, func: _Subscriber) -> None:
+        ## Profiler to time the subscribers with, or None.
+        self.profiler: typing.Optional[Profiler] = None
+
+    def subscribe(
+        self,
+        event: str,
+        func: _Subscriber,
+        queue_size: typing.Optional[int] = None,
+        overflow: str = OVERFLOW_DROP_OLDEST,
+    ) -> None:
         """Subscribe callable to specified event.
 
+        By default, subscribers are called on the thread that publishes
+        the event, and the publisher waits for them.  If `queue_size`
+        is given, the subscription is asynchronous instead: the event
+        is queued and the subscriber called from its own thread.
+
         Args:
             event: event type/name (global constants in this module.)
             func: function to be called when the named event happens.
+            queue_size: maximum number of events queued for an
+                asynchronous subscriber.
+            overflow: what to do with a new event when the queue is
+                full, one of the ``OVERFLOW_*`` constants in this
+                module.
         """
+        if queue_size is not None:
+            func = _AsyncSubscriber(func, queue_size, overflow)
         with self._lock:
-            self._subscriptions[event].append(func)
+            self._subscriptions[event] = self._subscriptions.get(event, ()) + (
+                func,
+            )
 
     def unsubscribe(self, event: str, func: _Subscriber) -> None:
         """Unsubscribe callable to specified event."""
         with self._lock:
+            subscribers = list(self._subscriptions.get(event, ()))
             try:
-                self._subscriptions[event].remove(func)
+                index = subscribers.index(func)
             except ValueError:
-                pass  # ignore func not in list error
+                return  # ignore func not in list error
+            removed = subscribers.pop(index)
+            if subscribers:
+                self._subscriptions[event] = tuple(subscribers)
+            else:
+                del self._subscriptions[event]
+        if isinstance(removed, _AsyncSubscriber):
+            removed.stop()
 
     def publish(self, event: str, *args, **kwargs):
         """Call all functions subscribed to specific event with given arguments."""
-        for func in self._subscriptions[event]:
-            try:
-                func(*args, **kwargs)
-            except:
-                sys.stderr.write(
-                    "Error in subscribed callable %s.%s().  %s"
-                    % (func.__module__, func.__name__, traceback.format_exc())
-                )
+        subscribers = self._subscriptions.get(event, ())
+        profiler = self.profiler
+        if profiler is None:
+            for func in subscribers:
+                _call_subscriber(func, args, kwargs)
+        else:
+            profiler.count_publication(event)
+            profiler.call_subscribers(event, subscribers, args, kwargs)
 
 
 class OneShotPublisher(Publisher):
@@ -266,20 +557,27 @@ class OneShotPublisher(Publisher):
     """
 
     def publish(self, event: str, *args, **kwargs) -> None:
-        try:
-            super().publish(event, *args, **kwargs)
-        finally:
-            # _subscriptions is a defaultdict but pop will still raise
-            # if key is missing, so we need None as pop's default.
-            self._subscriptions.pop(event, None)
+        # Take the subscribers out before calling them, so that each is
+        # called only once even if the event is published again.
+        with self._lock:
+            subscribers = self._subscriptions.pop(event, ())
+        profiler = self.profiler
+        if profiler is None:
+            for func in subscribers:
+                _call_subscriber(func, args, kwargs)
+        else:
+            profiler.call_subscribers(event, subscribers, args, kwargs)
 
     def clear(self) -> None:
         with self._lock:
-            for subscriptions in self._subscriptions.values():
-                for subscription in subscriptions:
-                    if hasattr(subscription, "__abort__"):
-                        subscription.__abort__()
+            subscriptions = list(self._subscriptions.values())
             self._subscriptions.clear()
+        for subscribers in subscriptions:
+            for subscription in subscribers:
+                if hasattr(subscription, "__abort__"):
+                    subscription.__abort__()
+                elif isinstance(subscription, _AsyncSubscriber):
+                    subscription.stop()
 
 
 # Global singletons
@@ -287,8 +585,13 @@ _publisher = Publisher()
 _one_shot_publisher = OneShotPublisher()
 
 
-def subscribe(event: str, func: _Subscriber) -> None:
-    return _publisher.subscribe(event, func)
+def subscribe(
+    event: str,
+    func: _Subscriber,
+    queue_size: typing.Optional[int] = None,
+    overflow: str = OVERFLOW_DROP_OLDEST,
+) -> None:
+    return _publisher.subscribe(event, func, queue_size, overflow)
 
 
 def unsubscribe(event: str, func: _Subscriber) -> None:
@@ -304,6 +607,22 @@ def oneShotSubscribe(event: str, func: _Subscriber):
     return _one_shot_publisher.subscribe(event, func)
 
 
+def start_profiling(slow_threshold: float = 0.1) -> Profiler:
+    """Start profiling the events published, see :class:`Profiler`."""
+    profiler = Profiler(slow_threshold)
+    _publisher.profiler = profiler
+    _one_shot_publisher.profiler = profiler
+    return profiler
+
+
+def stop_profiling() -> typing.Optional[Profiler]:
+    """Stop profiling the events published, and return the profiler."""
+    profiler = _publisher.profiler
+    _publisher.profiler = None
+    _one_shot_publisher.profiler = None
+    return profiler
+
+
 # Clear one-shot subscribers on abort.  Usually, these were subscribed
 # by executeAndWaitFor, which leaves the calling thread waiting for a
 # lock to be released.  On an abort, that event may never happen.
@@ -52,16 +52,142 @@
 
 import decimal
 
+import numpy
+
+
+## Number of integer ticks per millisecond in which action times are
+# stored, i.e. a tick is a nanosecond.
+TICKS_PER_MS = 10**6
+_DECIMAL_TICKS_PER_MS = decimal.Decimal(TICKS_PER_MS)
+
+
+## Return a time in milliseconds, e.g. a Decimal, as a tuple of the
+# nearest integer number of ticks and the remaining fraction of a tick,
+# as a float between -0.5 and 0.5.
+def timeToTicks(time):
+    if isinstance(time, int):
+        return time * TICKS_PER_MS, 0.0
+    if not isinstance(time, decimal.Decimal):
+        time = decimal.Decimal(time)
+    scaled = time * _DECIMAL_TICKS_PER_MS
+    ticks = scaled.to_integral_value()
+    return int(ticks), float(scaled - ticks)
+
+
+## Move whole ticks from fractions into ticks, so that the fractions
+# are between -0.5 and 0.5.  Both are arrays, modified in place.
+def _carryFractions(ticks, fractions):
+    carry = numpy.round(fractions)
+    ticks += carry.astype(numpy.int64)
+    fractions -= carry
+
+
+## A block of actions repeated several times at a fixed interval, which
+# is added to an ActionTable with addRepeat.  Executors that can repeat
+# actions themselves run the block as is, instead of every repeat of it
+# (see Experiment.examineActions).
+#
+# The block stands in for a handler in the table it is added to, so it
+# has the attributes that device code reads from the handlers of a
+# table, like a DeviceHandler that is not used in experiments.
+class RepeatBlock:
+    ## Device type of all blocks, which no device has.
+    deviceType = "repeat block"
+    groupName = "repeat blocks"
+    isEligibleForExperiments = False
+
+    ## \param table ActionTable with the actions to repeat, with times
+    #        relative to the start of each repeat.
+    # \param count Number of times to perform the actions.
+    # \param interval Time from the start of one repeat to the start of
+    #        the next.
+    def __init__(self, table, count, interval):
+        self.table = table
+        self.count = count
+        self.interval = interval
+        self.name = "%d repeats" % count
+        self.callbacks = {}
+
+    def getIsEligibleForExperiments(self):
+        return self.isEligibleForExperiments
+
+    def getIdentifier(self):
+        return "%s:%s" % (self.deviceType, self.name)
+
+    def __repr__(self):
+        return "<%s named %s in group %s>" % (
+            self.deviceType,
+            self.name,
+            self.groupName,
+        )
+
+    ## Return the time from the start of the first repeat to the last
+    # action of the last one.
+    def getDuration(self):
+        lastTime = self.table.getFirstAndLastActionTimes(False)[1]
+        return (self.count - 1) * self.interval + lastTime
+
+    ## Generate the (time, handler, parameter) actions of every repeat,
+    # with the first repeat starting at startTime.
+    def iterActions(self, startTime):
+        for repeat in range(self.count):
+            offset = startTime + repeat * self.interval
+            for time, handler, parameter in self.table.iterExpanded():
+                yield offset + time, handler, parameter
+
 
 ## This class represents the actions performed during an experiment.
 # Each action has a timestamp and the parameters for the action to be performed.
+#
+# Actions are stored in columns: the time of each action as an integer
+# number of ticks (see TICKS_PER_MS) and the remaining fraction of a
+# tick, the index of its handler in self.handlers, and its parameter.
+# This makes sorting and shifting large tables fast, and lets executors
+# work on whole columns (see getColumns).  The exact time of each
+# action, as it was given, is kept too.  Indexing the table still gives
+# (time, handler, parameter) tuples, with that exact time, and None for
+# deleted actions.
+#
+# A table can also hold RepeatBlocks, as a single action with the block
+# as handler (see addRepeat).
 class ActionTable:
     toggleTime = decimal.Decimal(".1")
 
+    ## Names of the columns, each an array with room for more actions
+    # than are in the table.
+    _columns = (
+        "_times",
+        "_ticks",
+        "_fractions",
+        "_handlerIndices",
+        "_parameters",
+        "_isValid",
+    )
+
     def __init__(self):
-        ## List of (time, handler, parameter) tuples indicating what actions
-        # must be taken at what times.
-        self.actions = []
+        ## Number of actions in the table, including deleted ones.
+        self._length = 0
+        ## Exact times, in milliseconds, usually as Decimals.  Times of
+        # Decimals that do not fall on a tick would not round-trip
+        # through the ticks and fractions.
+        self._times = numpy.full(16, None, object)
+        ## Times in ticks, rounded to the nearest tick, and the fraction
+        # of a tick left over.  Together, they keep times much finer
+        # than a tick, as given by Decimal times, apart.
+        self._ticks = numpy.zeros(16, numpy.int64)
+        self._fractions = numpy.zeros(16, numpy.float64)
+        ## Indices into self.handlers of the handler of each action.
+        self._handlerIndices = numpy.zeros(16, numpy.int32)
+        self._parameters = numpy.empty(16, object)
+        ## False for actions deleted by setting them to None.
+        self._isValid = numpy.zeros(16, bool)
+        ## Handlers used in the table, in order of first use.
+        self.handlers = []
+        ## Maps the ids of handlers to their index in self.handlers.
+        self._handlerIdToIndex = {}
+        ## Maps handler indices to the list of rows with actions for
+        # that handler, in order, or None if it needs rebuilding.
+        self._handlerRows = {}
         ## Time of our first action.
         # \todo How do we handle the removal of actions rendering this invalid?
         # For now, we don't.
@@ -69,9 +195,59 @@ class ActionTable:
         ## Time of our last action.
         self.lastActionTime = None
 
-    ## Insert an element into self.actions.
+    ## List of (time, handler, parameter) tuples indicating what actions
+    # must be taken at what times, or None for deleted actions.  This is
+    # a copy; modify the table by indexing it instead.
+    @property
+    def actions(self):
+        return list(self)
+
+    ## Return the index in self.handlers of a handler, adding it if it
+    # is new.
+    def getHandlerIndex(self, handler):
+        index = self._handlerIdToIndex.get(id(handler))
+        if index is None:
+            index = len(self.handlers)
+            self.handlers.append(handler)
+            self._handlerIdToIndex[id(handler)] = index
+            if self._handlerRows is not None:
+                self._handlerRows[index] = []
+        return index
+
+    ## Make room in the columns for at least numRows actions.
+    def _reserve(self, numRows):
+        capacity = len(self._ticks)
+        if numRows <= capacity:
+            return
+        while capacity < numRows:
+            capacity *= 2
+        for name in self._columns:
+            old = getattr(self, name)
+            if old.dtype == object:
+                new = numpy.full(capacity, None, object)
+            else:
+                new = numpy.zeros(capacity, old.dtype)
+            new[: self._length] = old[: self._length]
+            setattr(self, name, new)
+
+    ## Insert an element into the table.
     def addAction(self, time, handler, parameter):
-        self.actions.append((time, handler, parameter))
+        # This is called for every action of every experiment, so avoid
+        # the overhead of calling the other methods when we can.
+        row = self._length
+        if row == len(self._ticks):
+            self._reserve(row + 1)
+        handlerIndex = self._handlerIdToIndex.get(id(handler))
+        if handlerIndex is None:
+            handlerIndex = self.getHandlerIndex(handler)
+        self._times[row] = time
+        self._ticks[row], self._fractions[row] = timeToTicks(time)
+        self._handlerIndices[row] = handlerIndex
+        self._parameters[row] = parameter
+        self._isValid[row] = True
+        self._length += 1
+        if self._handlerRows is not None:
+            self._handlerRows[handlerIndex].append(row)
         if self.firstActionTime is None or self.firstActionTime > time:
             self.firstActionTime = time
         if self.lastActionTime is None or self.lastActionTime < time:
@@ -84,54 +260,263 @@ class ActionTable:
         time, dt = handler.addToggle(time, self)
         return time
 
+    ## Perform the actions of another table count times, every interval,
+    # starting at the given time.  The other table must not be changed
+    # afterwards, and all its actions must be within the interval, though
+    # the last may be at the same time as the start of the next repeat.
+    # Return the time at which the last repeat is over.
+    def addRepeat(self, time, table, count, interval):
+        firstTime, lastTime = table.getFirstAndLastActionTimes(False)
+        if firstTime is None:
+            raise ValueError("Cannot repeat an empty table")
+        if count < 1:
+            raise ValueError("Cannot repeat a table %d times" % count)
+        if firstTime < 0 or lastTime > interval:
+            raise ValueError(
+                "Repeated actions from %s to %s do not fit in an interval"
+                " of %s" % (firstTime, lastTime, interval)
+            )
+        block = RepeatBlock(table, count, interval)
+        self.addAction(time, block, None)
+        lastTime = time + block.getDuration()
+        if self.lastActionTime < lastTime:
+            self.lastActionTime = lastTime
+        return time + count * interval
+
+    ## Return the RepeatBlocks in the table, in order.
+    def getRepeatBlocks(self):
+        blocks = []
+        for row in numpy.flatnonzero(self._getRepeatMask()):
+            if self._isValid[row]:
+                blocks.append(self.handlers[self._handlerIndices[row]])
+        return blocks
+
+    ## Return a boolean array which is True for RepeatBlock actions.
+    def _getRepeatMask(self):
+        return self.getHandlerMask(
+            [h for h in self.handlers if isinstance(h, RepeatBlock)]
+        )
+
+    ## Generate the (time, handler, parameter) actions in the table, with
+    # those of RepeatBlocks in place of the blocks.  This expands repeats
+    # lazily, without changing the table.
+    # NB assumes the table has been sorted.
+    def iterExpanded(self):
+        for action in self:
+            if action is None:
+                continue
+            time, handler, parameter = action
+            if isinstance(handler, RepeatBlock):
+                yield from handler.iterActions(time)
+            else:
+                yield action
+
+    ## Replace RepeatBlocks with the actions of all their repeats.  If
+    # blocks is given, only replace those.
+    # NB assumes the table has been sorted.
+    def expandRepeats(self, blocks=None):
+        isRepeat = self._getRepeatMask() & self._isValid[: self._length]
+        if blocks is not None:
+            blockIds = {id(block) for block in blocks}
+            for row in numpy.flatnonzero(isRepeat):
+                block = self.handlers[self._handlerIndices[row]]
+                isRepeat[row] = id(block) in blockIds
+        if not numpy.any(isRepeat):
+            return
+        n = self._length
+        pieces = {name: [] for name in self._columns}
+        prevRow = 0
+        for row in numpy.flatnonzero(isRepeat):
+            for name in self._columns:
+                pieces[name].append(getattr(self, name)[prevRow:row])
+            block = self.handlers[self._handlerIndices[row]]
+            expanded = self._expandBlock(block, row)
+            for name, column in zip(self._columns, expanded):
+                pieces[name].append(column)
+            prevRow = row + 1
+        for name in self._columns:
+            pieces[name].append(getattr(self, name)[prevRow:n])
+            setattr(self, name, numpy.concatenate(pieces[name]))
+        self._length = len(self._ticks)
+        self._handlerRows = None
+
+    ## Return the columns of the actions of every repeat of the block at
+    # a row.
+    def _expandBlock(self, block, row):
+        table = block.table
+        table.expandRepeats()
+        table.clearBadEntries()
+        n = len(table)
+        startTime = self._times[row]
+        startTicks, startFraction = self._ticks[row], self._fractions[row]
+        intervalTicks, intervalFraction = timeToTicks(block.interval)
+        repeats = numpy.arange(block.count)[:, numpy.newaxis]
+        offsets = numpy.empty((block.count, 1), object)
+        offsets[:, 0] = [
+            startTime + repeat * block.interval
+            for repeat in range(block.count)
+        ]
+        times = (table._times[:n] + offsets).ravel()
+        ticks = (
+            table._ticks[:n] + startTicks + repeats * intervalTicks
+        ).ravel()
+        fractions = (
+            table._fractions[:n] + startFraction + repeats * intervalFraction
+        ).ravel()
+        _carryFractions(ticks, fractions)
+        handlerMap = numpy.array(
+            [self.getHandlerIndex(h) for h in table.handlers], numpy.int32
+        )
+        handlerIndices = numpy.tile(
+            handlerMap[table._handlerIndices[:n]], block.count
+        )
+        parameters = numpy.tile(table._parameters[:n], block.count)
+        isValid = numpy.ones(n * block.count, bool)
+        return times, ticks, fractions, handlerIndices, parameters, isValid
+
+    ## Return the rows of each handler, rebuilding them if needed.
+    def _getHandlerRows(self):
+        if self._handlerRows is None:
+            handlerIndices = self._handlerIndices[: self._length]
+            order = numpy.argsort(handlerIndices, kind="stable")
+            bounds = numpy.searchsorted(
+                handlerIndices[order], numpy.arange(len(self.handlers) + 1)
+            )
+            self._handlerRows = {
+                i: order[bounds[i] : bounds[i + 1]].tolist()
+                for i in range(len(self.handlers))
+            }
+        return self._handlerRows
+
     ## Retrieve the last time and action we performed with the specified
     # handler.
-    # NB assumes that self.actions has been sorted.
+    # NB assumes that the table has been sorted.
     def getLastActionFor(self, handler):
-        for time, altHandler, parameter in reversed(self.actions):
-            if altHandler is handler:
-                return time, parameter
+        handlerRows = self._getHandlerRows()
+        lastRow = -1
+        handlerIndex = self._handlerIdToIndex.get(id(handler))
+        if handlerIndex is not None:
+            for row in reversed(handlerRows[handlerIndex]):
+                if self._isValid[row]:
+                    lastRow = row
+                    break
+        # Actions in later RepeatBlocks come after that.
+        lastBlockRow = -1
+        for blockIndex, block in enumerate(self.handlers):
+            if isinstance(block, RepeatBlock):
+                for row in reversed(handlerRows[blockIndex]):
+                    if row <= max(lastRow, lastBlockRow):
+                        break
+                    if self._isValid[row] and (
+                        block.table.getLastActionFor(handler)[0] is not None
+                    ):
+                        lastBlockRow = row
+                        break
+        if lastBlockRow > lastRow:
+            block = self.handlers[self._handlerIndices[lastBlockRow]]
+            time, parameter = block.table.getLastActionFor(handler)
+            time += self._getTime(lastBlockRow)
+            return time + (block.count - 1) * block.interval, parameter
+        if lastRow >= 0:
+            return self._getTime(lastRow), self._parameters[lastRow]
         return None, None
 
-    ## Sort all the actions in the table by time.
+    ## Keep only the rows at the given indices, in that order.
+    def _selectRows(self, rows):
+        n = self._length
+        for name in self._columns:
+            column = getattr(self, name)
+            column[: len(rows)] = column[:n][rows]
+            if column.dtype == object:
+                # Drop references to removed times and parameters.
+                column[len(rows) : n] = None
+        self._length = len(rows)
+        self._handlerRows = None
+
+    ## Sort all the actions in the table by time.  The sort is stable,
+    # so simultaneous actions stay in the order they were added.
     # \todo We should remove redundant entries in here (e.g. due to
     # 0 stabilization time for stage movement).
     def sort(self):
-        # First element in each action is the timestamp.
-        self.actions.sort(key=lambda a: a[0])
+        ticks = self._ticks[: self._length]
+        fractions = self._fractions[: self._length]
+        isInOrder = (ticks[:-1] < ticks[1:]) | (
+            (ticks[:-1] == ticks[1:]) & (fractions[:-1] <= fractions[1:])
+        )
+        if numpy.all(isInOrder):
+            # Already sorted, which is common when tables are generated
+            # in order.
+            return
+        self._selectRows(numpy.lexsort((fractions, ticks)))
+
+    ## Keep only the actions for which a boolean array, with an entry
+    # for each action, is True.
+    def filter(self, mask):
+        self._selectRows(numpy.flatnonzero(mask))
+
+    ## Return a boolean array which is True for the actions of any of
+    # the given handlers.
+    def getHandlerMask(self, handlers):
+        indices = [
+            self._handlerIdToIndex[id(h)]
+            for h in handlers
+            if id(h) in self._handlerIdToIndex
+        ]
+        return numpy.isin(self._handlerIndices[: self._length], indices)
 
     ## Clear invalid entries from the list. Sometimes when the table is
     # modified, an entry needs to be deleted without affecting indexing into
     # the list; thus, the user sets it to None and then calls this function
     # afterwards.
     def clearBadEntries(self):
-        pairs = [item for item in enumerate(self.actions)]
-        for i, action in reversed(pairs):
-            if action is None:
-                del self.actions[i]
+        isValid = self._isValid[: self._length]
+        if not numpy.all(isValid):
+            self.filter(isValid)
+
+    ## Add delta, a time in milliseconds, to the times of the actions
+    # selected by rows, a slice or array of indices or booleans.
+    def _addTime(self, rows, delta):
+        self._times[: self._length][rows] += delta
+        deltaTicks, deltaFraction = timeToTicks(delta)
+        ticks = self._ticks[: self._length]
+        ticks[rows] += deltaTicks
+        if deltaFraction:
+            fractions = self._fractions[: self._length]
+            fractions[rows] += deltaFraction
+            _carryFractions(ticks, fractions)
 
     ## Go through the table and ensure all timepoints are positive.
     # NB assumes the table has been sorted.
     def enforcePositiveTimepoints(self):
-        delta = -self.actions[0][0]
+        delta = -self._getTime(0)
         if delta < 0:
             # First event is at a positive time, so we're good to go.
             return
-        for i in range(len(self.actions)):
-            self.actions[i] = (
-                self.actions[i][0] + delta,
-                self.actions[i][1],
-                self.actions[i][2],
-            )
+        self._addTime(slice(None), delta)
+        self.firstActionTime += delta
+        self.lastActionTime += delta
+
+    ## Shift the times of all actions so that the first one is at the
+    # given time.
+    def rebase(self, startTime=0):
+        if self.firstActionTime is None:
+            return
+        delta = startTime - self.getFirstAndLastActionTimes(False)[0]
+        self._addTime(slice(None), delta)
         self.firstActionTime += delta
         self.lastActionTime += delta
 
     ## Move all actions after the specified time back by the given offset,
     # to make room for some new action.
     def shiftActionsBack(self, markTime, delta):
-        for i, (actionTime, handler, action) in enumerate(self.actions):
-            if actionTime >= markTime:
-                self.actions[i] = (actionTime + delta, handler, action)
+        markTicks, markFraction = timeToTicks(markTime)
+        ticks = self._ticks[: self._length]
+        fractions = self._fractions[: self._length]
+        self._addTime(
+            (ticks > markTicks)
+            | ((ticks == markTicks) & (fractions >= markFraction)),
+            delta,
+        )
         if self.firstActionTime > markTime:
             self.firstActionTime += delta
         if self.lastActionTime > markTime:
@@ -142,31 +527,92 @@ class ActionTable:
     def getFirstAndLastActionTimes(self, canUseCache=True):
         if canUseCache:
             return self.firstActionTime, self.lastActionTime
-        firstTime = lastTime = None
-        for actionTime, handler, action in self.actions:
-            if firstTime is None:
-                firstTime = lastTime = actionTime
-            firstTime = min(firstTime, actionTime)
-            lastTime = max(lastTime, actionTime)
-        return firstTime, lastTime
-
-    ## Access an element in the table.
+        rows = numpy.flatnonzero(self._isValid[: self._length])
+        if not len(rows):
+            return None, None
+        order = numpy.lexsort((self._fractions[rows], self._ticks[rows]))
+        return self._getTime(rows[order[0]]), self._getTime(rows[order[-1]])
+
+    ## Return views of the (ticks, handler indices, parameters) columns
+    # for the actions from startIndex up to stopIndex.  Handler indices
+    # are into self.handlers.  Ticks are rounded to the nearest tick
+    # (see TICKS_PER_MS).  The views must not be modified, and are
+    # invalidated by adding actions.
+    def getColumns(self, startIndex=0, stopIndex=None):
+        rows = slice(startIndex, stopIndex)
+        return (
+            self._ticks[: self._length][rows],
+            self._handlerIndices[: self._length][rows],
+            self._parameters[: self._length][rows],
+        )
+
+    ## Return a view of the fractions of a tick to add to the ticks from
+    # getColumns to get the exact times of the actions.
+    def getTickFractions(self, startIndex=0, stopIndex=None):
+        return self._fractions[: self._length][startIndex:stopIndex]
+
+    ## Return the exact time of a row, in milliseconds.
+    def _getTime(self, row):
+        return self._times[row]
+
+    ## Return the action at a row as a (time, handler, parameter) tuple,
+    # or None if deleted.
+    def _getRow(self, row):
+        if not self._isValid[row]:
+            return None
+        return (
+            self._getTime(row),
+            self.handlers[self._handlerIndices[row]],
+            self._parameters[row],
+        )
+
+    ## Return the row of an index, which may be negative.
+    def _getRowIndex(self, index):
+        row = index + self._length if index < 0 else index
+        if not 0 <= row < self._length:
+            raise IndexError("action table index out of range")
+        return row
+
+    ## Access an element in the table, or a list of them for a slice.
     def __getitem__(self, index):
-        return self.actions[index]
+        if isinstance(index, slice):
+            return [
+                self._getRow(row)
+                for row in range(*index.indices(self._length))
+            ]
+        return self._getRow(self._getRowIndex(index))
 
-    ## Modify an item in the table
+    ## Modify an item in the table.  Setting it to None deletes it, but
+    # keeps the indices of later items until clearBadEntries is called.
     def __setitem__(self, index, val):
-        self.actions[index] = val
+        row = self._getRowIndex(index)
+        if val is None:
+            self._isValid[row] = False
+            return
+        time, handler, parameter = val
+        handlerIndex = self.getHandlerIndex(handler)
+        if handlerIndex != self._handlerIndices[row]:
+            self._handlerRows = None
+        self._times[row] = time
+        self._ticks[row], self._fractions[row] = timeToTicks(time)
+        self._handlerIndices[row] = handlerIndex
+        self._parameters[row] = parameter
+        self._isValid[row] = True
+
+    ## Iterate over the actions in the table.
+    def __iter__(self):
+        for row in range(self._length):
+            yield self._getRow(row)
 
     ## Get the length of the table.
     def __len__(self):
-        return len(self.actions)
+        return self._length
 
     ## Generate pretty text for our table, optionally only for the specified
     # handler(s)
     def prettyString(self, handlers=[]):
         result = ""
-        for event in self.actions:
+        for event in self:
             if event is None:
                 result += "<Deleted event>\n"
             else:
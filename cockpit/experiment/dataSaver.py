@@ -49,113 +49,833 @@
 ## ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 ## POSSIBILITY OF SUCH DAMAGE.
 
-import queue
+import bisect
+import collections
+import concurrent.futures
+import datetime
+import json
+import logging
+import os
+import tempfile
 import threading
 import time
 
 import numpy
 import wx
 
+import cockpit.util.bufferPool
 import cockpit.util.datadoc
-import cockpit.util.threads
+import cockpit.util.Mrc
 from cockpit import events
 
 
+_logger = logging.getLogger(__name__)
+
 ## Unique ID for identifying saver instances
 uniqueID = 0
 
 
-## This class simply records all data received during an experiment and saves
-# it to disk in MRC format.
-class DataSaver:
-    ## \param cameras List of CameraHandler instances for the cameras that
-    #         will be generating images
+## Write all of a bytes-like object at the given offset of a file
+# descriptor.  Like os.pwrite, this neither uses nor changes the file
+# position, but it also retries after short writes.
+def _pwriteAll(fd, data, offset):
+    view = memoryview(data).cast("B")
+    while view:
+        numWritten = os.pwrite(fd, view, offset)
+        view = view[numWritten:]
+        offset += numWritten
+
+
+## Maximum number of buffers in one os.pwritev call.  16 is the least
+# that POSIX allows.
+try:
+    _IOV_MAX = os.sysconf("SC_IOV_MAX")
+except (AttributeError, ValueError, OSError):
+    _IOV_MAX = 16
+
+
+## Write a list of bytes-like objects, one after the other, at the given
+# offset of a file descriptor, with as few os.pwritev calls as the
+# system allows.  Retries after short writes.
+def _pwritevAll(fd, buffers, offset):
+    views = [memoryview(buffer).cast("B") for buffer in buffers]
+    i = 0
+    while i < len(views):
+        numWritten = os.pwritev(fd, views[i : i + _IOV_MAX], offset)
+        offset += numWritten
+        while i < len(views) and numWritten >= views[i].nbytes:
+            numWritten -= views[i].nbytes
+            i += 1
+        if numWritten:
+            views[i] = views[i][numWritten:]
+
+
+## Fill a writable bytes-like object with the data at the given offset
+# of a file descriptor, retrying after short reads.
+def _preadIntoAll(fd, buffer, offset):
+    view = memoryview(buffer).cast("B")
+    while view:
+        numRead = os.preadv(fd, [view], offset)
+        if numRead == 0:
+            raise EOFError("Unexpected end of file at offset %d" % offset)
+        view = view[numRead:]
+        offset += numRead
+
+
+## Writes image planes, and their extended header records, to the
+# output files.  This is the simple strategy: each write seeks and then
+# writes while holding a per-file lock, so all writes to the same file
+# are serialised.
+class SeekWriter:
+    ## \param filehandles List of file objects, opened for binary writing.
+    # \param headers List of the MRC header for each file.  The headers
+    #        describe the layout of the file, and must be complete (other
+    #        than min/max values) before the writer is created.
+    # \param planeShape (height, width) of the planes in the files.
+    #        Smaller images are padded with zeros.
+    def __init__(self, filehandles, headers, planeShape):
+        self.filehandles = filehandles
+        self.headers = headers
+        self.planeShape = planeShape
+        ## One lock per file, held while seeking and writing.
+        self.fileLocks = [threading.Lock() for handle in self.filehandles]
+        ## Size of one plane's worth of metadata in the extended header,
+        # and of one plane of pixel data.
+        # \todo Assuming unsigned 16-bit integer here.
+        self.extendedBytes = 4 * (
+            int(headers[0].NumIntegers) + int(headers[0].NumFloats)
+        )
+        self.planeBytes = int(planeShape[0] * planeShape[1] * 2)
+        ## The integers in the extended header are always zero.
+        self.intMetadataBytes = bytes(4 * int(headers[0].NumIntegers))
+
+        # Extend each file to its final size up front.  This makes a
+        # sparse file which reads as zeros, so planes for images that
+        # never get written (e.g. dropped ones) are blank rather than
+        # missing from the end of the file.
+        for handle, header in zip(self.filehandles, self.headers):
+            handle.truncate(self.getFileSize(header))
+
+    ## Return the final size, in bytes, of the file with the given header.
+    def getFileSize(self, header):
+        numPlanes = int(header.Num[2])
+        return 1024 + int(header.next) + numPlanes * self.planeBytes
+
+    ## Return the offsets, in bytes, of a plane's metadata in the
+    # extended header and of its pixel data in the image section.
+    def getOffsets(self, fileIndex, planeIndex):
+        ## 1024 is the length of the base header.
+        metadataOffset = 1024 + (planeIndex * self.extendedBytes)
+        dataOffset = (
+            1024
+            + int(self.headers[fileIndex].next)
+            + (planeIndex * self.planeBytes)
+        )
+        return metadataOffset, dataOffset
+
+    ## Return the image as a full size plane, padded with zeros.  The
+    # plane comes from the buffer pool and must be released once written.
+    def padImage(self, imageData):
+        height, width = imageData.shape
+        # Pad with zeros. I wouldn't normally think this would be
+        # necessary, but we get "invalid argument" errors when writing
+        # to the filehandle if we don't.
+        # \todo Figure out why this is necessary.
+        paddedBuffer = cockpit.util.bufferPool.acquire(
+            self.planeShape, numpy.uint16
+        )
+        paddedBuffer[:height, :width] = imageData
+        # A reused buffer still holds an older image around this one.
+        paddedBuffer[height:, :] = 0
+        paddedBuffer[:height, width:] = 0
+        return paddedBuffer
+
+    ## Return a list of (offset, data) pairs which together write the
+    # image as the plane starting at dataOffset, and the padded buffer
+    # used for it, if any, to be released once written.  Images which
+    # are uint16 and C-contiguous are written without copying: whole if
+    # they have the width of a plane, else row by row.  The rest of the
+    # plane is already zero, since the file was created at its final
+    # size.  Other images are converted and padded.
+    def getPlaneChunks(self, dataOffset, imageData):
+        height, width = imageData.shape
+        if (
+            imageData.dtype != numpy.dtype(numpy.uint16)
+            or not imageData.flags.c_contiguous
+        ):
+            paddedBuffer = self.padImage(imageData)
+            return [(dataOffset, paddedBuffer)], paddedBuffer
+        if width == self.planeShape[1]:
+            return [(dataOffset, imageData)], None
+        rowBytes = self.planeShape[1] * imageData.itemsize
+        chunks = [
+            (dataOffset + row * rowBytes, imageData[row])
+            for row in range(height)
+        ]
+        return chunks, None
+
+    ## Write the MRC header at the start of the specified file.
+    def writeHeader(self, fileIndex, header):
+        with self.fileLocks[fileIndex]:
+            cockpit.util.datadoc.writeMrcHeader(
+                header, self.filehandles[fileIndex]
+            )
+
+    ## Write one image, and its metadata floats, as the specified plane
+    # of the specified file.
+    def writePlane(self, fileIndex, planeIndex, floatMetadata, imageData):
+        metadataOffset, dataOffset = self.getOffsets(fileIndex, planeIndex)
+        chunks, paddedBuffer = self.getPlaneChunks(dataOffset, imageData)
+        try:
+            with self.fileLocks[fileIndex]:
+                handle = self.filehandles[fileIndex]
+                handle.seek(metadataOffset)
+                handle.write(self.intMetadataBytes)
+                handle.write(floatMetadata)
+                for offset, data in chunks:
+                    handle.seek(offset)
+                    handle.write(data)
+        finally:
+            if paddedBuffer is not None:
+                cockpit.util.bufferPool.release(paddedBuffer)
+
+    ## Block until every plane passed to writePlane has been written.
+    def flush(self):
+        pass
+
+    ## Finish pending writes and close all files.
+    def close(self):
+        self.flush()
+        for i, handle in enumerate(self.filehandles):
+            with self.fileLocks[i]:
+                handle.close()
+
+
+## Writer that uses positional writes (os.pwrite) from a pool of
+# threads.  The offset of each plane is known in advance, so there is no
+# shared file position to protect and planes are written concurrently,
+# even within the same file.
+class PositionalWriter(SeekWriter):
+    ## \param numThreads Number of writer threads.
+    def __init__(self, filehandles, headers, planeShape, numThreads):
+        super().__init__(filehandles, headers, planeShape)
+        self.fds = [handle.fileno() for handle in self.filehandles]
+        self.pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=numThreads, thread_name_prefix="DataSaver-writer"
+        )
+        ## Maximum number of planes queued or being written.  Once
+        # reached, writePlane blocks, so that a slow disk holds back the
+        # caller instead of letting planes pile up in the pool's queue.
+        self.maxPending = 2 * numThreads
+        self.pendingSlots = threading.BoundedSemaphore(self.maxPending)
+        ## First exception raised in a writer thread, to be re-raised on
+        # the calling thread.
+        self.error = None
+
+    def writeHeader(self, fileIndex, header):
+        _pwriteAll(self.fds[fileIndex], header._array.tobytes(), 0)
+
+    def writePlane(self, fileIndex, planeIndex, floatMetadata, imageData):
+        self.raiseIfFailed()
+        metadataOffset, dataOffset = self.getOffsets(fileIndex, planeIndex)
+        # The pending write keeps its own copy of the metadata, since
+        # the caller may reuse its buffer for the next plane.
+        metadata = self.intMetadataBytes + floatMetadata.tobytes()
+        self.pendingSlots.acquire()
+        chunks, paddedBuffer = self.getPlaneChunks(dataOffset, imageData)
+        try:
+            self.pool.submit(
+                self._write,
+                self.fds[fileIndex],
+                metadataOffset,
+                metadata,
+                chunks,
+                paddedBuffer,
+            )
+        except:
+            if paddedBuffer is not None:
+                cockpit.util.bufferPool.release(paddedBuffer)
+            self.pendingSlots.release()
+            raise
+
+    ## As SeekWriter.getPlaneChunks, except that where the system has
+    # os.pwritev the rows of images narrower than a plane are written
+    # in one call: a chunk's data is then a list of the rows, with the
+    # zeros that pad each row to the width of a plane in between.
+    def getPlaneChunks(self, dataOffset, imageData):
+        chunks, paddedBuffer = super().getPlaneChunks(dataOffset, imageData)
+        if len(chunks) > 1 and hasattr(os, "pwritev"):
+            rowPadding = bytes(
+                self.planeShape[1] * imageData.itemsize - imageData[0].nbytes
+            )
+            buffers = []
+            for offset, row in chunks:
+                buffers.extend([row, rowPadding])
+            # Nothing needs writing after the last row.
+            buffers.pop()
+            chunks = [(dataOffset, buffers)]
+        return chunks, paddedBuffer
+
+    def _write(self, fd, metadataOffset, metadata, chunks, paddedBuffer):
+        try:
+            _pwriteAll(fd, metadata, metadataOffset)
+            for offset, data in chunks:
+                if isinstance(data, list):
+                    _pwritevAll(fd, data, offset)
+                else:
+                    _pwriteAll(fd, data, offset)
+        except Exception as e:
+            if self.error is None:
+                self.error = e
+        finally:
+            if paddedBuffer is not None:
+                cockpit.util.bufferPool.release(paddedBuffer)
+            self.pendingSlots.release()
+
+    def flush(self):
+        # Holding every slot means that no write is queued or running.
+        for i in range(self.maxPending):
+            self.pendingSlots.acquire()
+        for i in range(self.maxPending):
+            self.pendingSlots.release()
+        self.raiseIfFailed()
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self.pool.shutdown()
+
+    ## Re-raise the first error from the writer threads, if any.
+    def raiseIfFailed(self):
+        if self.error is not None:
+            raise self.error
+
+
+## Writer that preallocates each file to its final size and maps it
+# into memory.  Images are copied straight into their plane of the
+# mapped image section, and metadata into the mapped extended header,
+# with no padding buffer and no write calls; the operating system
+# writes the pages back to disk asynchronously.
+class MemmapWriter(SeekWriter):
+    def __init__(self, filehandles, headers, planeShape):
+        super().__init__(filehandles, headers, planeShape)
+        numIntegers = int(headers[0].NumIntegers)
+        numFloats = int(headers[0].NumFloats)
+        metadataDtype = numpy.dtype(
+            [
+                ("ints", numpy.int32, (numIntegers,)),
+                ("floats", numpy.float32, (numFloats,)),
+            ]
+        )
+        ## Memory map of each whole file, and views of its extended
+        # header as records and of its image section as planes.
+        self.fileMaps = []
+        self.metadataMaps = []
+        self.planeMaps = []
+        for handle, header in zip(self.filehandles, self.headers):
+            numPlanes = int(header.Num[2])
+            dataStart = 1024 + int(header.next)
+            fileSize = self.getFileSize(header)
+            fileMap = numpy.memmap(
+                handle, dtype=numpy.uint8, mode="r+", shape=(fileSize,)
+            )
+            self.fileMaps.append(fileMap)
+            self.metadataMaps.append(
+                fileMap[1024:dataStart].view(metadataDtype)
+            )
+            self.planeMaps.append(
+                fileMap[dataStart:]
+                .view(numpy.uint16)
+                .reshape((numPlanes,) + tuple(planeShape))
+            )
+
+    def writeHeader(self, fileIndex, header):
+        headerBytes = numpy.frombuffer(header._array.tobytes(), numpy.uint8)
+        self.fileMaps[fileIndex][: headerBytes.size] = headerBytes
+
+    def writePlane(self, fileIndex, planeIndex, floatMetadata, imageData):
+        height, width = imageData.shape
+        self.planeMaps[fileIndex][planeIndex, :height, :width] = imageData
+        self.metadataMaps[fileIndex][planeIndex]["floats"] = floatMetadata
+
+    def close(self):
+        for fileMap in self.fileMaps:
+            fileMap.flush()
+        # The maps are closed once nothing refers to them any more.
+        self.fileMaps = []
+        self.metadataMaps = []
+        self.planeMaps = []
+        super().close()
+
+
+## Return the writer to use for the given files.  Positional writes are
+# used if there are writer threads and the platform has os.pwrite (it is
+# not available on Windows).
+def makeWriter(filehandles, headers, planeShape, numThreads, useMemmap):
+    if useMemmap:
+        return MemmapWriter(filehandles, headers, planeShape)
+    if numThreads > 0 and hasattr(os, "pwrite"):
+        return PositionalWriter(filehandles, headers, planeShape, numThreads)
+    return SeekWriter(filehandles, headers, planeShape)
+
+
+## FIFO of images waiting to be saved, with a bound on the memory they
+# use.  Images are kept in memory up to maxBytes.  Past that, they are
+# written to a ring buffer in a scratch file, if there is one, and read
+# back when their turn comes.  If there is no room for an image in
+# either, it is dropped: it still goes through the queue, without its
+# data, so that the images after it are saved in the right place.
+class ImageQueue:
+    ## \param numCameras Number of cameras, for the per-camera counts.
+    # \param maxBytes Maximum size, in bytes, of images kept in memory.
+    # \param spillDir Directory for the scratch file, or None to drop
+    #        images instead of spilling them.
+    # \param spillBytes Size, in bytes, of the scratch file ring buffer.
+    def __init__(self, numCameras, maxBytes, spillDir=None, spillBytes=0):
+        self.maxBytes = maxBytes
+        ## Queued (cameraIndex, imageData, metadata, spillExtent,
+        # arrivalTime) tuples.  imageData is None for spilled and dropped
+        # images, and spillExtent is the (offset, shape, dtype) of a
+        # spilled image.
+        self.entries = collections.deque()
+        self.condition = threading.Condition()
+        ## Bytes of image data currently queued in memory.
+        self.bytesQueued = 0
+        ## Set by stop() to wake up, and return from, a waiting get().
+        self.stopped = False
+
+        self.spillFile = None
+        self.spillBytes = spillBytes
+        if spillDir and spillBytes > 0:
+            self.spillFile = tempfile.TemporaryFile(
+                prefix="cockpit-spill-", dir=spillDir
+            )
+        ## (offset, size) of spilled images in the scratch file, oldest
+        # first, and where the next one would go.
+        self.spillExtents = collections.deque()
+        self.spillHead = 0
+        ## Offsets of spilled images still being written, which cannot
+        # be read back yet.
+        self.spillsInProgress = set()
+        ## Lock on the scratch file's position, on platforms without
+        # positional reads and writes.
+        self.spillFileLock = threading.Lock()
+
+        ## Statistics reported at the end of the experiment.
+        self.maxDepth = 0
+        self.maxBytesQueued = 0
+        self.numSpilled = [0] * numCameras
+        self.bytesSpilled = [0] * numCameras
+        self.numDropped = [0] * numCameras
+
+    ## Add an image to the end of the queue.  arrivalTime is the
+    # time.time() at which it was received, which is given back with it.
+    # Spilled images are written to the scratch file without holding the
+    # queue's lock, so that putting and getting other images does not
+    # wait on the disk.
+    def put(self, cameraIndex, imageData, metadata, arrivalTime=None):
+        with self.condition:
+            spillExtent = None
+            if self.bytesQueued + imageData.nbytes <= self.maxBytes:
+                self.bytesQueued += imageData.nbytes
+                self.maxBytesQueued = max(
+                    self.maxBytesQueued, self.bytesQueued
+                )
+            else:
+                offset = self._allocateSpill(imageData.nbytes)
+                if offset is None:
+                    self.numDropped[cameraIndex] += 1
+                    imageData = None
+                else:
+                    spillExtent = (offset, imageData.shape, imageData.dtype)
+                    self.spillsInProgress.add(offset)
+                    self.numSpilled[cameraIndex] += 1
+                    self.bytesSpilled[cameraIndex] += imageData.nbytes
+            self.entries.append(
+                (
+                    cameraIndex,
+                    None if spillExtent else imageData,
+                    metadata,
+                    spillExtent,
+                    arrivalTime,
+                )
+            )
+            self.maxDepth = max(self.maxDepth, len(self.entries))
+            if spillExtent is None:
+                self.condition.notify()
+                return
+        try:
+            self._writeSpill(
+                spillExtent[0], numpy.ascontiguousarray(imageData)
+            )
+        finally:
+            with self.condition:
+                self.spillsInProgress.discard(spillExtent[0])
+                self.condition.notify()
+
+    ## Remove and return the (cameraIndex, imageData, metadata,
+    # arrivalTime) at the front of the queue, waiting for one if it is
+    # empty.  imageData is None if the image was dropped.  Returns None,
+    # instead of waiting, once the queue has been stopped.  Only one
+    # thread may get images, since spilled images are read back in the
+    # order they were put.
+    def get(self):
+        with self.condition:
+            while (
+                not self.entries
+                or self.entries[0][3] is not None
+                and self.entries[0][3][0] in self.spillsInProgress
+            ):
+                if not self.entries and self.stopped:
+                    return None
+                self.condition.wait()
+            (
+                cameraIndex,
+                imageData,
+                metadata,
+                spillExtent,
+                arrivalTime,
+            ) = self.entries.popleft()
+            if imageData is not None:
+                self.bytesQueued -= imageData.nbytes
+        if spillExtent is not None:
+            offset, shape, dtype = spillExtent
+            imageData = numpy.empty(shape, dtype)
+            try:
+                self._readSpill(offset, imageData)
+            finally:
+                # Only free the space once read, so that it is not
+                # reused by an image being spilled meanwhile.
+                with self.condition:
+                    self.spillExtents.popleft()
+                    if not self.spillExtents:
+                        self.spillHead = 0
+        return cameraIndex, imageData, metadata, arrivalTime
+
+    ## Return True if no images are waiting.
+    def empty(self):
+        with self.condition:
+            return not self.entries
+
+    ## Return how many images are waiting, and how many bytes of them
+    # are in memory.
+    def getDepth(self):
+        with self.condition:
+            return len(self.entries), self.bytesQueued
+
+    ## Return the offset in the scratch file at which to spill an image
+    # of the given size, or None if it does not fit.  Spilled images are
+    # read back in order, so the free space is always after the newest
+    # and before the oldest extent, possibly wrapping around.
+    def _allocateSpill(self, size):
+        if self.spillFile is None:
+            return None
+        if not self.spillExtents:
+            offset = 0 if size <= self.spillBytes else None
+        else:
+            tail = self.spillExtents[0][0]
+            if self.spillHead > tail:
+                if self.spillHead + size <= self.spillBytes:
+                    offset = self.spillHead
+                elif size <= tail:
+                    offset = 0
+                else:
+                    offset = None
+            elif self.spillHead + size <= tail:
+                offset = self.spillHead
+            else:
+                offset = None
+        if offset is not None:
+            self.spillExtents.append((offset, size))
+            self.spillHead = offset + size
+        return offset
+
+    ## Write an image to the scratch file at the given offset.
+    def _writeSpill(self, offset, imageData):
+        if hasattr(os, "pwrite"):
+            _pwriteAll(self.spillFile.fileno(), imageData, offset)
+        else:
+            with self.spillFileLock:
+                self.spillFile.seek(offset)
+                self.spillFile.write(imageData)
+
+    ## Read an image from the scratch file at the given offset into
+    # imageData.
+    def _readSpill(self, offset, imageData):
+        if hasattr(os, "preadv"):
+            _preadIntoAll(self.spillFile.fileno(), imageData, offset)
+        else:
+            with self.spillFileLock:
+                self.spillFile.seek(offset)
+                self.spillFile.readinto(imageData)
+
+    ## Stop the queue: get() no longer waits for images, so that the
+    # thread saving them can finish.
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+    ## Delete the scratch file, if any.
+    def close(self):
+        if self.spillFile is not None:
+            self.spillFile.close()
+            self.spillFile = None
+
+
+## Return the histogram of an image, with a bin for each uint16 value.
+# Images of other types are counted as they are stored, i.e. converted
+# to uint16.
+def getImageHistogram(imageData):
+    if imageData.dtype not in (numpy.uint8, numpy.uint16):
+        imageData = imageData.astype(numpy.uint16)
+    return numpy.bincount(imageData.ravel(), minlength=2**16)
+
+
+## Return the path of the file(s) for one camera's images, when each
+# camera is saved to its own files.  The camera name is inserted before
+# the extension, e.g. "data_cam1.dv" for "data.dv".
+def getCameraPath(savePath, camera):
+    root, ext = os.path.splitext(savePath)
+    return "%s_%s%s" % (root, camera.name, ext)
+
+
+## Return the path of the manifest written when each camera is saved to
+# its own files, e.g. "data.json" for "data.dv".
+def getManifestPath(savePath):
+    return os.path.splitext(savePath)[0] + ".json"
+
+
+## Return the path of the log of saving telemetry for the data saved at
+# savePath, e.g. "data_saving.log" for "data.dv".
+def getTelemetryPath(savePath):
+    root, ext = os.path.splitext(savePath)
+    return root + "_saving.log"
+
+
+## Upper edges, in seconds, of the bins of the histogram of how long
+# images took from being acquired to being written.  The last bin counts
+# anything slower.
+LATENCY_BIN_EDGES = (
+    0.001,
+    0.002,
+    0.005,
+    0.01,
+    0.02,
+    0.05,
+    0.1,
+    0.2,
+    0.5,
+    1.0,
+    2.0,
+    5.0,
+)
+
+
+## Statistics on how saving keeps up with the images arriving: queue
+# depth, frames and megabytes per second for each camera, how long
+# images took to be written, time since the last image, and when
+# saving is expected to finish.  Images are recorded from the saving
+# thread, while snapshots are taken from the status thread.
+class SaveTelemetry:
+    ## \param cameraNames List of names of the cameras.
+    # \param totals List of the total images expected per camera.
+    # \param imageQueue ImageQueue the images are saved from.
+    # \param logPath Path of a file to log each snapshot to, in the
+    #        format of ValueLogger, or None to not log them.
+    def __init__(self, cameraNames, totals, imageQueue, logPath=None):
+        self.cameraNames = cameraNames
+        self.totals = totals
+        self.imageQueue = imageQueue
+        self.logPath = logPath
+        self.lock = threading.Lock()
+        ## Images written, including dropped ones, and bytes written per
+        # camera.
+        self.numImages = [0] * len(cameraNames)
+        self.numBytes = [0] * len(cameraNames)
+        ## Counts of write latencies in the bins of LATENCY_BIN_EDGES.
+        self.latencyCounts = [0] * (len(LATENCY_BIN_EDGES) + 1)
+        self.startTime = time.time()
+        self.lastImageTime = None
+        ## Time and counts of the previous snapshot, to compute rates.
+        self.prevTime = self.startTime
+        self.prevImages = list(self.numImages)
+        self.prevBytes = list(self.numBytes)
+        ## Log file, opened on the first snapshot logged.
+        self.logFile = None
+
+    ## Record that an image from a camera has been written.  latency is
+    # the time, in seconds, from its arrival until then, or None if it
+    # was dropped.
+    def recordImage(self, cameraIndex, numBytes, latency):
+        with self.lock:
+            self.numImages[cameraIndex] += 1
+            self.numBytes[cameraIndex] += numBytes
+            if latency is not None:
+                binIndex = bisect.bisect_left(LATENCY_BIN_EDGES, latency)
+                self.latencyCounts[binIndex] += 1
+            self.lastImageTime = time.time()
+
+    ## Return a dict of the current statistics.  Rates are averaged
+    # since the previous snapshot.  The projected finish is the time
+    # since the epoch at which the slowest camera is expected to have
+    # all its images, at its average rate so far, or None if not known.
+    def getSnapshot(self):
+        queueDepth, queueBytes = self.imageQueue.getDepth()
+        with self.lock:
+            now = time.time()
+            numImages = list(self.numImages)
+            numBytes = list(self.numBytes)
+            latencyCounts = list(self.latencyCounts)
+            lastImageTime = self.lastImageTime
+        interval = max(now - self.prevTime, 1e-6)
+        elapsed = max(now - self.startTime, 1e-6)
+        cameras = []
+        finishTime = now
+        for i, name in enumerate(self.cameraNames):
+            remaining = self.totals[i] - numImages[i]
+            if remaining > 0:
+                if numImages[i] and finishTime is not None:
+                    rate = numImages[i] / elapsed
+                    finishTime = max(finishTime, now + remaining / rate)
+                else:
+                    finishTime = None
+            cameras.append(
+                {
+                    "name": name,
+                    "images": numImages[i],
+                    "total": self.totals[i],
+                    "fps": (numImages[i] - self.prevImages[i]) / interval,
+                    "mbps": (numBytes[i] - self.prevBytes[i])
+                    / interval
+                    / 2**20,
+                }
+            )
+        self.prevTime = now
+        self.prevImages = numImages
+        self.prevBytes = numBytes
+        sinceLastImage = None
+        if lastImageTime is not None:
+            sinceLastImage = now - lastImageTime
+        return {
+            "time": now,
+            "queue_depth": queueDepth,
+            "queue_bytes": queueBytes,
+            "cameras": cameras,
+            "latency_bin_edges": LATENCY_BIN_EDGES,
+            "latency_counts": latencyCounts,
+            "since_last_image": sinceLastImage,
+            "projected_finish": finishTime,
+        }
+
+    ## Return the names of the values in each line of the log.
+    def getLogKeys(self):
+        keys = ["queue depth", "queue MB", "since last image", "finish in"]
+        for name in self.cameraNames:
+            keys.extend(["%s fps" % name, "%s MB/s" % name])
+        keys.extend(
+            "latency <%gms" % (1e3 * edge) for edge in LATENCY_BIN_EDGES
+        )
+        keys.append("latency >%gms" % (1e3 * LATENCY_BIN_EDGES[-1]))
+        return keys
+
+    ## Append a snapshot to the log, if there is one.  Lines have the
+    # timestamp and values separated by semicolons, with a header line
+    # naming the values, like ValueLogger.
+    def log(self, snapshot):
+        if self.logPath is None:
+            return
+        if self.logFile is None:
+            self.logFile = open(self.logPath, "w")
+            self.logFile.write(
+                ";".join(["timestamp"] + self.getLogKeys()) + "\n"
+            )
+        values = [
+            snapshot["queue_depth"],
+            "%.1f" % (snapshot["queue_bytes"] / 2**20),
+            _formatSeconds(snapshot["since_last_image"]),
+            _formatSeconds(
+                None
+                if snapshot["projected_finish"] is None
+                else snapshot["projected_finish"] - snapshot["time"]
+            ),
+        ]
+        for camera in snapshot["cameras"]:
+            values.extend(["%.1f" % camera["fps"], "%.1f" % camera["mbps"]])
+        values.extend(snapshot["latency_counts"])
+        timestamp = datetime.datetime.fromtimestamp(snapshot["time"])
+        self.logFile.write(
+            ";".join([timestamp.isoformat()] + [str(v) for v in values]) + "\n"
+        )
+        self.logFile.flush()
+
+    ## Close the log, if open.
+    def close(self):
+        if self.logFile is not None:
+            self.logFile.close()
+            self.logFile = None
+
+
+def _formatSeconds(seconds):
+    return "" if seconds is None else "%.3f" % seconds
+
+
+## A set of MRC files holding the images from some cameras, interleaved
+# in WZT order.  The planes are as large as the largest image of those
+# cameras; smaller images are padded.  If the data would be too large,
+# it is split across multiple files at timepoint boundaries, each with
+# a numeric suffix.
+class FileSet:
+    ## Number of 32-bit ints and floats in the extended header, per plane.
+    numIntegers = 8
+    numFloats = 32
+
+    ## \param cameras List of the CameraHandlers whose images are stored
+    #         in these files, in the order they are interleaved.
+    # \param savePath Path to save the data to.
     # \param numReps How many times the experiment will be repeated.
-    # \param repDuration How long each rep lasts.
-    # \param cameraToImagesPerRep Maps camera handlers to how many images to
-    #        expect for that camera in a single repeat of the experiment.
-    # \param cameraToIgnoredImageIndices Maps camera handlers to indices of
-    #        images that we don't actually want to keep.
-    # \param runThread Thread that is executing the experiment. When it exits,
-    #        we know to stop expecting more images.
-    # \param savePath Path to save the incoming data to.
-    # \param pixelSizeZ Size of the Z "pixel" (i.e. distance between Z slices).
-    # \param titles List of strings to insert into the MRC file's header.
-    #        Per the file format, each string can be up to 80 characters long
-    #        and there can be up to 10 of them.
-    # \param cameraToExcitation Maps camera handlers to the excitation
-    #        wavelength used to generate the images it will acquire.
+    # \param cameraToImagesKeptPerRep Maps camera handlers to how many
+    #        images will be kept from them in each repeat.
+    # \param maxFilesize Maximum size, in megabytes, of the image data
+    #        in each file.
+    # \param pixelSizeZ, titles, objectives As for DataSaver.
+    # \param writerThreads, useMemmap Passed on to makeWriter.
     def __init__(
         self,
         cameras,
-        numReps,
-        repDuration,
-        cameraToImagesPerRep,
-        cameraToIgnoredImageIndices,
-        runThread,
         savePath,
+        numReps,
+        cameraToImagesKeptPerRep,
+        maxFilesize,
         pixelSizeZ,
         titles,
-        cameraToExcitation,
+        objectives,
+        writerThreads,
+        useMemmap,
     ):
         self.cameras = cameras
         self.numReps = numReps
-        self.repDuration = repDuration
-        self.cameraToImagesPerRep = cameraToImagesPerRep
-        self.cameraToIgnoredImageIndices = cameraToIgnoredImageIndices
-        self.runThread = runThread
-
-        ## We want to write the excitation wavelength for each image
-        ## on the metadata (see issue #290).  We only allow one
-        ## excitation wavelength per image.  This is a limitation of
-        ## the dv format.  We also assume that all images from a
-        ## camera will have the same light source.  This is a
-        ## limitation of the cockpit interface.
-        self.cameraToExcitation = cameraToExcitation
-
-        ## Maximum size, in megabytes, of each file generated.  If the
-        # experiment data exceeds this, then a new file will be opened, and
-        # each file will have a suffix appended to it (e.g.  ".001", ".002",
-        # etc.). This is not a precise cap, since it only considers the amount
-        # of space allocated to image data -- not the header or extended
-        # header.
-        # The default of a googol megabytes ought to be enough to avoid
-        # splitting files if no cap is specified. :)
-        self.maxFilesize = 10**100
-
-        global uniqueID
-        ## Unique ID for our instance
-        self.uniqueID = uniqueID
-        uniqueID += 1
-        # Find the maximum image size (in pixels) in X and Y. While we're at it,
-        # assign a number to each camera, for indexing into our data array
-        # later, and figure out how many images per camera we'll actually be
-        # *keeping*.
+        ## Maps camera handlers to their position in the interleaving.
+        self.cameraToIndex = {c: i for i, c in enumerate(self.cameras)}
+        # Find the maximum image size (in pixels) in X and Y.
         self.maxWidth, self.maxHeight = 0, 0
-        ## We need to establish a consistent ordering for cameras so that
-        # each image gets stored in the correct part of the file. This
-        # maps camera handlers to indices.
-        self.cameraToIndex = {}
-        ## Maps camera handlers to total images kept per rep.
-        self.cameraToImagesKeptPerRep = {}
-        for i, camera in enumerate(self.cameras):
+        for camera in self.cameras:
             width, height = camera.getImageSize()
             self.maxWidth = max(width, self.maxWidth)
             self.maxHeight = max(height, self.maxHeight)
-            self.cameraToIndex[camera] = i
-            self.cameraToImagesKeptPerRep[camera] = self.cameraToImagesPerRep[
-                camera
-            ] - len(self.cameraToIgnoredImageIndices[camera])
         ## We need this for the upper bound on the array of data we write.
-        self.maxImagesPerRep = max(self.cameraToImagesKeptPerRep.values())
+        self.maxImagesPerRep = max(
+            cameraToImagesKeptPerRep[c] for c in self.cameras
+        )
 
         ## Number of bytes to allocate for each image in the file.
         # \todo Assuming unsigned 16-bit integer here.
         self.planeBytes = int(self.maxWidth * self.maxHeight * 2)
 
         ## Number of timepoints per file, based on the above and
-        # self.maxFilesize.
-        self.maxRepsPerFile = self.maxFilesize // (
+        # maxFilesize.
+        self.maxRepsPerFile = maxFilesize // (
             self.maxImagesPerRep
             * self.planeBytes
             * len(self.cameras)
@@ -176,22 +896,6 @@ class DataSaver:
         # self.numReps in cases where we only need a single file anyway.
         self.maxRepsPerFile = min(self.numReps, self.maxRepsPerFile)
 
-        ## Maps ints to cameras; the ints represent the order in which the
-        # images are stored.
-        self.indexToCamera = {v: k for k, v in self.cameraToIndex.items()}
-        ## Timestamp of the first image we receive.
-        # We need this so we can rebase the timestamps of images to
-        # to be relative to the beginning of the experiment -- Python
-        # timestamps can't be stored directly as 32-bit floating points without
-        # losing a lot of precision. And we want to store image timestamps in
-        # the extended header, to help us identify when frames get dropped.
-        self.firstTimestamp = None
-
-        ## Time at which we last received an image, so we know when images
-        # have stopped arriving.
-        self.lastImageTime = time.time()
-        self.startTime = time.time()
-
         ## Filehandles we will write the data to.
         self.filehandles = []
         ## Filenames for same.
@@ -210,30 +914,23 @@ class DataSaver:
             formatString = "%0" + str(numDigits) + "d"
             for i in range(numFilehandles):
                 filename = "%s.%s" % (savePath, formatString % i)
-                self.filehandles.append(open(filename, "wb"))
+                self.filehandles.append(open(filename, "w+b"))
                 self.filenames.append(filename)
         else:
             # We have just a single filehandle with the save path as specified.
-            self.filehandles.append(open(savePath, "wb"))
+            self.filehandles.append(open(savePath, "w+b"))
             self.filenames.append(savePath)
 
-        ## Lock on writing to each file.
-        self.fileLocks = [threading.Lock() for handle in self.filehandles]
-
-        pixelSizeXY = wx.GetApp().Objectives.GetPixelSize()
-        lensID = wx.GetApp().Objectives.GetCurrent().lens_ID
+        pixelSizeXY = objectives.GetPixelSize()
+        lensID = objectives.GetCurrent().lens_ID
         # wavelength should always be on camera even if "0"
         wavelengths = [c.wavelength for c in self.cameras]
 
         ## Size of one plane's worth of metadata in the extended header.
-        numIntegers = 8
-        numFloats = 32
-        self.extendedBytes = 4 * (numIntegers + numFloats)
+        self.extendedBytes = 4 * (self.numIntegers + self.numFloats)
 
         ## MRC header objects for each file.
         self.headers = []
-        self.intMetadataBuffers = []
-        self.floatMetadataBuffers = []
         for i in range(len(self.filehandles)):
             # Calculate how many timepoints fit into this particular file
             # (potentially different for the final file).
@@ -283,31 +980,300 @@ class DataSaver:
                 * numTimepoints
             )
             # Number of 32-bit ints and floats in extended header, per plane.
-            header.NumIntegers = numIntegers
-            header.NumFloats = numFloats
+            header.NumIntegers = self.numIntegers
+            header.NumFloats = self.numFloats
 
             self.headers.append(header)
 
-            ## This will hold the metadata for one image plane at a
-            ## time and will be written into the extended header.  We
-            ## could create a new array each time for each plane but
-            ## these arrays are small and there will be many image
-            ## planes.  We do this to avoid memory fragmentation.
-            self.intMetadataBuffers.append(
-                numpy.array([0] * numIntegers, dtype=numpy.int32)
-            )
-            floatMetadataBuffer = numpy.array(
-                [0.0] * numFloats, dtype=numpy.float32
-            )
-            floatMetadataBuffer[12] = 1.0  # intensity scaling
-            self.floatMetadataBuffers.append(floatMetadataBuffer)
+        ## Object that does the actual writing to the files.
+        self.writer = makeWriter(
+            self.filehandles,
+            self.headers,
+            (self.maxHeight, self.maxWidth),
+            writerThreads,
+            useMemmap,
+        )
 
         # Write the headers, to get us started. We will re-write this at the
         # end when we have more metadata to fill in (specifically, the min/max
         # values for each wavelength).
-        for i, handle in enumerate(self.filehandles):
-            with self.fileLocks[i]:
-                cockpit.util.datadoc.writeMrcHeader(self.headers[i], handle)
+        self.writeHeaders()
+
+        ## Per file, the (min, max) pixel values of the images from each
+        # camera, tracking the dimmest and brightest pixels.
+        self.minMaxVals = [
+            [(float("inf"), float("-inf"))] * len(self.cameras)
+            for handle in self.filehandles
+        ]
+        ## Per file, the histogram of the pixel values of the first
+        # camera, for their median, or None if there are no images yet.
+        self.histograms = [None] * len(self.filehandles)
+
+    ## Return the indices of the file, and of the plane within that
+    # file, for the numImages'th image kept from the camera, which is
+    # at zIndex within its rep.
+    def getPlaneLocation(self, camera, numImages, zIndex):
+        timepoint = numImages // self.maxImagesPerRep
+        fileIndex = timepoint // self.maxRepsPerFile
+        # Rebase the timepoint to be relative to the beginning of this
+        # specific file.
+        timepoint -= fileIndex * self.maxRepsPerFile
+        numCameras = len(self.cameras)
+        planeIndex = (
+            int(timepoint * self.maxImagesPerRep * numCameras)
+            + (zIndex * numCameras)
+            + self.cameraToIndex[camera]
+        )
+        return fileIndex, planeIndex
+
+    ## Add an image to the statistics of a file, and return its minimum
+    # and maximum values.  The header needs the median of the first
+    # camera only, so we only keep a histogram of its images; for the
+    # others, min and max are cheaper than a histogram.
+    def addImageStatistics(self, fileIndex, camera, imageData):
+        cameraIndex = self.cameraToIndex[camera]
+        if cameraIndex == 0:
+            counts = getImageHistogram(imageData)
+            nonzero = numpy.flatnonzero(counts)
+            imageMin, imageMax = nonzero[0], nonzero[-1]
+            if self.histograms[fileIndex] is None:
+                self.histograms[fileIndex] = counts
+            else:
+                self.histograms[fileIndex] += counts
+        else:
+            imageMin = imageData.min()
+            imageMax = imageData.max()
+        curMin, curMax = self.minMaxVals[fileIndex][cameraIndex]
+        self.minMaxVals[fileIndex][cameraIndex] = (
+            min(curMin, imageMin),
+            max(curMax, imageMax),
+        )
+        return imageMin, imageMax
+
+    ## Fill in the min/max values for each wavelength, and the median for
+    # the first, in the header of each file.
+    def setHeaderStatistics(self):
+        for fileIndex, header in enumerate(self.headers):
+            for i, (minVal, maxVal) in enumerate(self.minMaxVals[fileIndex]):
+                if minVal > maxVal:
+                    # No images from this camera made it into this file.
+                    minVal, maxVal = 0, 0
+                if i == 0:
+                    median = 0
+                    if self.histograms[fileIndex] is not None:
+                        median = cockpit.util.Mrc.histogramMedian(
+                            self.histograms[fileIndex]
+                        )
+                    setattr(header, "mmm1", (minVal, maxVal, median))
+                else:
+                    setattr(header, "mm%d" % (i + 1), (minVal, maxVal))
+
+    ## Write the headers of all of our files.
+    def writeHeaders(self):
+        for i in range(len(self.filehandles)):
+            self.writer.writeHeader(i, self.headers[i])
+
+    ## Finish writing, and close our files.
+    def close(self):
+        self.writer.close()
+
+
+## This class simply records all data received during an experiment and saves
+# it to disk in MRC format.
+class DataSaver:
+    ## \param cameras List of CameraHandler instances for the cameras that
+    #         will be generating images
+    # \param numReps How many times the experiment will be repeated.
+    # \param repDuration How long each rep lasts.
+    # \param cameraToImagesPerRep Maps camera handlers to how many images to
+    #        expect for that camera in a single repeat of the experiment.
+    # \param cameraToIgnoredImageIndices Maps camera handlers to indices of
+    #        images that we don't actually want to keep.
+    # \param runThread Thread that is executing the experiment. When it exits,
+    #        we know to stop expecting more images.
+    # \param savePath Path to save the incoming data to.
+    # \param pixelSizeZ Size of the Z "pixel" (i.e. distance between Z slices).
+    # \param titles List of strings to insert into the MRC file's header.
+    #        Per the file format, each string can be up to 80 characters long
+    #        and there can be up to 10 of them.
+    # \param cameraToExcitation Maps camera handlers to the excitation
+    #        wavelength used to generate the images it will acquire.
+    # \param writerThreads Number of threads writing image data to disk.
+    #        If zero, images are written from the saving thread itself
+    #        (see makeWriter).
+    # \param useMemmap If True, preallocate the files and map them into
+    #        memory instead of writing to them (see MemmapWriter).
+    # \param maxQueueBytes Maximum size, in bytes, of the images waiting
+    #        in memory to be saved.
+    # \param spillDir Directory for a scratch file where images are
+    #        queued once maxQueueBytes is reached, or None to drop them.
+    # \param spillBytes Size, in bytes, of that scratch file.
+    # \param filePerCamera If True, write each camera's images to its
+    #        own files, at the camera's image size, and write a manifest
+    #        listing them (see getCameraPath and getManifestPath).
+    # \param zIndexMap List mapping the index of each image kept from a
+    #        camera in a rep, in the order they arrive, to the Z index it
+    #        is saved at, or None to save them in the order they arrive.
+    #        Each camera must keep one image per entry.
+    # \param objectives Objectives to get the pixel size and lens ID
+    #        from, or None for those of the app.  This lets DataSaver
+    #        run without a wx.App, e.g. for benchmarks.
+    # \param telemetryPath Path of a file to log saving telemetry to
+    #        (see SaveTelemetry and getTelemetryPath), or None to not
+    #        log it.  Telemetry is published as SAVE_STATUS regardless.
+    def __init__(
+        self,
+        cameras,
+        numReps,
+        repDuration,
+        cameraToImagesPerRep,
+        cameraToIgnoredImageIndices,
+        runThread,
+        savePath,
+        pixelSizeZ,
+        titles,
+        cameraToExcitation,
+        writerThreads=0,
+        useMemmap=False,
+        maxQueueBytes=float("inf"),
+        spillDir=None,
+        spillBytes=0,
+        filePerCamera=False,
+        zIndexMap=None,
+        objectives=None,
+        telemetryPath=None,
+    ):
+        self.cameras = cameras
+        self.numReps = numReps
+        self.repDuration = repDuration
+        self.cameraToImagesPerRep = cameraToImagesPerRep
+        self.cameraToIgnoredImageIndices = cameraToIgnoredImageIndices
+        self.runThread = runThread
+
+        ## We want to write the excitation wavelength for each image
+        ## on the metadata (see issue #290).  We only allow one
+        ## excitation wavelength per image.  This is a limitation of
+        ## the dv format.  We also assume that all images from a
+        ## camera will have the same light source.  This is a
+        ## limitation of the cockpit interface.
+        self.cameraToExcitation = cameraToExcitation
+
+        ## Maximum size, in megabytes, of each file generated.  If the
+        # experiment data exceeds this, then a new file will be opened, and
+        # each file will have a suffix appended to it (e.g.  ".001", ".002",
+        # etc.). This is not a precise cap, since it only considers the amount
+        # of space allocated to image data -- not the header or extended
+        # header.
+        # The default of a googol megabytes ought to be enough to avoid
+        # splitting files if no cap is specified. :)
+        self.maxFilesize = 10**100
+
+        global uniqueID
+        ## Unique ID for our instance
+        self.uniqueID = uniqueID
+        uniqueID += 1
+        # Assign a number to each camera, for indexing into our data array
+        # later, and figure out how many images per camera we'll actually be
+        # *keeping*.
+        ## We need to establish a consistent ordering for cameras so that
+        # each image gets stored in the correct part of the file. This
+        # maps camera handlers to indices.
+        self.cameraToIndex = {}
+        ## Maps camera handlers to total images kept per rep.
+        self.cameraToImagesKeptPerRep = {}
+        for i, camera in enumerate(self.cameras):
+            self.cameraToIndex[camera] = i
+            self.cameraToImagesKeptPerRep[camera] = self.cameraToImagesPerRep[
+                camera
+            ] - len(self.cameraToIgnoredImageIndices[camera])
+
+        self.zIndexMap = zIndexMap
+        if self.zIndexMap is not None:
+            for camera, numKept in self.cameraToImagesKeptPerRep.items():
+                if numKept != len(self.zIndexMap):
+                    raise ValueError(
+                        "Z index map has %d entries but %s keeps %d images"
+                        " per rep"
+                        % (len(self.zIndexMap), camera.name, numKept)
+                    )
+
+        ## Maps ints to cameras; the ints represent the order in which the
+        # images are stored.
+        self.indexToCamera = {v: k for k, v in self.cameraToIndex.items()}
+        ## Timestamp of the first image we receive.
+        # We need this so we can rebase the timestamps of images to
+        # to be relative to the beginning of the experiment -- Python
+        # timestamps can't be stored directly as 32-bit floating points without
+        # losing a lot of precision. And we want to store image timestamps in
+        # the extended header, to help us identify when frames get dropped.
+        self.firstTimestamp = None
+
+        ## Time at which we last received an image, so we know when images
+        # have stopped arriving.
+        self.lastImageTime = time.time()
+        self.startTime = time.time()
+
+        if objectives is None:
+            objectives = wx.GetApp().Objectives
+
+        ## Sets of files the data is written to.  Either one set with
+        # all the cameras, or one set per camera.
+        self.fileSets = []
+        ## Maps camera handlers to the FileSet their images go in.
+        self.cameraToFileSet = {}
+        ## Path to the manifest listing the files for each camera, if
+        # there is one.
+        self.manifestPath = None
+        if filePerCamera:
+            for camera in self.cameras:
+                fileSet = FileSet(
+                    [camera],
+                    getCameraPath(savePath, camera),
+                    self.numReps,
+                    self.cameraToImagesKeptPerRep,
+                    self.maxFilesize,
+                    pixelSizeZ,
+                    titles,
+                    objectives,
+                    writerThreads,
+                    useMemmap,
+                )
+                self.fileSets.append(fileSet)
+                self.cameraToFileSet[camera] = fileSet
+            self.manifestPath = getManifestPath(savePath)
+        else:
+            fileSet = FileSet(
+                self.cameras,
+                savePath,
+                self.numReps,
+                self.cameraToImagesKeptPerRep,
+                self.maxFilesize,
+                pixelSizeZ,
+                titles,
+                objectives,
+                writerThreads,
+                useMemmap,
+            )
+            self.fileSets.append(fileSet)
+            for camera in self.cameras:
+                self.cameraToFileSet[camera] = fileSet
+        ## Filenames for all the files we write to.
+        self.filenames = []
+        for fileSet in self.fileSets:
+            self.filenames.extend(fileSet.filenames)
+        if self.manifestPath is not None:
+            self.writeManifest()
+
+        ## This will hold the metadata floats for one image plane at
+        ## a time, to be written into the extended header.  We could
+        ## create a new array for each plane but these arrays are
+        ## small and there will be many image planes.  We do this to
+        ## avoid memory fragmentation.  Writers do not keep a
+        ## reference to it, so it is safe to reuse.
+        self.floatMetadataBuffer = numpy.zeros(
+            FileSet.numFloats, numpy.float32
+        )
+        self.floatMetadataBuffer[12] = 1.0  # intensity scaling
 
         ## List of how many images we've received, on a per-camera basis.
         self.imagesReceived = [0] * len(self.cameras)
@@ -316,35 +1282,41 @@ class DataSaver:
         ## List of functions that receive image data and feed it into
         # self.imagesReceived.
         self.lambdas = []
-        ## List of (min, max) tuples, on a per-camera basis, tracking
-        # the dimmest and brightest pixels.
-        self.minMaxVals = []
 
         ## True if we should stop collecting data.
         self.shouldAbort = False
         ## True if we are done collecting data.
         self.amDone = False
-        ## Queue of (camera index, image data, timestamp) tuples for images
+        ## Queue of (camera index, image data, metadata) tuples for images
         # that need to be saved
-        self.imageQueue = queue.Queue()
+        self.imageQueue = ImageQueue(
+            len(self.cameras), maxQueueBytes, spillDir, spillBytes
+        )
 
         # Use dye name if available, otherwise use camera name.
         names = [camera.dye or camera.name for camera in self.cameras]
         totals = []
         for camera in self.cameras:
             totals.append(self.cameraToImagesKeptPerRep[camera] * self.numReps)
+        ## Statistics on how saving keeps up.
+        self.telemetry = SaveTelemetry(
+            names, totals, self.imageQueue, telemetryPath
+        )
         ## Thread that handles updating the UI.
         self.statusThread = StatusUpdateThread(
-            names, totals, self.numReps, self.repDuration
+            names, totals, self.numReps, self.repDuration, self.telemetry
         )
 
-        # Start the data-saving thread.
-        self.saveData()
+        ## Thread that takes images off the queue and writes them.  It
+        # has to finish before the files are closed.
+        self.saveThread = threading.Thread(
+            target=self.saveData, name="DataSaver-save", daemon=True
+        )
+        self.saveThread.start()
 
     ## Subscribe to the new-camera-image events for the cameras we care about.
     # Save the functions we generate for handling the subscriptions, so we can
-    # unsubscribe later. Initialize self.minMaxVals. Start our status-update
-    # thread.
+    # unsubscribe later. Start our status-update thread.
     def startCollecting(self):
         for camera in self.cameras:
 
@@ -353,8 +1325,6 @@ class DataSaver:
 
             self.lambdas.append(func)
             events.subscribe(events.NEW_IMAGE % camera.name, func)
-
-            self.minMaxVals.append((float("inf"), float("-inf")))
         events.subscribe(events.USER_ABORT, self.onAbort)
         self.statusThread.start()
 
@@ -393,26 +1363,44 @@ class DataSaver:
 
         self.cleanup()
 
-        # Determine min/max vals for each wavelength.
-        for header in self.headers:
-            for i in range(len(self.cameras)):
-                # HACK: camera 1 is supposed to get min/max/median. However,
-                # computing the median of a large dataset takes a very long
-                # time (30s for a 2GB file on a fairly powerful computer),
-                # so we just store 0.
-                minVal, maxVal = self.minMaxVals[i]
-                if i == 0:
-                    setattr(header, "mmm1", (minVal, maxVal, 0))
-                else:
-                    setattr(header, "mm%d" % (i + 1), (minVal, maxVal))
-        # Rewrite the headers, now that we know what the min/max values are.
-        # Of course, these won't be precisely accurate for every file.
-        # \todo Track min/max values on a per-file basis.
-        # Then, close the filehandle.
-        for i, handle in enumerate(self.filehandles):
-            with self.fileLocks[i]:
-                cockpit.util.datadoc.writeMrcHeader(self.headers[i], handle)
-                handle.close()
+        # Stop the saving thread and wait for it, so that no image is
+        # being written while the files are closed.
+        self.imageQueue.stop()
+        self.saveThread.join()
+
+        # Rewrite the headers, now that we know what the min/max values
+        # are.  Then, close the filehandles.
+        for fileSet in self.fileSets:
+            fileSet.setHeaderStatistics()
+            fileSet.writeHeaders()
+            fileSet.close()
+        self.imageQueue.close()
+        self.logQueueStatistics()
+
+    ## Log how far the save queue grew, and how many images were
+    # spilled to the scratch file or dropped, for each camera.
+    def logQueueStatistics(self):
+        imageQueue = self.imageQueue
+        _logger.info(
+            "Save queue peaked at %d images, %.1f MB in memory",
+            imageQueue.maxDepth,
+            imageQueue.maxBytesQueued / 1024.0 / 1024.0,
+        )
+        for i, camera in enumerate(self.cameras):
+            if imageQueue.numSpilled[i]:
+                _logger.info(
+                    "%s: spilled %d images (%.1f MB) to scratch file",
+                    camera.name,
+                    imageQueue.numSpilled[i],
+                    imageQueue.bytesSpilled[i] / 1024.0 / 1024.0,
+                )
+            if imageQueue.numDropped[i]:
+                _logger.warning(
+                    "%s: dropped %d images because the save queue was"
+                    " full; their planes are left blank",
+                    camera.name,
+                    imageQueue.numDropped[i],
+                )
 
     ## Clean up once saving is completed.
     def cleanup(self):
@@ -421,18 +1409,23 @@ class DataSaver:
             events.unsubscribe(events.NEW_IMAGE % camera.name, self.lambdas[i])
         events.unsubscribe(events.USER_ABORT, self.onAbort)
 
-    ## Receive new data, and add it to the queue.
+    ## Receive new data, and add it to the queue.  The time it arrived
+    # is recorded here, since the timestamp in its metadata may be from
+    # the clock of a remote device server or of the camera itself.
     def onImage(self, cameraIndex, imageData, metadata):
-        self.imageQueue.put((cameraIndex, imageData, metadata))
+        self.imageQueue.put(cameraIndex, imageData, metadata, time.time())
 
-    ## Continually poll our imageQueue and save data to the file.
-    @cockpit.util.threads.callInNewThread
+    ## Continually poll our imageQueue and save data to the file, until
+    # we are done or the queue is stopped.
     def saveData(self):
         while not self.amDone:
             if self.shouldAbort:
                 # Do nothing.
                 return
-            cameraIndex, imageData, metadata = self.imageQueue.get()
+            entry = self.imageQueue.get()
+            if entry is None:
+                return
+            cameraIndex, imageData, metadata, arrivalTime = entry
             timestamp = metadata["timestamp"]
             if self.firstTimestamp is None:
                 self.firstTimestamp = timestamp
@@ -441,10 +1434,11 @@ class DataSaver:
             # rebase then the numbers are big enough that we lose decimal
             # precision.
             timestamp = timestamp - self.firstTimestamp
-            self.writeImage(cameraIndex, imageData, timestamp)
+            self.writeImage(cameraIndex, imageData, timestamp, arrivalTime)
 
-    ## Write a single image to the file.
-    def writeImage(self, cameraIndex, imageData, timestamp):
+    ## Write a single image to the file.  arrivalTime is the time.time()
+    # at which it was received, for the telemetry.
+    def writeImage(self, cameraIndex, imageData, timestamp, arrivalTime):
         self.imagesReceived[cameraIndex] += 1
         camera = self.indexToCamera[cameraIndex]
         # First determine if we actually want to keep this image.
@@ -454,109 +1448,83 @@ class DataSaver:
         ) in self.cameraToIgnoredImageIndices[camera]:
             # This image is one that should be discarded.
             return
+        if imageData is None:
+            # The image was dropped from the queue.  Leave its plane
+            # blank, but count it so later images go to the right place.
+            self.imagesKept[cameraIndex] += 1
+            self.lastImageTime = time.time()
+            self.telemetry.recordImage(cameraIndex, 0, None)
+            return
 
-        # Calculate the time and Z indices for the new image. This will in turn
-        # help us to calculate which file to write to and the offset of the
+        # Calculate the Z index for the new image. This will in turn help
+        # us to calculate which file to write to and the offset of the
         # image in the file.
         numImages = self.imagesKept[cameraIndex]
-        timepoint = numImages // self.maxImagesPerRep
-        fileIndex = timepoint // self.maxRepsPerFile
-        # Rebase the timepoint to be relative to the beginning of this specific
-        # file.
-        timepoint -= fileIndex * self.maxRepsPerFile
         zIndex = numImages % self.cameraToImagesKeptPerRep[camera]
-
-        numCameras = len(self.cameras)
-        planeIndex = (
-            int(timepoint * self.maxImagesPerRep * numCameras)
-            + (zIndex * numCameras)
-            + cameraIndex
+        if self.zIndexMap is not None:
+            zIndex = self.zIndexMap[zIndex]
+        fileSet = self.cameraToFileSet[camera]
+        fileIndex, planeIndex = fileSet.getPlaneLocation(
+            camera, numImages, zIndex
         )
 
-        ## Offsets for the plane metadata in the extended header, and
-        ## for the plane data in the image section.  1024 is the
-        ## length of the base header.
-        metadataOffset = 1024 + (planeIndex * self.extendedBytes)
-        dataOffset = (
-            1024
-            + int(self.headers[fileIndex].next)
-            + (planeIndex * self.planeBytes)
+        imageMin, imageMax = fileSet.addImageStatistics(
+            fileIndex, camera, imageData
         )
 
-        height, width = imageData.shape
-
-        # Pad with zeros. I wouldn't normally think this would be
-        # necessary, but we get "invalid argument" errors when writing
-        # to the filehandle if we don't.
-        # \todo Figure out why this is necessary.
-        paddedBuffer = numpy.zeros(
-            (self.maxHeight, self.maxWidth), dtype=numpy.uint16
-        )
-        paddedBuffer[:height, :width] = imageData
-
-        imageMin = imageData.min()
-        imageMax = imageData.max()
-
         ex_wavelength = self.cameraToExcitation[camera]
         em_wavelength = camera.wavelength
 
-        with self.fileLocks[fileIndex]:
-            handle = self.filehandles[fileIndex]
-
-            ## The extended header has the following structure per
-            ## plane (see issue #290):
-            ##
-            ##     8 32bit signed integers whose meaning we don't
-            ##     know.  Often are all set to zero.
-            ##
-            ##     Followed by 32 32bit floats.  We only what the
-            ##     first 14 are:
-            ##
-            ##     photosensor reading (typically in mV)
-            ##     elapsed time (seconds since experiment began)
-            ##     x stage coordinates
-            ##     y stage coordinates
-            ##     z stage coordinates
-            ##     minimum intensity
-            ##     maximum intensity
-            ##     mean intensity
-            ##     exposure time (seconds)
-            ##     neutral density (fraction of 1 or percentage)
-            ##     excitation wavelength
-            ##     emission wavelength
-            ##     intensity scaling (usually 1)
-            ##     energy conversion factor (usually 1)
-            ##
-            ## Experience from inspecting actual dv files from API
-            ## systems, tells us that we can leave most of them at
-            ## zero.
-            intMetadataBuffer = self.intMetadataBuffers[fileIndex]
-            floatMetadataBuffer = self.floatMetadataBuffers[fileIndex]
-            floatMetadataBuffer[1] = timestamp
-            floatMetadataBuffer[5] = imageMin
-            floatMetadataBuffer[6] = imageMax
-            # TODO floatMetadataBuffer[8] could be exposure time in seconds
-            floatMetadataBuffer[10] = ex_wavelength
-            floatMetadataBuffer[11] = em_wavelength
+        ## The extended header has the following structure per
+        ## plane (see issue #290):
+        ##
+        ##     8 32bit signed integers whose meaning we don't
+        ##     know.  Often are all set to zero.
+        ##
+        ##     Followed by 32 32bit floats.  We only what the
+        ##     first 14 are:
+        ##
+        ##     photosensor reading (typically in mV)
+        ##     elapsed time (seconds since experiment began)
+        ##     x stage coordinates
+        ##     y stage coordinates
+        ##     z stage coordinates
+        ##     minimum intensity
+        ##     maximum intensity
+        ##     mean intensity
+        ##     exposure time (seconds)
+        ##     neutral density (fraction of 1 or percentage)
+        ##     excitation wavelength
+        ##     emission wavelength
+        ##     intensity scaling (usually 1)
+        ##     energy conversion factor (usually 1)
+        ##
+        ## Experience from inspecting actual dv files from API
+        ## systems, tells us that we can leave most of them at
+        ## zero.
+        floatMetadataBuffer = self.floatMetadataBuffer
+        floatMetadataBuffer[1] = timestamp
+        floatMetadataBuffer[5] = imageMin
+        floatMetadataBuffer[6] = imageMax
+        # TODO floatMetadataBuffer[8] could be exposure time in seconds
+        floatMetadataBuffer[10] = ex_wavelength
+        floatMetadataBuffer[11] = em_wavelength
 
-            try:
-                handle.seek(metadataOffset)
-                handle.write(intMetadataBuffer)
-                handle.write(floatMetadataBuffer)
-                handle.seek(dataOffset)
-                handle.write(paddedBuffer)
-            except Exception as e:
-                print("Error writing image:", e)
-                raise e
-
-            self.imagesKept[cameraIndex] += 1
-            self.lastImageTime = time.time()
-
-            curMin, curMax = self.minMaxVals[cameraIndex]
-            self.minMaxVals[cameraIndex] = (
-                min(curMin, imageMin),
-                max(curMax, imageMax),
+        try:
+            fileSet.writer.writePlane(
+                fileIndex, planeIndex, floatMetadataBuffer, imageData
             )
+        except Exception as e:
+            print("Error writing image:", e)
+            raise e
+
+        self.imagesKept[cameraIndex] += 1
+        self.lastImageTime = time.time()
+        self.telemetry.recordImage(
+            cameraIndex,
+            imageData.nbytes,
+            self.lastImageTime - arrivalTime,
+        )
 
         # Update the status text. But first, check for abort/experiment
         # completion, since we may actually be done now and we don't want
@@ -565,15 +1533,56 @@ class DataSaver:
             return
         self.statusThread.newImage(cameraIndex)
 
-    ## Return a list of the filenames we are writing to.
+    ## Return a list of the filenames we are writing to.  This does not
+    # include the manifest, if any.
     def getFilenames(self):
         return self.filenames
 
+    ## Return the path to the manifest, or None if all cameras are
+    # saved to the same files.
+    def getManifestPath(self):
+        return self.manifestPath
+
+    ## Write a manifest listing the files of each camera, relative to the
+    # manifest itself, so that the channels of the experiment can be
+    # found and put back together.
+    def writeManifest(self):
+        manifestDir = os.path.dirname(self.manifestPath)
+        channels = []
+        for camera in self.cameras:
+            fileSet = self.cameraToFileSet[camera]
+            channels.append(
+                {
+                    "camera": camera.name,
+                    "dye": camera.dye,
+                    "wavelength": float(camera.wavelength),
+                    "excitation": float(self.cameraToExcitation[camera]),
+                    "image_size": [fileSet.maxWidth, fileSet.maxHeight],
+                    "images_per_rep": self.cameraToImagesKeptPerRep[camera],
+                    "files": [
+                        os.path.relpath(f, manifestDir or os.curdir)
+                        for f in fileSet.filenames
+                    ],
+                }
+            )
+        manifest = {
+            "format": "cockpit-per-camera",
+            "version": 1,
+            "num_reps": self.numReps,
+            "rep_duration": self.repDuration,
+            "channels": channels,
+        }
+        with open(self.manifestPath, "w") as fh:
+            json.dump(manifest, fh, indent=2)
+
 
 ## This thread handles telling the saving status light to update twice per
-# second.
+# second.  If given a SaveTelemetry, it also publishes a snapshot of it
+# as SAVE_STATUS, and logs it, as often.
 class StatusUpdateThread(threading.Thread):
-    def __init__(self, cameraNames, totals, numReps, repDuration):
+    def __init__(
+        self, cameraNames, totals, numReps, repDuration, telemetry=None
+    ):
         super().__init__()
         ## List of names of the cameras.
         self.cameraNames = cameraNames
@@ -586,15 +1595,23 @@ class StatusUpdateThread(threading.Thread):
         self.numReps = numReps
         self.repDuration = repDuration
         self.startTime = time.time()
+        self.telemetry = telemetry
+        ## Most recent telemetry snapshot, or None.
+        self.snapshot = None
         ## Set to True to end the thread.
         self.shouldStop = False
         self.name = "DataSaver-status"
 
     def run(self):
         prevCounts = list(self.imagesReceived)
+        self.updateTelemetry()
+        nextTelemetryTime = time.time() + 0.5
         self.updateText()
         count = 0
         while not self.shouldStop:
+            if time.time() >= nextTelemetryTime:
+                self.updateTelemetry()
+                nextTelemetryTime += 0.5
             if prevCounts != self.imagesReceived:
                 # Have received new images since the last update;
                 # update the display.
@@ -609,9 +1626,26 @@ class StatusUpdateThread(threading.Thread):
                 if count == 5:
                     count = 0
                     self.updateText()
-        # Clear the status light.
+        # Publish and log the final statistics, then clear the status
+        # light.
+        self.updateTelemetry()
+        if self.telemetry is not None:
+            self.telemetry.close()
         events.publish(events.UPDATE_STATUS_LIGHT, "image count", "")
 
+    ## Take, publish, and log a new telemetry snapshot.
+    def updateTelemetry(self):
+        if self.telemetry is None:
+            return
+        self.snapshot = self.telemetry.getSnapshot()
+        events.publish(events.SAVE_STATUS, self.snapshot)
+        try:
+            self.telemetry.log(self.snapshot)
+        except OSError as e:
+            # Losing the log must not stop the experiment.
+            _logger.warning("Failed to log saving telemetry: %s", e)
+            self.telemetry.logPath = None
+
     ## Push a new text to the status light.
     def updateText(self):
         statusText = []
@@ -624,6 +1658,14 @@ class StatusUpdateThread(threading.Thread):
             repTime = (time.time() - self.startTime) % self.repDuration
             timeleft = self.repDuration - repTime
             statusText.append("waiting %.0fs for next repeat" % timeleft)
+        if self.snapshot is not None:
+            statusText.append(
+                "%.0f MB/s, %d queued"
+                % (
+                    sum(c["mbps"] for c in self.snapshot["cameras"]),
+                    self.snapshot["queue_depth"],
+                )
+            )
         events.publish(
             events.UPDATE_STATUS_LIGHT, "image count", " | ".join(statusText)
         )
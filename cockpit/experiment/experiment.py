@@ -51,19 +51,20 @@
 ## POSSIBILITY OF SUCH DAMAGE.
 
 import decimal
-import gc
 import logging
 import os
 import threading
 import time
 
+import numpy
 import wx
 from microscope import ElectronicShutteringMode
 
 import cockpit.handlers.camera
 import cockpit.interfaces.stageMover
+import cockpit.util.sequencer
 from cockpit import depot, events
-from cockpit.experiment import dataSaver
+from cockpit.experiment import actionTable, dataSaver, simulator
 from cockpit.gui import guiUtils
 
 
@@ -146,6 +147,9 @@ class Experiment:
         self.otherHandlers = list(otherHandlers)
         self.metadata = metadata
         self.savePath = savePath
+        ## Files the images are saved to, once the experiment has started.
+        # These are based on savePath, but there may be several of them.
+        self.dataFilenames = []
 
         self._run_thread = None
 
@@ -199,6 +203,14 @@ class Experiment:
         # when setting the "titles" in the MRC header.
         self.lightToExposureTime = {l: set() for l in self.lights}
 
+        ## List of (executor, startIndex, stopIndex) runs of self.table to
+        # execute, from makeExecutionPlan, and the table it is for.
+        self.executionPlan = None
+        self._executionPlanTable = None
+        ## TimingRecord of when execute ran software timed actions, and
+        # started executors, compared to when they were due.
+        self.softwareTiming = None
+
     ## Cancel the experiment, if it's running.
     def onAbort(self):
         self.shouldAbort = True
@@ -208,9 +220,15 @@ class Experiment:
     def run(self):
         # Returns True to close config dialog box, False or None otherwise.
         # Check if the user is set to save to an already-existing file.
-        if self.savePath and os.path.exists(self.savePath):
+        # When saving a file per camera, the manifest stands in for them.
+        savingConfig = wx.GetApp().Config["saving"]
+        filePerCamera = savingConfig.getboolean("file-per-camera")
+        checkPath = self.savePath
+        if self.savePath and filePerCamera:
+            checkPath = dataSaver.getManifestPath(self.savePath)
+        if checkPath and os.path.exists(checkPath):
             if not guiUtils.getUserPermission(
-                ("The file:\n%s\nalready exists. " % self.savePath)
+                ("The file:\n%s\nalready exists. " % checkPath)
                 + "Are you sure you want to overwrite it?"
             ):
                 return False
@@ -254,6 +272,9 @@ class Experiment:
             # set repDuration to the last table action
             self.repDuration = float(self.table.lastActionTime) / 1000.0
 
+        if not self.preflightCheck():
+            return False
+
         if not self.lastMinuteActions():
             return False
 
@@ -284,6 +305,13 @@ class Experiment:
                         cameraToExcitation[camera], max_wavelength
                     )
 
+            telemetryPath = None
+            if savingConfig.getboolean("telemetry-log"):
+                telemetryPath = dataSaver.getTelemetryPath(self.savePath)
+            # Images waiting to be saved are only limited if configured.
+            maxQueueBytes = float("inf")
+            if savingConfig.get("queue-memory"):
+                maxQueueBytes = savingConfig.getint("queue-memory") * 2**20
             saver = dataSaver.DataSaver(
                 self.cameras,
                 self.numReps,
@@ -295,13 +323,22 @@ class Experiment:
                 self.sliceHeight,
                 self.generateTitles(),
                 cameraToExcitation,
+                writerThreads=savingConfig.getint("writer-threads"),
+                useMemmap=savingConfig.getboolean("memory-map"),
+                maxQueueBytes=maxQueueBytes,
+                spillDir=savingConfig.getpath("spill-dir") or None,
+                spillBytes=savingConfig.getint("spill-size") * 2**20,
+                filePerCamera=filePerCamera,
+                zIndexMap=self.getZIndexMap(),
+                telemetryPath=telemetryPath,
             )
             saver.startCollecting()
             saveThread = threading.Thread(
                 target=saver.executeAndSave, name="Experiment-execute-save"
             )
             saveThread.start()
-            generatedFilenames.append(saver.getFilenames())
+            self.dataFilenames = saver.getFilenames()
+            generatedFilenames.append(self.dataFilenames)
 
         self._run_thread.start()
 
@@ -321,6 +358,9 @@ class Experiment:
         self.examineActions()
         self.table.sort()
         self.table.enforcePositiveTimepoints()
+        # Plan now so that a table we cannot run fails before we start.
+        self.getExecutionPlan()
+        _logger.debug("Execution plan:\n%s", self.describeExecutionPlan())
 
     ## Perform any necessary sanity checks to ensure that the environment is
     # set up properly. Raise an exception if anything is wrong.
@@ -357,14 +397,187 @@ class Experiment:
     ## Allow devices to examine the ActionTable we will be running, and modify
     # it if necessary.
     def examineActions(self):
+        # Repeat blocks that no executor can repeat by itself have to be
+        # run one repeat at a time, so expand them.
+        self.table.expandRepeats(
+            [
+                block
+                for block in self.table.getRepeatBlocks()
+                if self.getRepeatExecutor(block) is None
+            ]
+        )
         for handler in depot.getHandlersOfType(depot.EXECUTOR):
             handler.examineActions(self.table)
+            for block in self.table.getRepeatBlocks():
+                handler.examineActions(block.table)
+
+    ## Return an executor that can run all the actions of a RepeatBlock
+    # and repeat them itself, or None if there is none.
+    def getRepeatExecutor(self, block):
+        for executor in depot.getHandlersOfType(depot.EXECUTOR):
+            if executor.supportsRepeats and executor.getNumRunnableLines(
+                block.table, 0
+            ) == len(block.table):
+                return executor
+        return None
+
+    ## Return a function that performs an action in software, for actions
+    # that no executor can run, or None if it cannot be done in software.
+    def getSoftwareAction(self, handler, action):
+        if (
+            handler.deviceType == depot.CAMERA
+            and "softTrigger" in handler.callbacks
+        ):
+            return lambda: handler.callbacks["softTrigger"]()
+        elif handler.deviceType == depot.STAGE_POSITIONER:
+            return lambda: handler.moveAbsolute(action)
+        return None
+
+    ## Split self.table into runs of actions for executors, as a list of
+    # (executor, startIndex, stopIndex).  Starting from the first action,
+    # each run goes to the executor that can run the most actions in a row
+    # from there, with the first executor winning ties.  Actions that no
+    # executor can run get a run of their own with None for executor, to be
+    # done in software, and so do RepeatBlocks, with the executor to repeat
+    # them.  Raise a RuntimeError if any action cannot be run at all.
+    def makeExecutionPlan(self):
+        executors = depot.getHandlersOfType(depot.EXECUTOR)
+        numRows = len(self.table)
+        rows = numpy.arange(numRows)
+        # Number of actions in a row that each executor can run, starting
+        # from each action.
+        runLengths = numpy.zeros((len(executors) + 1, numRows), int)
+        for i, executor in enumerate(executors):
+            canRun = self.table.getHandlerMask(executor.getRunnableHandlers())
+            # Index of the first action at or after each action that the
+            # executor cannot run.
+            stops = numpy.where(canRun, numRows, rows)
+            stops = numpy.minimum.accumulate(stops[::-1])[::-1]
+            runLengths[i] = stops - rows
+        plan = []
+        index = 0
+        while index < numRows:
+            best = numpy.argmax(runLengths[:, index])
+            numLines = runLengths[best, index]
+            if numLines:
+                plan.append((executors[best], index, index + numLines))
+                index += numLines
+                continue
+            t, h, action = self.table[index]
+            executor = None
+            if isinstance(h, actionTable.RepeatBlock):
+                executor = self.getRepeatExecutor(h)
+                if executor is None:
+                    raise RuntimeError(
+                        "Found a repeat block that no executor could repeat:"
+                        " %s" % str(self.table[index])
+                    )
+            elif self.getSoftwareAction(h, action) is None:
+                raise RuntimeError(
+                    "Found a line that no executor could handle: %s"
+                    % str(self.table[index])
+                )
+            plan.append((executor, index, index + 1))
+            index += 1
+        return plan
+
+    ## Return the execution plan for self.table, making it if it has not
+    # been made for this table.
+    def getExecutionPlan(self):
+        if self._executionPlanTable is not self.table:
+            self.executionPlan = self.makeExecutionPlan()
+            self._executionPlanTable = self.table
+        return self.executionPlan
+
+    ## Return a description of the execution plan, a line for each run.
+    def describeExecutionPlan(self):
+        lines = []
+        for executor, startIndex, stopIndex in self.getExecutionPlan():
+            startTime = self.table[startIndex][0]
+            handler = self.table[startIndex][1]
+            if isinstance(handler, actionTable.RepeatBlock):
+                what = "%s repeats %s" % (executor.name, handler.name)
+            elif executor is None:
+                what = "software: %s" % handler.name
+            else:
+                what = executor.name
+            lines.append(
+                "%10.2f ms  actions %d-%d  %s"
+                % (startTime, startIndex, stopIndex - 1, what)
+            )
+        return "\n".join(lines)
+
+    ## Replay our ActionTable, for all reps, in simulated time against
+    # models of our devices, and return a simulator.SimulationReport.
+    # Only the first two reps are replayed, so this is quick enough to
+    # run from the GUI thread however many reps there are.
+    def simulate(self):
+        models = simulator.makeModels(
+            {h for t, h, p in self.table.iterExpanded()}
+        )
+        repDuration = None
+        if self.repDuration is not None:
+            repDuration = decimal.Decimal(self.repDuration) * 1000
+        return simulator.simulate(
+            self.table, models, self.numReps, repDuration
+        )
+
+    ## Simulate the experiment before running it, and give the user a
+    # chance to cancel it if that finds timing conflicts.  Return False
+    # to cancel.  This is skipped if turned off in the config, and the
+    # experiment runs without it if the simulation fails.
+    def preflightCheck(self):
+        experimentConfig = wx.GetApp().Config["experiment"]
+        if not experimentConfig.getboolean("preflight-check"):
+            return True
+        try:
+            report = self.simulate()
+        except Exception:
+            _logger.exception(
+                "Failed to simulate the experiment, running it without"
+                " a pre-flight check"
+            )
+            return True
+        _logger.info("Simulated experiment:\n%s", report.describe())
+        for camera in self.cameras:
+            expected = self.cameraToImageCount[camera] * self.numReps
+            stats = report.cameras.get(camera.name)
+            simulated = stats["images"] if stats else 0
+            if simulated != expected:
+                _logger.warning(
+                    "Simulation of %s took %d images instead of %d",
+                    camera.name,
+                    simulated,
+                    expected,
+                )
+        if report.conflicts:
+            conflicts = report.conflicts[:10]
+            if len(report.conflicts) > len(conflicts):
+                conflicts.append(
+                    "... and %d more"
+                    % (len(report.conflicts) - len(conflicts))
+                )
+            warning = (
+                "Simulating the experiment found timing conflicts:\n\n%s"
+                "\n\nChoose:"
+                "\n    'OK' to run it anyway;"
+                "\n    'Cancel' to go back and change parameters."
+            ) % "\n".join(conflicts)
+            if not guiUtils.getUserPermission(warning):
+                return False
+        return True
 
     ## Do any last-minute actions immediately before starting the experiment.
     # Return False if anything goes wrong.
     def lastMinuteActions(self):
         return True
 
+    ## Return a list mapping each image kept from a camera in a rep, in
+    # the order they are taken, to its Z index in the saved file, or None
+    # to save them in the order taken.
+    def getZIndexMap(self):
+        return None
+
     ## Generate an ActionTable of events to perform during the experiment.
     # Return the ActionTable instance.
     def generateActions(self):
@@ -373,104 +586,88 @@ class Experiment:
     ## Run the experiment. Return True if it was successful.
     def execute(self):
         _logger.info("Experiment.execute started.")
-        # Iteratively find the ExperimentExecutor that can tackle the largest
-        # portion of self.table, have them run it, and wait for them to finish.
-        executors = depot.getHandlersOfType(depot.EXECUTOR)
+        # Have the executors run their part of self.table, as planned by
+        # makeExecutionPlan, and wait for them to finish.  Everything
+        # that is timed in software, i.e. actions that no executor can
+        # run and when each executor is started, is run by the shared
+        # sequencer at deadlines relative to the start of each rep.
+        plan = self.getExecutionPlan()
+        sequencer = cockpit.util.sequencer.getSequencer()
+        self.softwareTiming = cockpit.util.sequencer.TimingRecord()
         self.shouldAbort = False
         for rep in range(self.numReps):
-            startTime = time.time()
+            startTime = time.perf_counter_ns()
             repDuration = None
-            curIndex = 0
             shouldStop = False
-            # Need to track delay introduced by dropping back to software timing.
-            delay = 0.0
-            while curIndex < len(self.table):
-                if curIndex > 0:
+            # Need to track delay introduced by dropping back to software
+            # timing, in nanoseconds.
+            delay = 0
+            for executor, startIndex, stopIndex in plan:
+                t, h, action = self.table[startIndex]
+                if isinstance(h, actionTable.RepeatBlock):
+                    # Executors start with the first action of the
+                    # block, which may come after its start.
+                    t += h.table.getFirstAndLastActionTimes()[0]
+                dueTime = startTime + actionTable.timeToTicks(t)[0]
+                if startIndex > 0:
                     # Update the delay
-                    nextTime = (
-                        delay
-                        + startTime
-                        + float(self.table[curIndex][0]) / 1000.0
-                    )
-                    delay += max(0, time.time() - nextTime)
+                    delay += max(0, time.perf_counter_ns() - delay - dueTime)
 
                 if self.shouldAbort:
                     _logger.error(
                         "Cancelling on rep %d after %d actions due to user abort",
                         rep,
-                        curIndex,
+                        startIndex,
                     )
                     break
-                best = None
-                bestLen = 0
-                for executor in executors:
-                    numLines = executor.getNumRunnableLines(
-                        self.table, curIndex
-                    )
-                    if best is None or numLines > bestLen:
-                        best = executor
-                        bestLen = numLines
-                numReps = 1
-                if bestLen == len(self.table):
-                    # This executor can handle the entire experiment, so we
-                    # should tell them to handle the repeats as well.
-                    numReps = self.numReps
-                    shouldStop = True
-                    # Expand from seconds to milliseconds
-                    repDuration = self.repDuration * 1000
-
-                if bestLen == 0:
-                    # No executor can run this line. See if we can fall back to software.
-                    fn = None
-                    t, h, action = self.table[curIndex]
-                    if (
-                        h.deviceType == depot.CAMERA
-                        and "softTrigger" in h.callbacks
-                    ):
-                        fn = lambda: h.callbacks["softTrigger"]()
-                    elif h.deviceType == depot.STAGE_POSITIONER:
-                        fn = lambda: h.moveAbsolute(action)
-
-                    if fn is None:
-                        raise RuntimeError(
-                            "Found a line that no executor could handle: %s"
-                            % str(self.table.actions[curIndex])
-                        )
-                    # Wait until this action is due.
-                    if curIndex > 0:
-                        timeToNext = (
-                            delay
-                            + startTime
-                            + float(self.table[curIndex][0]) / 1000.0
-                            - time.time()
+
+                if executor is None:
+                    # No executor can run this line, so fall back to
+                    # software, when this action is due.
+                    func = self.getSoftwareAction(h, action)
+                    if startIndex > 0:
+                        self.softwareTiming.extend(
+                            sequencer.run([(delay + dueTime, func)])
                         )
-                        time.sleep(max(0, timeToNext))
-                    fn()
-                    curIndex += 1
+                    else:
+                        func()
+                    continue
+
+                # Don't resume execution too early.
+                # TODO: would be better to pass a 'do not start before' argument
+                # to the handler, so any work it has to do does not add further
+                # delays.
+                if startIndex > 0:
+                    self.softwareTiming.extend(sequencer.wait(delay + dueTime))
+                if isinstance(h, actionTable.RepeatBlock):
+                    # Have the executor repeat the block.
+                    events.executeAndWaitFor(
+                        events.EXPERIMENT_EXECUTION,
+                        executor.executeTable,
+                        h.table,
+                        0,
+                        len(h.table),
+                        h.count,
+                        float(h.interval),
+                    )
                 else:
-                    # Don't resume execution too early.
-                    # TODO: would be better to pass a 'do not start before' argument
-                    # to the handler, so any work it has to do does not add further
-                    # delays.
-                    if curIndex > 0:
-                        timeToNext = (
-                            delay
-                            + startTime
-                            + float(self.table[curIndex][0]) / 1000.0
-                            - time.time()
-                        )
-                        time.sleep(max(0, timeToNext))
-
+                    numReps = 1
+                    if stopIndex - startIndex == len(self.table):
+                        # This executor can handle the entire experiment, so we
+                        # should tell them to handle the repeats as well.
+                        numReps = self.numReps
+                        shouldStop = True
+                        # Expand from seconds to milliseconds
+                        repDuration = self.repDuration * 1000
                     events.executeAndWaitFor(
                         events.EXPERIMENT_EXECUTION,
-                        best.executeTable,
+                        executor.executeTable,
                         self.table,
-                        curIndex,
-                        curIndex + bestLen,
+                        startIndex,
+                        stopIndex,
                         numReps,
                         repDuration,
                     )
-                    curIndex += bestLen
 
             if shouldStop:
                 # All reps handled by an executor.
@@ -478,8 +675,9 @@ class Experiment:
                 break
             # Wait for the end of the rep.
             if rep != self.numReps - 1:
-                waitTime = self.repDuration - (time.time() - startTime)
-                time.sleep(max(0, waitTime))
+                sequencer.wait(startTime + int(self.repDuration * 1e9))
+        if len(self.softwareTiming):
+            _logger.info("Software timing: %s", self.softwareTiming.describe())
         ## TODO: figure out how long we should wait for the last captures to complete.
         # For now, wait 1s.
         time.sleep(1.0)
@@ -507,11 +705,6 @@ class Experiment:
             )
         events.publish(events.EXPERIMENT_COMPLETE)
         events.publish(events.UPDATE_STATUS_LIGHT, "device waiting", "")
-        # Ensure the saveThread's memory, which includes all the images
-        # collected thus far, is garbage collected. Otherwise memory tends
-        # to pile up and then the GC has more work to do, which can interfere
-        # with future experiments.
-        gc.collect()
 
     ## Generate the "titles" that provide extra miscellaneous information
     # about the experiment. These are part of the MRC file format spec:
@@ -733,6 +926,44 @@ class Experiment:
 
         return exposureEndTime
 
+    ## Like calling expose() numExposures times, but once the exposures
+    # settle into a regular pattern, add the rest as a RepeatBlock so that
+    # executors can repeat them without a row for every exposure.
+    # Return the time at which the last exposure ends.
+    def exposeRepeatedly(
+        self, curTime, cameras, lightTimePairs, table, numExposures
+    ):
+        # Each exposure depends on the ones before it, e.g. on when the
+        # cameras can be triggered again, so it is only safe to repeat an
+        # exposure once it came out the same as the previous one.
+        previous = None
+        for i in range(numExposures):
+            startRow = len(table)
+            curTime = self.expose(curTime, cameras, lightTimePairs, table)
+            actions = table[startRow:]
+            exposureStart = min(action[0] for action in actions)
+            pattern = [
+                (actionTable.timeToTicks(t - exposureStart)[0], id(h), p)
+                for t, h, p in actions
+            ]
+            pattern.append(actionTable.timeToTicks(curTime - exposureStart)[0])
+            numLeft = numExposures - i - 1
+            if previous is not None and pattern == previous[1] and numLeft:
+                interval = exposureStart - previous[0]
+                block = actionTable.ActionTable()
+                for t, h, p in actions:
+                    block.addAction(t - exposureStart, h, p)
+                block.sort()
+                if block.lastActionTime <= interval:
+                    table.addRepeat(
+                        exposureStart + interval, block, numLeft, interval
+                    )
+                    for camera in cameras:
+                        self.cameraToImageCount[camera] += numLeft
+                    return curTime + numLeft * interval
+            previous = (exposureStart, pattern)
+        return curTime
+
     ## Given a set of cameras and a time, trigger the cameras and record that
     # we want to throw away the resulting image. This blanks the camera
     # sensors so they don't record light that we don't care about.
@@ -272,8 +272,9 @@ class OffsetGainCorrectionExperiment(experiment.Experiment):
                         time * multiplier, decimal.Decimal(".1")
                     )
                     settings.append((light, exposureTime))
-                for i in range(self.numExposures):
-                    curTime = self.expose(curTime, usedCams, settings, table)
+                curTime = self.exposeRepeatedly(
+                    curTime, usedCams, settings, table, self.numExposures
+                )
         return table
 
     ## Record an image for the specified camera.
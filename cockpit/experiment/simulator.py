@@ -0,0 +1,376 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## Copyright (C) 2026 University of Oxford
+##
+## This file is part of Cockpit.
+##
+## Cockpit is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## Cockpit is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Cockpit.  If not, see <http://www.gnu.org/licenses/>.
+
+
+## This module replays an ActionTable in simulated time, against models of
+# the cameras, light sources, and positioners in it, to find out what
+# running it would do without running it.  It reports the images each
+# camera is expected to take, how much of the time cameras spend exposing
+# and lights spend on, the total duration, and any timing conflicts: a
+# camera triggered while it is still exposing or reading out, a positioner
+# told to move before it has settled, or reps that overrun.
+#
+# For example, as a pre-flight check of an experiment:
+#
+#     models = simulator.makeModels(cameras + lights + positioners)
+#     report = simulator.simulate(table, models, numReps, repDuration)
+#     for message in report.conflicts:
+#         print(message)
+
+import decimal
+
+import cockpit.handlers.camera
+from cockpit import depot
+from cockpit.experiment.actionTable import TICKS_PER_MS, timeToTicks
+
+
+## Return a Decimal, or float, time in milliseconds as integer ticks.
+def _toTicks(time):
+    return timeToTicks(decimal.Decimal(time))[0]
+
+
+## Return a time in ticks as a string in milliseconds, for messages.
+def _formatTicks(ticks):
+    return "%.4f ms" % (ticks / TICKS_PER_MS)
+
+
+## Model of a camera, which takes an image for each trigger.  How an
+# exposure relates to the triggers depends on the exposure mode:
+# - TRIGGER_BEFORE and TRIGGER_SOFT: the exposure starts at the trigger
+#   and lasts exposureTime.
+# - TRIGGER_AFTER: the exposure is from the previous trigger to this one,
+#   i.e. the camera exposes continuously.
+# - TRIGGER_DURATION: the exposure lasts while the trigger is high.
+# After each exposure, the camera reads out for readoutTime, and
+# triggering it before then is a conflict.  All times are in ticks.
+class CameraModel:
+    ## Attributes that accumulate over reps.
+    counters = ("numImages", "exposedTime")
+
+    def __init__(self, name, exposureMode, exposureTime, readoutTime):
+        self.name = name
+        self.exposureMode = exposureMode
+        self.exposureTime = exposureTime
+        self.readoutTime = readoutTime
+        ## Number of images taken.
+        self.numImages = 0
+        ## Total time spent exposing.
+        self.exposedTime = 0
+        self._isHigh = False
+        ## Start of the current exposure, or None if not exposing.
+        self._exposureStart = None
+        ## When the camera is ready to be triggered again.
+        self._readyTime = 0
+
+    ## Make a model of a CameraHandler, with its current settings.
+    @classmethod
+    def fromHandler(cls, camera):
+        return cls(
+            camera.name,
+            camera.getExposureMode(),
+            _toTicks(camera.getExposureTime(isExact=True)),
+            _toTicks(camera.getTimeBetweenExposures(isExact=True)),
+        )
+
+    ## Handle an action at time, and return a list of conflict messages.
+    def act(self, time, parameter):
+        isHigh = bool(parameter)
+        wasHigh, self._isHigh = self._isHigh, isHigh
+        conflicts = []
+        if self.exposureMode == cockpit.handlers.camera.TRIGGER_DURATION:
+            if isHigh and not wasHigh:
+                self._checkReady(time, conflicts)
+                self._exposureStart = time
+            elif wasHigh and not isHigh:
+                self._endExposure(time)
+        elif isHigh and not wasHigh:
+            self._checkReady(time, conflicts)
+            if self.exposureMode == cockpit.handlers.camera.TRIGGER_AFTER:
+                # Exposing since the previous trigger, or the start.
+                if self._exposureStart is None:
+                    self._exposureStart = 0
+                self._endExposure(time)
+                self._exposureStart = time
+            else:
+                self._exposureStart = time
+                self._endExposure(time + self.exposureTime)
+        return conflicts
+
+    def _checkReady(self, time, conflicts):
+        if time < self._readyTime:
+            conflicts.append(
+                "%s: %s triggered %s before it is ready"
+                % (
+                    _formatTicks(time),
+                    self.name,
+                    _formatTicks(self._readyTime - time),
+                )
+            )
+
+    def _endExposure(self, time):
+        self.exposedTime += time - self._exposureStart
+        self.numImages += 1
+        self._exposureStart = None
+        self._readyTime = time + self.readoutTime
+
+    ## Return the time at which the camera is done, i.e. read out the
+    # last image.
+    def getEndTime(self):
+        return self._readyTime
+
+
+## Model of a light source, which is on while its action is True.
+class LightModel:
+    counters = ("numPulses", "onTime")
+
+    def __init__(self, name):
+        self.name = name
+        ## Number of times the light was turned on.
+        self.numPulses = 0
+        ## Total time the light was on.
+        self.onTime = 0
+        self._onSince = None
+
+    @classmethod
+    def fromHandler(cls, light):
+        return cls(light.name)
+
+    def act(self, time, parameter):
+        if parameter and self._onSince is None:
+            self._onSince = time
+            self.numPulses += 1
+        elif not parameter and self._onSince is not None:
+            self.onTime += time - self._onSince
+            self._onSince = None
+        return []
+
+    def getEndTime(self):
+        return 0
+
+
+## Model of a positioner, which moves to the position of each action.
+# getMovementTime(start, end) returns how long, in ticks, a move takes
+# to finish and settle.  Moving again before then is a conflict.
+class PositionerModel:
+    counters = ("numMoves", "movingTime")
+
+    def __init__(self, name, getMovementTime, position=None):
+        self.name = name
+        self.getMovementTime = getMovementTime
+        ## Current position, or None if not known until the first move.
+        self.position = position
+        ## Number of moves.
+        self.numMoves = 0
+        ## Total time spent moving and settling.
+        self.movingTime = 0
+        self._settledTime = 0
+
+    @classmethod
+    def fromHandler(cls, positioner):
+        def getMovementTime(start, end):
+            return _toTicks(sum(positioner.getMovementTime(start, end)))
+
+        try:
+            position = positioner.getPosition()
+        except Exception:
+            position = None
+        return cls(positioner.name, getMovementTime, position)
+
+    def act(self, time, parameter):
+        conflicts = []
+        if time < self._settledTime:
+            conflicts.append(
+                "%s: %s moved %s before it settled"
+                % (
+                    _formatTicks(time),
+                    self.name,
+                    _formatTicks(self._settledTime - time),
+                )
+            )
+        if self.position is not None and parameter != self.position:
+            moveTime = self.getMovementTime(self.position, parameter)
+            self.movingTime += moveTime
+            self._settledTime = time + moveTime
+        self.position = parameter
+        self.numMoves += 1
+        return conflicts
+
+    def getEndTime(self):
+        return self._settledTime
+
+
+## Return a dict mapping the handlers that we have models for to new
+# models of them, made from their current settings.
+def makeModels(handlers):
+    models = {}
+    for handler in handlers:
+        deviceType = getattr(handler, "deviceType", None)
+        if deviceType == depot.CAMERA:
+            models[handler] = CameraModel.fromHandler(handler)
+        elif deviceType == depot.LIGHT_TOGGLE:
+            models[handler] = LightModel.fromHandler(handler)
+        elif deviceType in (depot.STAGE_POSITIONER, depot.GENERIC_POSITIONER):
+            models[handler] = PositionerModel.fromHandler(handler)
+    return models
+
+
+## Results of simulate.  Times are in milliseconds.
+class SimulationReport:
+    def __init__(self, models, duration, conflicts, numActions):
+        ## Total duration of all reps, until the last action and the
+        # last camera readout, or positioner settling, are done.
+        self.duration = duration
+        ## List of messages about timing conflicts, in time order.
+        self.conflicts = conflicts
+        ## Number of actions, over all reps.
+        self.numActions = numActions
+        ## Maps camera names to dicts of the number of images, and of
+        # the time spent exposing and not exposing (dead time), and the
+        # fraction of the duration spent exposing (duty cycle).
+        self.cameras = {}
+        ## Maps light names to dicts of the number of pulses, time on,
+        # and the fraction of the duration spent on.
+        self.lights = {}
+        ## Maps positioner names to dicts of the number of moves and the
+        # time spent moving.
+        self.positioners = {}
+        for model in models:
+            if isinstance(model, CameraModel):
+                exposed = model.exposedTime / TICKS_PER_MS
+                self.cameras[model.name] = {
+                    "images": model.numImages,
+                    "exposed": exposed,
+                    "dead": duration - exposed,
+                    "duty cycle": exposed / duration if duration else 0.0,
+                }
+            elif isinstance(model, LightModel):
+                onTime = model.onTime / TICKS_PER_MS
+                self.lights[model.name] = {
+                    "pulses": model.numPulses,
+                    "on": onTime,
+                    "duty cycle": onTime / duration if duration else 0.0,
+                }
+            elif isinstance(model, PositionerModel):
+                self.positioners[model.name] = {
+                    "moves": model.numMoves,
+                    "moving": model.movingTime / TICKS_PER_MS,
+                }
+
+    ## Return a multi-line description of the report.
+    def describe(self):
+        lines = [
+            "%d actions in %.3f ms, %d conflicts"
+            % (self.numActions, self.duration, len(self.conflicts))
+        ]
+        for name, stats in sorted(self.cameras.items()):
+            lines.append(
+                "camera %s: %d images, exposing %.3f ms (%.1f%%),"
+                " dead %.3f ms"
+                % (
+                    name,
+                    stats["images"],
+                    stats["exposed"],
+                    100 * stats["duty cycle"],
+                    stats["dead"],
+                )
+            )
+        for name, stats in sorted(self.lights.items()):
+            lines.append(
+                "light %s: %d pulses, on %.3f ms (%.1f%%)"
+                % (
+                    name,
+                    stats["pulses"],
+                    stats["on"],
+                    100 * stats["duty cycle"],
+                )
+            )
+        for name, stats in sorted(self.positioners.items()):
+            lines.append(
+                "positioner %s: %d moves, moving %.3f ms"
+                % (name, stats["moves"], stats["moving"])
+            )
+        lines.extend(self.conflicts)
+        return "\n".join(lines)
+
+
+## Return a dict mapping the names of the counters of a model to their
+# values.
+def _getCounters(model):
+    return {name: getattr(model, name) for name in model.counters}
+
+
+## Replay a sorted ActionTable, with any RepeatBlocks in it, in simulated
+# time against models, a dict mapping handlers to models from makeModels,
+# and return a SimulationReport.  Actions of handlers without a model are
+# skipped.  The table is run numReps times, starting every repDuration
+# milliseconds or, if that is shorter than the table, as soon as the
+# previous rep is over, which is a conflict.  The models are modified.
+#
+# Every rep runs the same table, so only the first two reps are replayed,
+# which is quick however many reps there are.  The second rep starts from
+# the state the first left the devices in, like all later reps do, and so
+# the counts and times of the others are taken to be the same as its.
+def simulate(table, models, numReps=1, repDuration=None):
+    actions = []
+    tableDuration = 0
+    for time, handler, parameter in table.iterExpanded():
+        ticks = _toTicks(time)
+        tableDuration = max(tableDuration, ticks)
+        if handler in models:
+            actions.append((ticks, models[handler], parameter))
+    conflicts = []
+    repTicks = tableDuration
+    if repDuration is not None:
+        repTicks = _toTicks(repDuration)
+        if numReps > 1 and repTicks < tableDuration:
+            conflicts.append(
+                "rep duration of %s is shorter than the %s of the table"
+                % (_formatTicks(repTicks), _formatTicks(tableDuration))
+            )
+            repTicks = tableDuration
+
+    uniqueModels = list({id(m): m for m in models.values()}.values())
+    simulatedReps = min(numReps, 2)
+    for rep in range(simulatedReps):
+        offset = rep * repTicks
+        before = [_getCounters(model) for model in uniqueModels]
+        repConflicts = []
+        for time, model, parameter in actions:
+            repConflicts.extend(model.act(offset + time, parameter))
+        conflicts.extend(repConflicts)
+
+    otherReps = numReps - simulatedReps
+    if otherReps:
+        for model, counters in zip(uniqueModels, before):
+            for name, value in counters.items():
+                perRep = getattr(model, name) - value
+                setattr(model, name, getattr(model, name) + otherReps * perRep)
+        if repConflicts:
+            conflicts.append(
+                "the %d conflicts of rep 2 repeat in each of the other %d"
+                " reps" % (len(repConflicts), otherReps)
+            )
+
+    endTime = (numReps - 1) * repTicks + tableDuration
+    for model in uniqueModels:
+        endTime = max(endTime, model.getEndTime() + otherReps * repTicks)
+    return SimulationReport(
+        uniqueModels, endTime / TICKS_PER_MS, conflicts, numReps * len(actions)
+    )
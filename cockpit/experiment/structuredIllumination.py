@@ -53,15 +53,10 @@
 
 import decimal
 import math
-import os
-import shutil
-import tempfile
 
 import numpy
 import wx
 
-import cockpit.util.datadoc
-import cockpit.util.Mrc
 import cockpit.util.userConfig
 from cockpit import depot
 from cockpit.experiment import actionTable, experiment
@@ -223,9 +218,9 @@ class SIExperiment(experiment.Experiment):
         self.slmHandler = slmHandler
         self.handlerToBleachCompensation = bleachCompensations
 
-    ## Generate a sequence of (angle, phase, Z) positions for SI experiments,
+    ## Generate a sequence of (angle, phase, Z) indices for SI experiments,
     # based on the order the user specified.
-    def genSIPositions(self):
+    def genSIIndices(self):
         ordering = COLLECTION_ORDERS[self.collectionOrder]
         maxVals = (self.numAngles, self.numPhases, self.numZSlices)
         for i in range(maxVals[ordering[0]]):
@@ -235,7 +230,13 @@ class SIExperiment(experiment.Experiment):
                     angle = vals[ordering.index(0)]
                     phase = vals[ordering.index(1)]
                     z = vals[ordering.index(2)]
-                    yield (angle, phase, self.zStart + z * self.sliceHeight)
+                    yield (angle, phase, z)
+
+    ## Generate a sequence of (angle, phase, Z) positions for SI experiments,
+    # based on the order the user specified.
+    def genSIPositions(self):
+        for angle, phase, z in self.genSIIndices():
+            yield (angle, phase, self.zStart + z * self.sliceHeight)
 
     ## Create the ActionTable needed to run the experiment. We do three
     # Z-stacks for three different angles, and take five images at each
@@ -264,6 +265,9 @@ class SIExperiment(experiment.Experiment):
             # Wait a few ms for any necessary SLM triggers.
             curTime = decimal.Decimal("5e-3")
 
+        # Every image is at a different angle, phase, or Z, so the images
+        # are not repeats of the same actions and cannot be added as a
+        # RepeatBlock.
         for angle, phase, z in self.genSIPositions():
             delayBeforeImaging = 0
             # Figure out which positions changed. They need to be held flat
@@ -444,117 +448,19 @@ class SIExperiment(experiment.Experiment):
         curTime += delay
         return super().expose(curTime, cameras, newPairs, table)
 
-    def reorder_img_file(self):
-        """Reorder the Z dimension in the file.
+    def getZIndexMap(self):
+        """Map the images of a rep, as taken, to angle-z-phase order.
 
         Priism and Softworx are only capable to handle five dimensions
         so angle and phase get mixed in the Z dimension.  In addition,
         their reconstruction programs are only capable to handle them
-        in angle-z-phase order.
+        in angle-z-phase order.  The images are saved straight into
+        that order, whatever the collection order.
         """
-        z_order = collection_order_tuple(self.collectionOrder)
-        z_wanted = ("a", "z", "p")
-        if z_order == z_wanted:
-            # Already in order; don't do anything.
-            return
-
-        doc = cockpit.util.datadoc.DataDoc(self.savePath)
-        order_in = tuple(doc.image.Mrc.axisOrderStr())
-
-        length_getters = {
-            "a": self.numAngles,
-            "z": self.numZSlices,
-            "p": self.numPhases,
-        }
-        ## If data is truncated, the number of Z planes in the header
-        ## may differ from the number of Z planes in the data.  So
-        ## these are checked separetely.  See cockpit bug #289.
-        header_z_lengths = tuple([length_getters[d] for d in z_order])
-        nz_in_header = numpy.prod(header_z_lengths)
-        nz_in_data = doc.image.shape[doc.image.Mrc.axisOrderStr().index("z")]
-        if nz_in_data == nz_in_header:
-            z_lengths = header_z_lengths
-        else:
-            z_lengths = cockpit.util.Mrc.adjusted_data_shape(
-                nz_in_data, header_z_lengths
-            )
-
-        ## Read the extended header again separately.  It our case,
-        ## this is a struct made of int32 and float32, one per plane.
-        ## Its order also needs to be corrected.  We just fake a dtype
-        ## with the right number of bytes per plane for the extended
-        ## header.  We fake the struct by using multiple u1 per
-        ## element.
-        ext_header_stride = 4 * (
-            doc.imageHeader.NumIntegers + doc.imageHeader.NumFloats
-        )
-        ext_header_dtype = ",".join(["u1"] * ext_header_stride)
-        with open(self.savePath, "rb") as fh:
-            fh.seek(1024)  # skip base header
-            ext_header = numpy.fromfile(
-                fh, count=doc.getNPlanes(), dtype=ext_header_dtype
-            )
-        assert (
-            doc.imageHeader.next == ext_header.nbytes
-        ), "next value from datadoc differs from computed length"
-        assert order_in[-2:] == (
-            "y",
-            "x",
-        ), "ORDER_IN two last dimensions are not Y and X"
-
-        ## The file may be truncated if the experiment was aborted.
-        ## In that case, the number of planes in file may be different
-        ## from what is in the header so we get the shape header and
-        ## not the shape from the data in the datadoc instance.  See
-        ## cockpit bug #289.
-        header_shape = [
-            int(n) for n in cockpit.util.Mrc.shapeFromHdr(doc.imageHeader)
+        return [
+            (angle * self.numZSlices + z) * self.numPhases + phase
+            for angle, phase, z in self.genSIIndices()
         ]
-        ext_header = ext_header.reshape(header_shape[:-2])
-
-        ## Finally, reorder the things.
-        img_data = reorder_z_dim(
-            doc.image, order_in, z_lengths, z_order, z_wanted
-        )
-        ext_header = reorder_z_dim(
-            ext_header, order_in[:-2], header_z_lengths, z_order, z_wanted
-        )
-
-        ## Build a new header from old doc data
-
-        ## Save to a new file, reusing the original base header since
-        ## we don't actually changed anything there.
-        tmp_fh = tempfile.NamedTemporaryFile(delete=False)
-        cockpit.util.datadoc.writeMrcHeader(doc.imageHeader, tmp_fh)
-        ## Make sure the data is actually ordered for writing,
-        ## otherwise at this point the arrays might be making use of
-        ## views.
-        ext_header = numpy.ascontiguousarray(ext_header)
-        img_data = numpy.ascontiguousarray(img_data)
-        tmp_fh.write(ext_header)
-        tmp_fh.write(img_data)
-        tmp_fh.close()
-
-        ## We are going to swap the files now, so destroy the old
-        ## datadoc which memmaps the old file or we won't be able to
-        ## overwrite.
-        del doc
-        del img_data
-
-        # Copy permissions to new file
-        shutil.copymode(self.savePath, tmp_fh.name)
-
-        ## Windows needs to have the file removed first.
-        if os.name == "nt":
-            os.remove(self.savePath)
-        shutil.move(tmp_fh.name, self.savePath)
-        return
-
-    def cleanup(self, runThread=None, saveThread=None):
-        super().cleanup(runThread, saveThread)
-        if self.savePath:
-            self.reorder_img_file()
-        return
 
     def lastMinuteActions(self):
         if self.sliceHeight != 0.125:
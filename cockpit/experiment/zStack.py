@@ -74,6 +74,8 @@ class ZStackExperiment(experiment.Experiment):
             # Non-2D experiment; tack on an extra image to hit the top of
             # the volume.
             numZSlices += 1
+        # Each slice moves to a different Z, so slices are not repeats of
+        # the same actions and cannot be added as a RepeatBlock.
         for zIndex in range(numZSlices):
             # Move to the next position, then wait for the stage to
             # stabilize.
@@ -194,7 +194,14 @@ class ViewPanel(wx.Panel):
         self.canvas.resetView()
 
         # Subscribe to new image events only after canvas is prepared.
-        events.subscribe(events.NEW_IMAGE % self.curCamera.name, self.onImage)
+        # Images may arrive faster than they can be drawn, so only draw
+        # the latest one, without holding up the camera.
+        events.subscribe(
+            events.NEW_IMAGE % self.curCamera.name,
+            self.onImage,
+            queue_size=1,
+            overflow=events.OVERFLOW_LATEST_ONLY,
+        )
 
     # TODO: This needs revision, too many sizes are being set
     def change_size(self, size=wx.Size(VIEW_WIDTH, VIEW_HEIGHT - 40)):
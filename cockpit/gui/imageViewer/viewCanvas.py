@@ -49,6 +49,7 @@
 ## ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 ## POSSIBILITY OF SUCH DAMAGE.
 
+import ctypes
 import operator
 import queue
 import threading
@@ -66,6 +67,8 @@ import cockpit.gui.freetype
 import cockpit.gui.guiUtils
 import cockpit.gui.mosaic.window
 import cockpit.util.datadoc
+import cockpit.util.decimation
+import cockpit.util.histogram
 import cockpit.util.threads
 from cockpit import events
 
@@ -79,6 +82,10 @@ HISTOGRAM_HEIGHT = 40
 ## Drag modes
 (DRAG_NONE, DRAG_CANVAS, DRAG_BLACKPOINT, DRAG_WHITEPOINT, DRAG_ROI) = range(5)
 
+## Put in ViewCanvas.imageQueue instead of an image, to update the display
+# of the current image after the view changed.
+_REDISPLAY = object()
+
 
 class BaseGL:
     # Default vertex shader glsl source
@@ -120,12 +127,21 @@ class BaseGL:
 class Image(BaseGL):
     """An class for rendering grayscale images from image data.
 
-    GL textures are generated once. GL stores textures as floats with a range of
-    0 to 1. We use the data.min and data.max of the incoming data to fill this
-    range to prevent loss of detail due to quantisation when rendering low dynamic
-    range images.
+    GL textures are generated once. 8 and 16 bit unsigned data is uploaded
+    as it is, to normalised integer textures. Other data is converted to
+    floats, using the data.min and data.max of the incoming data to fill the
+    range of 0 to 1, to prevent loss of detail due to quantisation when
+    rendering low dynamic range images. The shader maps texture values back
+    to data values, and those to the display range.
     """
 
+    ## Maps dtypes that are uploaded natively to their (internal texture
+    # format, GL type, maximum value).
+    _NATIVE_FORMATS = {
+        np.dtype(np.uint8): (GL_R8, GL_UNSIGNED_BYTE, 255),
+        np.dtype(np.uint16): (GL_R16, GL_UNSIGNED_SHORT, 65535),
+    }
+
     # Vertex shader glsl source
     _VS = """
     #version 120
@@ -163,6 +179,13 @@ class Image(BaseGL):
         self._maxTexEdge = 0
         # Textures used to display this image.
         self._textures = []
+        # Maps textures to the (internal format, width, height) of their
+        # storage, so that it is only allocated when that changes.
+        self._textureFormats = {}
+        # Pixel buffer objects to upload through, in turn, and the index
+        # of the next one to use.
+        self._pbos = []
+        self._pboIndex = 0
         # New data flag
         self._update = False
         # Geometry as number of textures along each axis.
@@ -171,26 +194,33 @@ class Image(BaseGL):
         self.clipHighlight = False
         # Data
         self._data = None
-        # Minimum and maximum data value - used for setting greyscale range.
-        self.dptp = 1
-        self.dmin = 0
+        # Where the data is in the image, as (fullShape, origin, factor),
+        # or None if it is the whole image.
+        self._region = None
+        # Data values of texture values of 0 and 1 - used for setting
+        # greyscale range.
+        self._texMin = 0
+        self._texRange = 1
         # Grayscale clipping points
         self.vmax = 1
         self.vmin = 0
 
     @property
     def scale(self):
-        return (self.vmax - self.vmin) / (self.dptp)
+        return (self.vmax - self.vmin) / (self._texRange)
 
     @property
     def offset(self):
-        return -(self.vmin - self.dmin) / ((self.dptp * self.scale) or 1)
+        return -(self.vmin - self._texMin) / (
+            (self._texRange * self.scale) or 1
+        )
 
     def __del__(self):
-        """Clean up textures."""
+        """Clean up textures and buffers."""
         try:
             # On exit, textures may have already been cleaned up.
             glDeleteTextures(len(self._textures), self._textures)
+            glDeleteBuffers(len(self._pbos), self._pbos)
         except:
             pass
 
@@ -207,7 +237,17 @@ class Image(BaseGL):
         self.vmin = float(vmin)
         self.vmax = float(vmax)
 
-    def setData(self, data):
+    def setData(self, data, fullShape=None, origin=(0, 0), factor=1):
+        """Set the data to display.
+
+        By default, the data is the whole image.  Otherwise, it is the
+        part of an image of fullShape from origin, a (row, column)
+        tuple, binned by factor, which must fit in a single texture.
+        """
+        if fullShape is None:
+            self._region = None
+        else:
+            self._region = (fullShape, origin, factor)
         self._data = data
         self._update = True
 
@@ -217,6 +257,10 @@ class Image(BaseGL):
     def _createTextures(self):
         """Convert data to textures.
 
+        Tiles are uploaded through two pixel buffer objects in turn, so
+        that copying a tile into one overlaps with the transfer of the
+        previous one from the other.
+
         Needs GL context to be set prior to call, and should only
         be called in the main thread."""
         if self._data is None:
@@ -224,6 +268,7 @@ class Image(BaseGL):
         self._maxTexEdge = glGetInteger(GL_MAX_TEXTURE_SIZE)
         data = self._data
         glPixelStorei(GL_UNPACK_SWAP_BYTES, False)
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
         # Ensure the right number of textures available.
         nx = int(np.ceil(data.shape[1] / self._maxTexEdge))
         ny = int(np.ceil(data.shape[0] / self._maxTexEdge))
@@ -236,7 +281,13 @@ class Image(BaseGL):
             else:
                 self._textures.append(textures)
         elif ntex < len(self._textures):
-            glDeleteTextures(len(self._textures) - ntex)
+            unused = self._textures[ntex:]
+            glDeleteTextures(len(unused), unused)
+            del self._textures[ntex:]
+            for tex in unused:
+                self._textureFormats.pop(tex, None)
+        if not self._pbos:
+            self._pbos = list(glGenBuffers(2))
         if ntex == 1:
             # Data will fit into a single texture.
             # Do we need to round these up to a power of 2?
@@ -244,39 +295,84 @@ class Image(BaseGL):
         else:
             # Need to use multiple textures to store data.
             tx = ty = self._maxTexEdge
-        self.dptp = np.ptp(data)
-        self.dmin = data.min()
-        if self.dptp < 1e-6:
-            self.dptp = 1
+        if data.dtype in self._NATIVE_FORMATS:
+            internalFormat, glType, maxValue = self._NATIVE_FORMATS[data.dtype]
+            dtype = data.dtype
+            self._texMin, self._texRange = 0, maxValue
+        else:
+            internalFormat, glType, dtype = GL_RED, GL_FLOAT, np.float32
+            dmin = data.min()
+            dptp = data.max() - dmin
+            if dptp < 1e-6:
+                dptp = 1
+            self._texMin, self._texRange = float(dmin), float(dptp)
         for i, tex in enumerate(self._textures):
             xoff = tx * (i % nx)
             yoff = ty * (i // nx)
-            subdata = (
-                data[
-                    yoff : min(data.shape[0], yoff + ty),
-                    xoff : min(data.shape[1], xoff + tx),
-                ].astype(np.float32)
-                - self.dmin
-            ) / self.dptp
+            region = data[
+                yoff : min(data.shape[0], yoff + ty),
+                xoff : min(data.shape[1], xoff + tx),
+            ]
             glBindTexture(GL_TEXTURE_2D, tex)
-            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
-            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
-            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
-            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
-            glTexImage2D(
-                GL_TEXTURE_2D, 0, GL_RED, tx, ty, 0, GL_RED, GL_FLOAT, None
+            if self._textureFormats.get(tex) != (internalFormat, tx, ty):
+                glTexParameteri(
+                    GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST
+                )
+                glTexParameteri(
+                    GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST
+                )
+                glTexParameteri(
+                    GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE
+                )
+                glTexParameteri(
+                    GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE
+                )
+                glTexImage2D(
+                    GL_TEXTURE_2D,
+                    0,
+                    internalFormat,
+                    tx,
+                    ty,
+                    0,
+                    GL_RED,
+                    glType,
+                    None,
+                )
+                self._textureFormats[tex] = (internalFormat, tx, ty)
+            glBindBuffer(GL_PIXEL_UNPACK_BUFFER, self._pbos[self._pboIndex])
+            self._pboIndex = (self._pboIndex + 1) % len(self._pbos)
+            numBytes = region.size * np.dtype(dtype).itemsize
+            # Orphan the previous contents, which the GL may still be
+            # transferring, instead of waiting for it.
+            glBufferData(
+                GL_PIXEL_UNPACK_BUFFER, numBytes, None, GL_STREAM_DRAW
             )
+            pointer = ctypes.cast(
+                glMapBuffer(GL_PIXEL_UNPACK_BUFFER, GL_WRITE_ONLY),
+                ctypes.POINTER(ctypes.c_ubyte),
+            )
+            try:
+                staging = np.ctypeslib.as_array(pointer, shape=(numBytes,))
+                staging = staging.view(dtype).reshape(region.shape)
+                staging[...] = region
+                if dtype == np.float32:
+                    staging -= self._texMin
+                    staging /= self._texRange
+            finally:
+                glUnmapBuffer(GL_PIXEL_UNPACK_BUFFER)
             glTexSubImage2D(
                 GL_TEXTURE_2D,
                 0,
                 0,
                 0,
-                subdata.shape[1],
-                subdata.shape[0],
+                region.shape[1],
+                region.shape[0],
                 GL_RED,
-                GL_FLOAT,
-                subdata,
+                glType,
+                None,
             )
+        glBindBuffer(GL_PIXEL_UNPACK_BUFFER, 0)
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 4)
         self._update = False
 
     def draw(self, pan=(0, 0), zoom=1):
@@ -285,8 +381,37 @@ class Image(BaseGL):
             return
         elif self._update:
             self._createTextures()
+        if self._region is None:
+            quads, pan, zoom = self._getTiledQuads(pan, zoom)
+        else:
+            quads = self._getRegionQuads()
         shader = self.getShader()
         glUseProgram(shader)
+        # Update shader parameters
+        glUniform2f(glGetUniformLocation(shader, "pan"), pan[0], pan[1])
+        glUniform1i(glGetUniformLocation(shader, "tex"), 0)
+        glUniform1f(glGetUniformLocation(shader, "scale"), self.scale)
+        glUniform1f(glGetUniformLocation(shader, "offset"), self.offset)
+        glUniform1f(glGetUniformLocation(shader, "zoom"), zoom)
+        glUniform1i(
+            glGetUniformLocation(shader, "show_clip"), self.clipHighlight
+        )
+        # Render
+        glEnable(GL_TEXTURE_2D)
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glEnableClientState(GL_TEXTURE_COORD_ARRAY)
+        for texture, vertices, texCoords in quads:
+            glVertexPointerf(vertices)
+            glTexCoordPointer(2, GL_FLOAT, 0, texCoords)
+            glBindTexture(GL_TEXTURE_2D, texture)
+            glDrawArrays(GL_QUADS, 0, 4)
+        glDisable(GL_TEXTURE_2D)
+        glDisableClientState(GL_TEXTURE_COORD_ARRAY)
+        glUseProgram(0)
+
+    def _getTiledQuads(self, pan, zoom):
+        """Return (texture, vertices, texture co-ordinates) of the quads
+        to draw the whole image with, and the pan and zoom to use."""
         # Vertical and horizontal modifiers for non-square images.
         hlim = self._data.shape[1] / max(self._data.shape)
         vlim = self._data.shape[0] / max(self._data.shape)
@@ -304,19 +429,7 @@ class Image(BaseGL):
             zoomcorr = max(zoomcorr, self._data.shape[0] / (ny * ty))
             zoom = zoom / zoomcorr
             pan = (zoomcorr * pan[0] + xcorr, zoomcorr * pan[1] + ycorr)
-        # Update shader parameters
-        glUniform2f(glGetUniformLocation(shader, "pan"), pan[0], pan[1])
-        glUniform1i(glGetUniformLocation(shader, "tex"), 0)
-        glUniform1f(glGetUniformLocation(shader, "scale"), self.scale)
-        glUniform1f(glGetUniformLocation(shader, "offset"), self.offset)
-        glUniform1f(glGetUniformLocation(shader, "zoom"), zoom)
-        glUniform1i(
-            glGetUniformLocation(shader, "show_clip"), self.clipHighlight
-        )
-        # Render
-        glEnable(GL_TEXTURE_2D)
-        glEnableClientState(GL_VERTEX_ARRAY)
-        glEnableClientState(GL_TEXTURE_COORD_ARRAY)
+        quads = []
         # nested loops are still quicker than itertools.product
         for j in range(ny):
             # i and j are indices that determine left and bottom quad co-ords.
@@ -334,30 +447,38 @@ class Image(BaseGL):
                 # Arrays used to create textures have top left at [0,0].
                 # GL co-ords run *bottom* left to top right, so need to invert
                 # vertical co-ords.
-                glVertexPointerf(
-                    [
-                        (-hlim + i * dx, -vlim + jj * dy),
-                        (-hlim + ii * dx, -vlim + jj * dy),
-                        (-hlim + ii * dx, -vlim + j * dy),
-                        (-hlim + i * dx, -vlim + j * dy),
-                    ]
-                )
-                glTexCoordPointer(
-                    2,
-                    GL_FLOAT,
-                    0,
-                    [
-                        (0, 0),
-                        (ii % 1 or 1, 0),
-                        (ii % 1 or 1, jj % 1 or 1),
-                        (0, jj % 1 or 1),
-                    ],
-                )
-                glBindTexture(GL_TEXTURE_2D, self._textures[j * nx + i])
-                glDrawArrays(GL_QUADS, 0, 4)
-        glDisable(GL_TEXTURE_2D)
-        glDisableClientState(GL_TEXTURE_COORD_ARRAY)
-        glUseProgram(0)
+                vertices = [
+                    (-hlim + i * dx, -vlim + jj * dy),
+                    (-hlim + ii * dx, -vlim + jj * dy),
+                    (-hlim + ii * dx, -vlim + j * dy),
+                    (-hlim + i * dx, -vlim + j * dy),
+                ]
+                texCoords = [
+                    (0, 0),
+                    (ii % 1 or 1, 0),
+                    (ii % 1 or 1, jj % 1 or 1),
+                    (0, jj % 1 or 1),
+                ]
+                quads.append((self._textures[j * nx + i], vertices, texCoords))
+        return quads, pan, zoom
+
+    def _getRegionQuads(self):
+        """Return (texture, vertices, texture co-ordinates) of the quad
+        to draw part of an image with, where it is in the image."""
+        (height, width), (y0, x0), factor = self._region
+        # Vertical and horizontal modifiers for non-square images.
+        hlim = width / max(height, width)
+        vlim = height / max(height, width)
+        y1 = y0 + self._data.shape[0] * factor
+        x1 = x0 + self._data.shape[1] * factor
+        left = -hlim + 2 * hlim * x0 / width
+        right = -hlim + 2 * hlim * x1 / width
+        # Rows run from the top down.
+        top = vlim - 2 * vlim * y0 / height
+        bottom = vlim - 2 * vlim * y1 / height
+        vertices = [(left, top), (right, top), (right, bottom), (left, bottom)]
+        texCoords = [(0, 0), (1, 0), (1, 1), (0, 1)]
+        return [(self._textures[0], vertices, texCoords)]
 
 
 class Histogram(BaseGL):
@@ -366,6 +487,9 @@ class Histogram(BaseGL):
         self.counts = None
         self.lbound = None
         self.ubound = None
+        ## Range of the data, or of a sample of it.
+        self.dmin = None
+        self.dmax = None
         self.lthresh = None
         self.uthresh = None
 
@@ -377,33 +501,20 @@ class Histogram(BaseGL):
     def gl2data(self, x):
         return self.lbound + ((self.ubound - self.lbound) or 1) * (x + 1) / 2
 
-    def setData(self, data):
-        # Calculate histogram.
-        # Use shifted average histogram to avoid binning artefacts.
-        # generate set of m histograms
-        #   each has class width h
-        #   start points 0, h/m, 2h/m, ..., (m-1)h/m
-        # 1 < m < 64
-        # sum to average
+    def setData(self, histogramData):
+        """Show a cockpit.util.histogram.HistogramData."""
         if self.lbound is None:
-            self.lbound = data.min()
+            self.lbound = histogramData.min
         if self.ubound is None:
-            self.ubound = data.max()
+            self.ubound = histogramData.max
         if self.lthresh is None:
             self.lthresh = self.lbound
         if self.uthresh is None:
             self.uthresh = self.ubound
-        nbins = 64
-        m = 4
-        self.bins = np.linspace(data.min(), data.max(), nbins)
-        self.counts = np.zeros(nbins)
-        h = self.bins[1] - self.bins[0]
-        for i in range(m):
-            these = np.bincount(
-                np.digitize(data.flat, self.bins + i * h / m, right=True),
-                minlength=nbins,
-            )
-            self.counts += these[0:nbins]
+        self.dmin = histogramData.min
+        self.dmax = histogramData.max
+        self.bins = histogramData.bins
+        self.counts = histogramData.counts
 
     def draw(self):
         if self.counts is None:
@@ -446,6 +557,11 @@ class ViewCanvas(wx.glcanvas.GLCanvas):
 
         self.image = Image()
         self.histogram = Histogram()
+        ## Computes histograms of our images, so that large images do
+        # not hold up displaying them.
+        self.histogramWorker = cockpit.util.histogram.HistogramWorker(
+            self.setHistogram
+        )
 
         ## Menu - keep reference to store state of toggle buttons.
         # Must be created after self.image.
@@ -483,6 +599,17 @@ class ViewCanvas(wx.glcanvas.GLCanvas):
         self.imageData = None
         ## Event that signals that we've finished drawing the current image.
         self.drawEvent = threading.Event()
+        ## Size of the viewport the image is drawn in, once drawn.
+        self._viewportSize = None
+        ## The current image, or its FFT, to display.
+        self._displaySource = None
+        self._isFFTSource = False
+        ## View, and (region, factor) of self._displaySource, that
+        # self.image was last given data for.
+        self._displayView = None
+        self._displayRegion = None
+        ## Whether a _REDISPLAY is in imageQueue.
+        self._isRedisplayPending = False
         # This spawns a new thread.
         self.processImages()
         ## Percentile scaling of min/max based on our histogram.
@@ -596,8 +723,11 @@ class ViewCanvas(wx.glcanvas.GLCanvas):
                 break
         self.imageData = None
         self.imageShape = None
+        self._displaySource = None
+        self._displayRegion = None
         if shouldDestroy:
             self.shouldDraw = False
+            self.histogramWorker.stop()
             self.Destroy()
         else:
             self.Refresh()
@@ -616,35 +746,90 @@ class ViewCanvas(wx.glcanvas.GLCanvas):
     def processImages(self):
         while self.shouldDraw:
             # Grab all images out of the queue; we'll use the most recent one.
+            # If there are none, the view changed.
             newImage = self.imageQueue.get()
             while not self.imageQueue.empty():
-                newImage = self.imageQueue.get_nowait()
-            # We want to autoscale to the image if it's our first one.
-            isFirstImage = self.imageData is None
-            self.imageData = newImage
-            # When the image shape changes, we reset back to filling the
-            # display with the image.
-            shouldResetView = self.imageShape != newImage.shape
-            self.imageShape = newImage.shape
-            self.histogram.setData(newImage)
-            if self.showFFT:
-                self.image.setData(
-                    np.log(
-                        np.abs(np.fft.fftshift(np.fft.fft2(self.imageData)))
-                        + 1e-16
-                    )
-                )
+                item = self.imageQueue.get_nowait()
+                if item is not _REDISPLAY or newImage is _REDISPLAY:
+                    newImage = item
+            self._isRedisplayPending = False
+            if newImage is _REDISPLAY:
+                image = self.imageData
+                if image is None or not self._updateDisplay(image, False):
+                    continue
             else:
-                self.image.setData(newImage)
-            if shouldResetView:
-                self.resetView()
-            if isFirstImage:
-                self.image.autoscale()
+                # We want to autoscale to the image if it's our first one.
+                isFirstImage = self.imageData is None
+                self.imageData = newImage
+                # When the image shape changes, we reset back to filling the
+                # display with the image.
+                shouldResetView = self.imageShape != newImage.shape
+                self.imageShape = newImage.shape
+                if shouldResetView:
+                    self.resetView()
+                self._updateDisplay(newImage, True)
+                if isFirstImage:
+                    self.image.autoscale()
+                self.histogramWorker.submit(newImage)
             wx.CallAfter(self.Refresh)
             # Wait for the image to be drawn before we do anything more.
             self.drawEvent.wait(timeout=1)
             self.drawEvent.clear()
 
+    def _getView(self):
+        return (self._viewportSize, self.zoom, self.panX, self.panY)
+
+    ## Give self.image the image, or its FFT, binned down to about the
+    # resolution of the screen and cropped to the part that is visible.
+    # Returns whether that changed what self.image displays.
+    def _updateDisplay(self, image, isNewImage):
+        view = self._getView()
+        self._displayView = view
+        isNewSource = isNewImage or self._isFFTSource != self.showFFT
+        if isNewSource:
+            self._isFFTSource = self.showFFT
+            if self.showFFT:
+                self._displaySource = np.log(
+                    np.abs(np.fft.fftshift(np.fft.fft2(image))) + 1e-16
+                )
+            else:
+                self._displaySource = image
+        source = self._displaySource
+        viewportSize, zoom, panX, panY = view
+        if viewportSize is None:
+            # Not drawn yet.
+            factor = 1
+            region = (0, source.shape[0], 0, source.shape[1])
+        else:
+            factor = cockpit.util.decimation.getFactor(
+                source.shape, viewportSize[::-1], zoom
+            )
+            region = cockpit.util.decimation.getVisibleRegion(
+                source.shape, zoom, (panX, panY), factor
+            )
+        if not isNewSource and (region, factor) == self._displayRegion:
+            return False
+        self._displayRegion = (region, factor)
+        y0, y1, x0, x1 = region
+        if factor == 1 and region == (0, source.shape[0], 0, source.shape[1]):
+            self.image.setData(source)
+        else:
+            self.image.setData(
+                cockpit.util.decimation.decimate(source[y0:y1, x0:x1], factor),
+                source.shape,
+                (y0, x0),
+                factor,
+            )
+        return True
+
+    ## Show the histogram of an image, as computed by histogramWorker.
+    @cockpit.util.threads.callInMainThread
+    def setHistogram(self, histogramData):
+        if not self.shouldDraw:
+            return
+        self.histogram.setData(histogramData)
+        self.Refresh()
+
     ## Return the blackpoint and whitepoint (i.e. the pixel values which
     # are displayed as black and white, respectively).
     def getScaling(self):
@@ -680,6 +865,15 @@ class ViewCanvas(wx.glcanvas.GLCanvas):
         try:
             Hist_Height = int(HISTOGRAM_HEIGHT * self.GetContentScaleFactor())
             self.painting = True
+            # Update the display of the image for a new view.
+            self._viewportSize = (self.w, self.h - Hist_Height)
+            if (
+                self.imageData is not None
+                and not self._isRedisplayPending
+                and self._getView() != self._displayView
+            ):
+                self._isRedisplayPending = True
+                self.imageQueue.put_nowait(_REDISPLAY)
             self.SetCurrent(self.context)
             glClear(GL_COLOR_BUFFER_BIT)
             glViewport(0, Hist_Height, self.w, self.h - Hist_Height)
@@ -704,10 +898,10 @@ class ViewCanvas(wx.glcanvas.GLCanvas):
                 self.face.render(
                     "%d [%-10d %10d] %d"
                     % (
-                        self.image.dmin,
+                        self.histogram.dmin,
                         self.histogram.lthresh,
                         self.histogram.uthresh,
-                        self.image.dmin + self.image.dptp,
+                        self.histogram.dmax,
                     )
                 )
             except:
@@ -983,17 +1177,9 @@ class ViewCanvas(wx.glcanvas.GLCanvas):
         self.showCrosshair = not (self.showCrosshair)
 
     def toggleFFT(self, event=None):
-        if self.showFFT:
-            self.showFFT = False
-            self.image.setData(self.imageData)
-        else:
-            self.showFFT = True
-            self.image.setData(
-                np.log(
-                    np.abs(np.fft.fftshift(np.fft.fft2(self.imageData)))
-                    + 1e-16
-                )
-            )
+        self.showFFT = not self.showFFT
+        if self.imageData is not None:
+            self.imageQueue.put_nowait(_REDISPLAY)
 
     ## Convert window co-ordinates to gl co-ordinates.
     def canvasToGl(self, x, y):
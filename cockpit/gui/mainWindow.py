@@ -289,11 +289,14 @@ def _show_configparser_frame(
 ) -> None:
     config_str = io.StringIO()
     config.write(config_str)
+    _show_text_frame(config_str.getvalue(), frame_title)
 
+
+def _show_text_frame(text: str, frame_title: str) -> None:
     frame = wx.Frame(parent=None, title=frame_title)
     panel = wx.Panel(parent=frame)
     text_ctrl = cockpit.gui.create_monospaced_multiline_text_ctrl(
-        parent=panel, text=config_str.getvalue(), min_rows=24, min_cols=80
+        parent=panel, text=text, min_rows=24, min_cols=80
     )
 
     panel_sizer = wx.BoxSizer(wx.HORIZONTAL)
@@ -491,6 +494,12 @@ class WindowsMenu(wx.Menu):
         menu_item = self.Append(wx.ID_ANY, "Launch SIM Intensity Profile")
         self.Bind(wx.EVT_MENU, self.OnLaunchSIMIntensityProfile, menu_item)
 
+        # Item to find which event subscribers are slow.  Profiling
+        # starts when checked, and the top offenders are shown when
+        # unchecked.
+        menu_item = self.AppendCheckItem(wx.ID_ANY, "Profile events")
+        self.Bind(wx.EVT_MENU, self.OnProfileEvents, menu_item)
+
         # This is only for the piDIO and executor, both of which are a
         # window to set lines high/low.  We should probably have a
         # general window for this which we could use for all executor
@@ -595,6 +604,14 @@ class WindowsMenu(wx.Menu):
         window = IntensityProfilerFrame(wx.GetApp().MainWindow)
         window.Show()
 
+    def OnProfileEvents(self, event: wx.CommandEvent) -> None:
+        if event.IsChecked():
+            events.start_profiling()
+        else:
+            profiler = events.stop_profiling()
+            if profiler is not None:
+                _show_text_frame(profiler.format_report(), "Event profile")
+
 
 class MainWindow(wx.Frame):
     def __init__(self):
@@ -114,6 +114,8 @@ from OpenGL.GL import (
     glViewport,
 )
 
+import cockpit.util.bufferPool
+
 
 ## This module contains the Tile and MegaTile classes, along with some
 # supporting functions and constants.
@@ -216,9 +218,12 @@ class Tile:
         img = self.textureData
         mi, ma = self.histogramScale
         pic_ny, pic_nx = img.shape
+        ## Buffer from the pool holding a converted copy of the image.
+        staging = None
         if img.dtype.type in (numpy.float64, numpy.int32, numpy.uint32):
-            data = img.astype(numpy.float32)
-            imgString = data.tobytes()
+            staging = cockpit.util.bufferPool.acquire(img.shape, numpy.float32)
+            staging[...] = img
+            imgString = staging
             imgType = numpy.float32
         else:
             imgString = img.tobytes()
@@ -266,19 +271,23 @@ class Tile:
 
         glPixelStorei(GL_UNPACK_ALIGNMENT, itSize)
 
-        if imgType not in dtypeToGlTypeMap:
-            raise ValueError("Unsupported data mode %s" % str(imgType))
-        glTexSubImage2D(
-            GL_TEXTURE_2D,
-            0,
-            0,
-            0,
-            pic_nx,
-            pic_ny,
-            GL_LUMINANCE,
-            dtypeToGlTypeMap[imgType],
-            imgString,
-        )
+        try:
+            if imgType not in dtypeToGlTypeMap:
+                raise ValueError("Unsupported data mode %s" % str(imgType))
+            glTexSubImage2D(
+                GL_TEXTURE_2D,
+                0,
+                0,
+                0,
+                pic_nx,
+                pic_ny,
+                GL_LUMINANCE,
+                dtypeToGlTypeMap[imgType],
+                imgString,
+            )
+        finally:
+            if staging is not None:
+                cockpit.util.bufferPool.release(staging)
 
     ## Free up memory we were using.
     def wipe(self):
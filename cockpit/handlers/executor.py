@@ -49,20 +49,25 @@
 ## ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 ## POSSIBILITY OF SUCH DAMAGE.
 
+import collections
 import collections.abc
 import functools
+import hashlib
 import operator
+import pickle
 import time
 import typing
 from numbers import Number
 
 import matplotlib.pyplot as plt
+import numpy
 import wx
 from microscope import ElectronicShutteringMode
 
+import cockpit.util.sequencer
 from cockpit import depot, events, util
 from cockpit.experiment import experiment
-from cockpit.experiment.actionTable import ActionTable
+from cockpit.experiment.actionTable import TICKS_PER_MS, ActionTable
 from cockpit.handlers.deviceHandler import DeviceHandler
 from cockpit.handlers.genericPositioner import GenericPositionerHandler
 
@@ -73,13 +78,29 @@ class ExecutorHandler(DeviceHandler):
     # - examineActions(name, table): Perform any necessary validation or
     #   modification of the experiment's ActionTable.
     # - executeTable(name, table, startIndex, stopIndex): Actually perform
-    #   actions through the specified lines in the ActionTable.
-    def __init__(self, name, groupName, callbacks, dlines=None, alines=None):
+    #   actions through the specified entries of a CompiledTable, which
+    #   has the states of our lines compiled from the ActionTable.
+
+    ## Number of compiled tables to keep for reuse.
+    maxCompiledTables = 16
+
+    def __init__(
+        self,
+        name,
+        groupName,
+        callbacks,
+        dlines=None,
+        alines=None,
+        supportsRepeats=False,
+    ):
         # \param name: handler name
         # \param groupname: handler and device group name
         # \param callbacks: callbacks, as above
         # \param dlines: optional, number of digital lines
         # \param alines: optional, number of analogue lines
+        # \param supportsRepeats: optional, whether executeTable can
+        #     repeat a table numReps times itself, so that RepeatBlocks
+        #     in the experiment's ActionTable need not be expanded.
         # Note that even though this device is directly involved in running
         # experiments, it is never itself a part of an experiment, so
         # we pass False for isEligibleForExperiments here.
@@ -93,6 +114,9 @@ class ExecutorHandler(DeviceHandler):
         # Number of digital and analogue lines.
         self._dlines = dlines
         self._alines = alines
+        self.supportsRepeats = supportsRepeats
+        ## Maps keys of recently compiled tables to them, oldest first.
+        self._compiledTables = collections.OrderedDict()
         if not isinstance(self, DigitalMixin):
             self.registerDigital = self._raiseNoDigitalException
             self.getDigital = self._raiseNoDigitalException
@@ -116,6 +140,10 @@ class ExecutorHandler(DeviceHandler):
     def examineActions(self, table):
         return self.callbacks["examineActions"](table)
 
+    ## Return the set of handlers whose actions we can run.
+    def getRunnableHandlers(self):
+        return {self} | set(self.digitalClients) | set(self.analogClients)
+
     def getNumRunnableLines(self, table, index):
         ## Return number of lines this handler can run.
         count = 0
@@ -149,66 +177,9 @@ class ExecutorHandler(DeviceHandler):
     def executeTable(self, table, startIndex, stopIndex, numReps, repDuration):
         # The actions between startIndex and stopIndex may include actions for
         # this handler, or for this handler's clients. All actions are
-        # ultimately carried out by this handler, so we need to parse the
-        # table to replace client actions, resulting in a table of
-        # (time, (analogStage, digitalState)).
-        if isinstance(self, DigitalMixin):
-            dstate = self.readDigital()
-        else:
-            dstate = None
-        if isinstance(self, AnalogMixin):
-            astate = [self.getAnalogLine(line) for line in range(self._alines)]
-        else:
-            astate = None
-
-        actions = []
-
-        tPrev = None
-        hPrev = None
-        argsPrev = None
-
-        for i in range(startIndex, stopIndex):
-            t, h, args = table[i]
-            if h in self.analogClients:
-                # update analog state
-                lineHandler = self.analogClients[h]
-                if isinstance(args, collections.abc.Iterable):
-                    # Using an indexed position
-                    pos = lineHandler.indexedPosition(*args)
-                else:
-                    pos = args
-                astate[lineHandler.line] = lineHandler.posToNative(pos)
-            elif h in self.digitalClients:
-                # set/clear appropriate bit
-                change = 1 << self.digitalClients[h]
-                # args contains new bit state
-                if args:
-                    dstate |= change
-                else:
-                    dstate = dstate & (2**self._dlines - 1) - (change)
-
-            # Check for simultaneous actions.
-            if tPrev is not None and t == tPrev:
-                if h not in hPrev:
-                    # Update last action to merge actions at same timepoint.
-                    actions[-1] = (t, (dstate, astate[:]))
-                    # Add handler and args to list for next check.
-                    hPrev.append(h)
-                    argsPrev.append(args)
-                elif args == argsPrev[hPrev.index(h)]:
-                    # Just a duplicate entry
-                    continue
-                else:
-                    # Simultaneous, different actions with same handler.
-                    raise Exception(
-                        "Simultaneous actions with same hander, %s." % h
-                    )
-            else:
-                # Append new action.
-                actions.append((t, (dstate, astate[:])))
-                # Reinitialise hPrev and argsPrev for next check.
-                hPrev, argsPrev = [h], [args]
-                tPrev = t
+        # ultimately carried out by this handler, so we need to compile the
+        # table into the states of our lines over time.
+        actions = self.compileTable(table, startIndex, stopIndex)
 
         events.publish(
             events.UPDATE_STATUS_LIGHT,
@@ -220,6 +191,177 @@ class ExecutorHandler(DeviceHandler):
             actions, 0, len(actions), numReps, repDuration
         )
 
+    ## Compile the actions from startIndex up to stopIndex of a table into
+    # the states of our lines over time, as a CompiledTable.  Simultaneous
+    # actions are merged into a single state; raise an exception if two of
+    # them set the same handler to different values.
+    def compileTable(self, table, startIndex, stopIndex):
+        ticks, handlerIndices, parameters = table.getColumns(
+            startIndex, stopIndex
+        )
+        fractions = table.getTickFractions(startIndex, stopIndex)
+        initialDigital = None
+        if isinstance(self, DigitalMixin):
+            initialDigital = self.readDigital()
+        initialAnalog = None
+        analogSettings = None
+        if isinstance(self, AnalogMixin):
+            initialAnalog = [
+                self.getAnalogLine(line) for line in range(self._alines)
+            ]
+            # How positions are converted to native values, which the
+            # user may have changed since, e.g. by recalibrating a line.
+            analogSettings = [
+                (h.line, h.gain, h.offset, h.positions)
+                for h in map(self.analogClients.get, table.handlers)
+                if h is not None
+            ]
+        # Experiments repeated, e.g. at each site of a multi-site
+        # experiment, give the same tables, so reuse what we compiled.
+        key = self._getCompileKey(
+            table,
+            ticks,
+            fractions,
+            handlerIndices,
+            parameters,
+            (initialDigital, initialAnalog, analogSettings),
+        )
+        if key in self._compiledTables:
+            self._compiledTables.move_to_end(key)
+            return self._compiledTables[key]
+
+        # Rows with a later time than the row before.
+        isNewTime = numpy.ones(len(ticks), bool)
+        isNewTime[1:] = (ticks[1:] != ticks[:-1]) | (
+            fractions[1:] != fractions[:-1]
+        )
+        self._checkSimultaneousActions(
+            table, numpy.cumsum(isNewTime), handlerIndices, parameters
+        )
+        # Each time gets the state after the last action at that time.
+        isLastAtTime = numpy.append(isNewTime[1:], True)
+        digital = None
+        if initialDigital is not None:
+            digital = self._compileDigital(
+                table.handlers, handlerIndices, parameters, initialDigital
+            )[isLastAtTime]
+        analog = None
+        if initialAnalog is not None:
+            analog = self._compileAnalog(
+                table.handlers, handlerIndices, parameters, initialAnalog
+            )[isLastAtTime]
+        compiled = CompiledTable(
+            ticks[isLastAtTime], fractions[isLastAtTime], digital, analog, key
+        )
+        if key is not None:
+            self._compiledTables[key] = compiled
+            while len(self._compiledTables) > self.maxCompiledTables:
+                self._compiledTables.popitem(last=False)
+        return compiled
+
+    ## Return a hash of everything that goes into compiling some rows of
+    # a table, or None if they cannot be hashed.
+    def _getCompileKey(
+        self, table, ticks, fractions, handlerIndices, parameters, state
+    ):
+        try:
+            parameterBytes = pickle.dumps((parameters.tolist(), state))
+        except Exception:
+            return None
+        # Our handlers, and so their ids, last for the whole session.
+        handlerIds = numpy.array([id(h) for h in table.handlers], numpy.uint64)
+        digest = hashlib.blake2b(digest_size=16)
+        for data in (
+            ticks,
+            fractions,
+            handlerIds[handlerIndices],
+            parameterBytes,
+        ):
+            digest.update(numpy.ascontiguousarray(data).tobytes())
+        return digest.hexdigest()
+
+    ## Raise an exception if any simultaneous actions, i.e. with the same
+    # timeIndex, for the same handler are different.
+    def _checkSimultaneousActions(
+        self, table, timeIndices, handlerIndices, parameters
+    ):
+        order = numpy.lexsort((handlerIndices, timeIndices))
+        timeIndices = timeIndices[order]
+        handlerIndices = handlerIndices[order]
+        isRepeated = (timeIndices[1:] == timeIndices[:-1]) & (
+            handlerIndices[1:] == handlerIndices[:-1]
+        )
+        for row in numpy.flatnonzero(isRepeated):
+            first, second = order[row], order[row + 1]
+            if parameters[first] != parameters[second]:
+                raise Exception(
+                    "Simultaneous actions with same hander, %s."
+                    % table.handlers[handlerIndices[row]]
+                )
+
+    ## Return the state of our digital lines after each action, starting
+    # from the initial state, as an array of bitmasks.
+    def _compileDigital(self, handlers, handlerIndices, parameters, initial):
+        numRows = len(handlerIndices)
+        # The line of each handler, or -1 if it is not a digital client.
+        handlerLines = numpy.array(
+            [self.digitalClients.get(h, -1) for h in handlers], numpy.int64
+        )
+        rowLines = handlerLines[handlerIndices]
+        isDigital = rowLines >= 0
+        rowStates = numpy.zeros(numRows, bool)
+        rowStates[isDigital] = parameters[isDigital].astype(bool)
+        rows = numpy.arange(numRows)
+        result = numpy.full(numRows, initial, numpy.int64)
+        for line in numpy.unique(rowLines[isDigital]):
+            # The last action on this line at or before each row.
+            lastRows = numpy.maximum.accumulate(
+                numpy.where(rowLines == line, rows, -1)
+            )
+            isSet = lastRows >= 0
+            isOn = rowStates[lastRows]
+            result[isSet & isOn] |= 1 << int(line)
+            result[isSet & ~isOn] &= ~(1 << int(line))
+        if self._dlines is not None:
+            # Clearing a line also clears any lines we do not have.
+            hasCleared = numpy.logical_or.accumulate(isDigital & ~rowStates)
+            result[hasCleared] &= 2**self._dlines - 1
+        return result
+
+    ## Return the native values of our analogue lines after each action,
+    # starting from the initial values, as an array with a column for each
+    # line.
+    def _compileAnalog(self, handlers, handlerIndices, parameters, initial):
+        numRows = len(handlerIndices)
+        rowLines = numpy.full(numRows, -1)
+        rowValues = numpy.zeros(numRows)
+        for handlerIndex in numpy.unique(handlerIndices):
+            lineHandler = self.analogClients.get(handlers[handlerIndex])
+            if lineHandler is None:
+                continue
+            isHandler = handlerIndices == handlerIndex
+            positions = [
+                # Using an indexed position
+                lineHandler.indexedPosition(*args)
+                if isinstance(args, collections.abc.Iterable)
+                else args
+                for args in parameters[isHandler]
+            ]
+            rowLines[isHandler] = lineHandler.line
+            rowValues[isHandler] = lineHandler.posToNative(
+                numpy.array(positions, float)
+            )
+        rows = numpy.arange(numRows)
+        result = numpy.empty((numRows, self._alines))
+        for line in range(self._alines):
+            lastRows = numpy.maximum.accumulate(
+                numpy.where(rowLines == line, rows, -1)
+            )
+            result[:, line] = numpy.where(
+                lastRows >= 0, rowValues[lastRows], initial[line]
+            )
+        return result
+
     ## Debugging function: display ExecutorOutputWindow.
     def showDebugWindow(self):
         # Ensure only a single instance of the window.
@@ -390,12 +532,21 @@ class DigitalMixin:
         # Mask of the bits that we toggle
         mask = functools.reduce(operator.ior, list(zip(*seq))[1])
         entryState = self.readDigital()
-        t_last = 0
-        for t, state in seq:
-            if t != t_last:
-                time.sleep((t - t_last) / 1000.0)
-                t_last = t
-            self.writeWithMask(mask, state)
+        # Times are in milliseconds from now.  The shared sequencer
+        # writes each state at its deadline, so that lateness of one
+        # write does not delay the following ones.
+        start = time.perf_counter_ns()
+        steps = [
+            (
+                start + round(t * TICKS_PER_MS),
+                functools.partial(self.writeWithMask, mask, state),
+            )
+            for t, state in seq
+        ]
+        ## TimingRecord of the last software sequence.
+        self.softSequenceTiming = cockpit.util.sequencer.getSequencer().run(
+            steps
+        )
         self.writeDigital(entryState)
 
 
@@ -554,7 +705,7 @@ def plot_action_table_profile(
         if isinstance(action, (float, int)):
             return "analogue"
 
-    for event in action_table.actions:
+    for event in action_table.iterExpanded():
         if event is None:
             continue
         time, handler, action = event
@@ -665,9 +816,40 @@ class ExecutorDebugWindow(wx.Frame):
             plot_action_table_profile(experiment.lastExperiment.table)
 
 
+## The states of an executor's lines over time, compiled from an
+# ActionTable by ExecutorHandler.compileTable.  There is an entry for each
+# time at which the executor has actions, with the state of its lines
+# after those actions.
+class CompiledTable:
+    def __init__(self, ticks, fractions, digital, analog, key=None):
+        ## Time of each entry, in ticks of the ActionTable (see
+        # cockpit.experiment.actionTable.TICKS_PER_MS).
+        self.ticks = ticks
+        ## Time of each entry, in milliseconds.
+        self.times = (ticks + fractions) / TICKS_PER_MS
+        ## Bitmask of the digital lines that are on, or None if the
+        # executor has no digital lines.
+        self.digital = digital
+        ## Array with a column of native values for each analogue line,
+        # or None if the executor has no analogue lines.
+        self.analog = analog
+        ## Hash of what the table was compiled from, which is the same
+        # for tables compiled from the same actions and initial states, or
+        # None if it could not be worked out.  Executors may use it to
+        # tell that they already have a table.
+        self.key = key
+
+    def __len__(self):
+        return len(self.ticks)
+
+
 ## A class for a handler that can perform actions in an experiment,
 # but doesn't have any analogue or digital capabilities.
 class SimpleExecutor(DeviceHandler):
+    ## We cannot repeat a table ourselves, like an ExecutorHandler made
+    # with supportsRepeats, so RepeatBlocks are never given to us.
+    supportsRepeats = False
+
     def __init__(self, name, groupName, isEligibleForExperiments, callbacks):
         super().__init__(
             name,
@@ -690,6 +872,12 @@ class SimpleExecutor(DeviceHandler):
         )
         events.publish(events.EXPERIMENT_EXECUTION)
 
+    ## Return the set of handlers whose actions we can run.
+    def getRunnableHandlers(self):
+        if not self.isEligibleForExperiments:
+            return set()
+        return {self}
+
     ## Return number of lines this handler can run.
     def getNumRunnableLines(self, table, index):
         count = 0
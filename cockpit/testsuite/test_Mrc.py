@@ -18,8 +18,13 @@
 ## You should have received a copy of the GNU General Public License
 ## along with Cockpit.  If not, see <http://www.gnu.org/licenses/>.
 
+import os.path
+import tempfile
 import unittest
 
+import numpy
+import numpy.testing
+
 import cockpit.util.Mrc as Mrc
 
 
@@ -59,5 +64,95 @@ class TruncatedMrcFiles(unittest.TestCase):
                 Mrc.adjusted_data_shape(numel, shape)
 
 
+class ConvertMrcFiles(unittest.TestCase):
+    ## Sections of a WZT (ImgSequence 1) file, in file order.
+    shape = (2, 3, 2, 4, 5)  # t, z, w, y, x
+
+    def setUp(self):
+        tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+        self.path = os.path.join(tempdir.name, "in.dv")
+        self.outPath = os.path.join(tempdir.name, "out.dv")
+        ## Go past 255, to test clipping on conversion to uint8.
+        self.data = 3 * numpy.arange(
+            numpy.prod(self.shape), dtype=numpy.uint16
+        ).reshape(self.shape)
+        numSections = numpy.prod(self.shape[:3])
+        hdr = Mrc.makeHdrArray()
+        Mrc.init_simple(hdr, Mrc.dtype2MrcMode(numpy.uint16), self.shape)
+        hdr.NumTimes, hdr.NumWaves, hdr.ImgSequence = 2, 2, 1
+        hdr.NumIntegers, hdr.NumFloats = 1, 2
+        hdr.next = 12 * numSections
+        self.ext = numpy.zeros(numSections, "i4,f4,f4")
+        self.ext["f1"] = numpy.arange(numSections)
+        with open(self.path, "wb") as fh:
+            fh.write(hdr._array.tobytes())
+            fh.write(self.ext.tobytes())
+            fh.write(self.data.tobytes())
+
+    def readOutput(self):
+        m = Mrc.Mrc(self.outPath)
+        try:
+            hdr = Mrc.implement_hdr(m.hdr._array.copy())
+            return hdr, numpy.array(m.data), numpy.array(m.extFloats)
+        finally:
+            m.close()
+
+    def test_reorder_sections_and_ext_header(self):
+        Mrc.convert(self.path, self.outPath, imgSequence=0)
+        hdr, data, extFloats = self.readOutput()
+        self.assertEqual(hdr.ImgSequence, 0)
+        numpy.testing.assert_array_equal(
+            data, self.data.transpose(2, 0, 1, 3, 4)
+        )
+        sections = numpy.arange(12).reshape(self.shape[:3])
+        numpy.testing.assert_array_equal(
+            extFloats[:, 0], sections.transpose(2, 0, 1).ravel()
+        )
+
+    def test_reorder_packed_z(self):
+        ## Sections packed as "ab" with lengths (1, 3) moved to "ba".
+        sections = Mrc.planeMapping(
+            Mrc.implement_hdr(self.readInputHeader()),
+            zLengths=(3, 1),
+            zOrder="ab",
+            zWanted="ba",
+        )
+        numpy.testing.assert_array_equal(sections, numpy.arange(12))
+        with self.assertRaisesRegex(ValueError, "z sections"):
+            Mrc.planeMapping(
+                Mrc.implement_hdr(self.readInputHeader()),
+                zLengths=(2, 2),
+                zOrder="ab",
+                zWanted="ba",
+            )
+
+    def readInputHeader(self):
+        with open(self.path, "rb") as fh:
+            return numpy.frombuffer(fh.read(1024), Mrc.mrcHdr_dtype).copy()
+
+    def test_crop_and_convert(self):
+        Mrc.convert(
+            self.path, self.outPath, crop=(1, 3, 0, 2), dtype=numpy.uint8
+        )
+        hdr, data, extFloats = self.readOutput()
+        self.assertEqual(data.dtype, numpy.uint8)
+        expected = numpy.clip(self.data[..., 1:3, 0:2], 0, 255)
+        numpy.testing.assert_array_equal(data, expected)
+        self.assertEqual(tuple(hdr.mmm1[:2]), (15, 255))
+        self.assertEqual(hdr.mmm1[2], numpy.median(expected[:, :, 0]))
+        self.assertEqual(tuple(hdr.mm2), (75, 255))
+
+    def test_truncated_and_in_place(self):
+        with open(self.path, "r+b") as fh:
+            fh.truncate(os.path.getsize(self.path) - 2 * 4 * 5 * 2)
+        Mrc.convert(self.path, self.path, imgSequence=0)
+        self.outPath = self.path
+        hdr, data, extFloats = self.readOutput()
+        self.assertEqual(data.shape, (2, 2, 3, 4, 5))
+        numpy.testing.assert_array_equal(data[:, 1, 2], 0)
+        numpy.testing.assert_array_equal(data[:, 0, 0], self.data[0, 0])
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -244,6 +244,205 @@ class TestActionTable(unittest.TestCase):
     def test_add_action_returns_time(self):
         self.assertEqual(0.1, self.action_table.addAction(0.1, None, None))
 
+    def test_sort_is_stable(self):
+        handlers = [_MockDeviceHandler(str(i)) for i in range(3)]
+        self.action_table.addAction(2, handlers[0], None)
+        self.action_table.addAction(1, handlers[1], None)
+        self.action_table.addAction(1, handlers[2], None)
+        self.action_table.sort()
+        self.assertEqual(
+            [action[1] for action in self.action_table],
+            [handlers[1], handlers[2], handlers[0]],
+        )
+
+    def test_sort_keeps_exact_times(self):
+        tiny = decimal.Decimal(1e-30)
+        self.action_table.addAction(tiny, None, "b")
+        self.action_table.addAction(0, None, "a")
+        self.action_table.sort()
+        self.assertEqual(
+            [action[2] for action in self.action_table], ["a", "b"]
+        )
+        self.action_table.shiftActionsBack(0, 1)
+        self.assertEqual(self.action_table[1][0], 1 + tiny)
+
+    def test_decimal_times_round_trip(self):
+        """Times like those of the experiment generators, which need not
+        fall on a tick, come back exactly as they were added, also after
+        sorting, shifting, and expanding repeats.
+        """
+        exposure = decimal.Decimal(100) / 3
+        times = [
+            decimal.Decimal("12.345678901"),
+            exposure,
+            exposure + self.action_table.toggleTime,
+            decimal.Decimal(0),
+        ]
+        for t in times:
+            self.action_table.addAction(t, None, None)
+        self.assertEqual([action[0] for action in self.action_table], times)
+        self.action_table.sort()
+        self.assertEqual(
+            [action[0] for action in self.action_table], sorted(times)
+        )
+        self.assertEqual(
+            self.action_table.getFirstAndLastActionTimes(False),
+            (min(times), max(times)),
+        )
+        self.action_table.rebase(exposure)
+        self.assertEqual(
+            [action[0] for action in self.action_table],
+            [t + exposure for t in sorted(times)],
+        )
+
+        block = cockpit.experiment.actionTable.ActionTable()
+        block.addAction(exposure, None, None)
+        table = cockpit.experiment.actionTable.ActionTable()
+        table.addRepeat(exposure, block, 3, 2 * exposure)
+        table.expandRepeats()
+        self.assertEqual(
+            [action[0] for action in table],
+            [exposure + i * 2 * exposure + exposure for i in range(3)],
+        )
+
+    def test_getLastActionFor_after_sort(self):
+        handler = _MockDeviceHandler()
+        other = _MockDeviceHandler("other")
+        self.action_table.addAction(3, handler, "last")
+        self.action_table.addAction(2, other, None)
+        self.action_table.addAction(1, handler, "first")
+        self.assertEqual(
+            self.action_table.getLastActionFor(handler), (1, "first")
+        )
+        self.action_table.sort()
+        self.assertEqual(
+            self.action_table.getLastActionFor(handler), (3, "last")
+        )
+
+    def test_getLastActionFor_skips_deleted(self):
+        handler = _MockDeviceHandler()
+        self.action_table.addAction(0, handler, "kept")
+        self.action_table.addAction(1, handler, "deleted")
+        self.action_table[1] = None
+        self.assertEqual(
+            self.action_table.getLastActionFor(handler), (0, "kept")
+        )
+
+    def test_getColumns(self):
+        handler = _MockDeviceHandler()
+        self.action_table.addAction(decimal.Decimal("1.5"), handler, True)
+        self.action_table.addAction(2, None, 3)
+        ticks, handlerIndices, parameters = self.action_table.getColumns()
+        self.assertEqual(
+            list(ticks),
+            [
+                1.5 * cockpit.experiment.actionTable.TICKS_PER_MS,
+                2 * cockpit.experiment.actionTable.TICKS_PER_MS,
+            ],
+        )
+        self.assertEqual(
+            [self.action_table.handlers[i] for i in handlerIndices],
+            [handler, None],
+        )
+        self.assertEqual(list(parameters), [True, 3])
+
+    def test_filter(self):
+        handler = _MockDeviceHandler()
+        for t in range(4):
+            self.action_table.addAction(t, handler if t % 2 else None, t)
+        self.action_table.filter(self.action_table.getHandlerMask([handler]))
+        self.assertEqual([action[2] for action in self.action_table], [1, 3])
+        self.assertEqual(self.action_table.getLastActionFor(handler), (3, 3))
+
+    def test_rebase(self):
+        for t in (5, 7):
+            self.action_table.addAction(t, None, None)
+        self.action_table.rebase(1)
+        self.assertEqual([action[0] for action in self.action_table], [1, 3])
+        self.assertEqual(
+            self.action_table.getFirstAndLastActionTimes(), (1, 3)
+        )
+
+    def test_add_many_actions(self):
+        for t in range(100):
+            self.action_table.addAction(t, None, t)
+        self.assertEqual(len(self.action_table), 100)
+        self.assertEqual(self.action_table[-1], (99, None, 99))
+
+
+class TestRepeatBlocks(unittest.TestCase):
+    def setUp(self):
+        self.light = _MockDeviceHandler("light")
+        self.camera = _MockDeviceHandler("camera")
+        self.block = cockpit.experiment.actionTable.ActionTable()
+        self.block.addAction(0, self.light, True)
+        self.block.addAction(decimal.Decimal("2.5"), self.light, False)
+        self.block.addAction(3, self.camera, True)
+        self.table = cockpit.experiment.actionTable.ActionTable()
+        self.table.addAction(0, self.camera, False)
+        self.endTime = self.table.addRepeat(1, self.block, 3, 4)
+        self.table.addAction(self.endTime, self.camera, False)
+
+    def getExplicitActions(self):
+        actions = [(0, self.camera, False)]
+        for repeat in range(3):
+            for t, h, p in self.block:
+                actions.append((1 + 4 * repeat + t, h, p))
+        actions.append((13, self.camera, False))
+        return actions
+
+    def test_addRepeat(self):
+        self.assertEqual(self.endTime, 13)
+        self.assertEqual(len(self.table), 3)
+        self.assertEqual(self.table.getFirstAndLastActionTimes(), (0, 13))
+        self.assertEqual(
+            [b.table for b in self.table.getRepeatBlocks()], [self.block]
+        )
+
+    def test_addRepeat_checks_interval(self):
+        with self.assertRaises(ValueError):
+            self.table.addRepeat(20, self.block, 2, 2)
+        with self.assertRaises(ValueError):
+            self.table.addRepeat(20, self.block, 0, 4)
+
+    def test_iterExpanded(self):
+        self.assertEqual(
+            list(self.table.iterExpanded()), self.getExplicitActions()
+        )
+        # The table itself is unchanged.
+        self.assertEqual(len(self.table), 3)
+
+    def test_expandRepeats(self):
+        self.table.expandRepeats()
+        self.assertEqual(list(self.table), self.getExplicitActions())
+        self.assertEqual(self.table.getRepeatBlocks(), [])
+        self.assertEqual(
+            self.table.getLastActionFor(self.light), (11.5, False)
+        )
+
+    def test_expandRepeats_nested(self):
+        outer = cockpit.experiment.actionTable.ActionTable()
+        outer.addRepeat(0, self.table, 2, 20)
+        self.assertEqual(
+            list(outer.iterExpanded()),
+            [
+                (20 * r + t, h, p)
+                for r in (0, 1)
+                for t, h, p in self.table.iterExpanded()
+            ],
+        )
+        expected = list(outer.iterExpanded())
+        outer.expandRepeats()
+        self.assertEqual(list(outer), expected)
+
+    def test_getLastActionFor_in_block(self):
+        self.assertEqual(
+            self.table.getLastActionFor(self.light),
+            (decimal.Decimal("11.5"), False),
+        )
+        # The camera action after the block comes later.
+        self.assertEqual(self.table.getLastActionFor(self.camera), (13, False))
+
 
 if __name__ == "__main__":
     unittest.main()
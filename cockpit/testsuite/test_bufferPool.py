@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## Copyright (C) 2026 University of Oxford
+##
+## This file is part of Cockpit.
+##
+## Cockpit is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## Cockpit is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Cockpit.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+
+import numpy
+
+import cockpit.util.bufferPool
+
+
+class TestBufferPool(unittest.TestCase):
+    def setUp(self):
+        self.pool = cockpit.util.bufferPool.BufferPool(maxBytes=1024)
+
+    def test_acquire_shape_and_dtype(self):
+        buf = self.pool.acquire((4, 8), numpy.uint16)
+        self.assertEqual(buf.shape, (4, 8))
+        self.assertEqual(buf.dtype, numpy.uint16)
+        self.assertTrue(buf.flags.c_contiguous)
+
+    def test_release_then_acquire_reuses(self):
+        buf = self.pool.acquire((4, 8), numpy.uint16)
+        self.pool.release(buf)
+        self.assertIs(self.pool.acquire((4, 8), numpy.uint16), buf)
+        self.assertEqual(self.pool.numAcquired, 2)
+        self.assertEqual(self.pool.numAllocated, 1)
+
+    def test_keyed_by_dtype(self):
+        buf = self.pool.acquire((4, 8), numpy.uint16)
+        self.pool.release(buf)
+        self.assertIsNot(self.pool.acquire((4, 8), numpy.float32), buf)
+
+    def test_keyed_by_shape(self):
+        buf = self.pool.acquire((4, 8), numpy.uint16)
+        self.pool.release(buf)
+        self.assertIsNot(self.pool.acquire((8, 4), numpy.uint16), buf)
+
+    def test_zero(self):
+        buf = self.pool.acquire((4, 8), numpy.uint16)
+        buf.fill(7)
+        self.pool.release(buf)
+        self.assertFalse(
+            self.pool.acquire((4, 8), numpy.uint16, zero=True).any()
+        )
+
+    def test_max_bytes(self):
+        big = self.pool.acquire((2048,), numpy.uint8)
+        self.pool.release(big)
+        self.assertIsNot(self.pool.acquire((2048,), numpy.uint8), big)
+
+    def test_clear(self):
+        buf = self.pool.acquire((4, 8), numpy.uint16)
+        self.pool.release(buf)
+        self.pool.clear()
+        self.assertIsNot(self.pool.acquire((4, 8), numpy.uint16), buf)
+
+
+if __name__ == "__main__":
+    unittest.main()
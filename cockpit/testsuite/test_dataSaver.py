@@ -0,0 +1,326 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## Copyright (C) 2026 University of Oxford
+##
+## This file is part of Cockpit.
+##
+## Cockpit is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## Cockpit is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Cockpit.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import tempfile
+import threading
+import unittest
+import unittest.mock
+
+import numpy
+import numpy.testing
+
+import cockpit.util.datadoc
+import cockpit.util.Mrc
+from cockpit.experiment import dataSaver
+
+
+class TestImageQueue(unittest.TestCase):
+    def setUp(self):
+        self.spillDir = tempfile.TemporaryDirectory()
+        # Each image is 200 bytes.
+        self.images = [
+            numpy.full((10, 10), i, dtype=numpy.uint16) for i in range(10)
+        ]
+
+    def tearDown(self):
+        self.spillDir.cleanup()
+
+    def makeQueue(self, maxBytes, spillBytes=0):
+        spillDir = self.spillDir.name if spillBytes else None
+        imageQueue = dataSaver.ImageQueue(2, maxBytes, spillDir, spillBytes)
+        self.addCleanup(imageQueue.close)
+        return imageQueue
+
+    def assertImagesOut(self, imageQueue, expected):
+        for cameraIndex, value in expected:
+            index, imageData, metadata, arrivalTime = imageQueue.get()
+            self.assertEqual(index, cameraIndex)
+            if value is None:
+                self.assertIsNone(imageData)
+            else:
+                numpy.testing.assert_equal(imageData, self.images[value])
+        self.assertTrue(imageQueue.empty())
+
+    def test_unbounded(self):
+        imageQueue = self.makeQueue(float("inf"))
+        for i in range(4):
+            imageQueue.put(i % 2, self.images[i], {})
+        self.assertEqual(imageQueue.maxDepth, 4)
+        self.assertEqual(imageQueue.maxBytesQueued, 800)
+        self.assertImagesOut(imageQueue, [(0, 0), (1, 1), (0, 2), (1, 3)])
+
+    def test_drop_without_spill(self):
+        imageQueue = self.makeQueue(400)
+        for i in range(4):
+            imageQueue.put(i % 2, self.images[i], {})
+        self.assertEqual(imageQueue.numDropped, [1, 1])
+        self.assertImagesOut(
+            imageQueue, [(0, 0), (1, 1), (0, None), (1, None)]
+        )
+
+    def test_spill_keeps_order(self):
+        imageQueue = self.makeQueue(200, spillBytes=400)
+        for i in range(4):
+            imageQueue.put(0, self.images[i], {})
+        self.assertEqual(imageQueue.numSpilled, [2, 0])
+        self.assertEqual(imageQueue.bytesSpilled, [400, 0])
+        self.assertEqual(imageQueue.numDropped, [1, 0])
+        self.assertImagesOut(imageQueue, [(0, 0), (0, 1), (0, 2), (0, None)])
+
+    def test_arrival_times(self):
+        imageQueue = self.makeQueue(200, spillBytes=200)
+        for i in range(3):
+            imageQueue.put(0, self.images[i], {}, 10.0 + i)
+        # In memory, spilled, and dropped.
+        self.assertEqual([imageQueue.get()[3] for i in range(3)], [10, 11, 12])
+
+    def test_spill_wraps_around(self):
+        imageQueue = self.makeQueue(0, spillBytes=500)
+        imageQueue.put(0, self.images[0], {})
+        imageQueue.put(0, self.images[1], {})
+        self.assertEqual(imageQueue.get()[1][0, 0], 0)
+        # Only the start of the file is free now.
+        imageQueue.put(0, self.images[2], {})
+        self.assertEqual(list(imageQueue.spillExtents), [(200, 200), (0, 200)])
+        self.assertImagesOut(imageQueue, [(0, 1), (0, 2)])
+
+    def test_spill_written_outside_lock(self):
+        imageQueue = self.makeQueue(200, spillBytes=400)
+        imageQueue.put(0, self.images[0], {})
+        spilling = threading.Event()
+        release = threading.Event()
+        writeSpill = imageQueue._writeSpill
+
+        def slowWriteSpill(offset, imageData):
+            spilling.set()
+            release.wait(5)
+            writeSpill(offset, imageData)
+
+        imageQueue._writeSpill = slowWriteSpill
+        putter = threading.Thread(
+            target=imageQueue.put, args=(1, self.images[1], {})
+        )
+        putter.start()
+        self.assertTrue(spilling.wait(5))
+        # The image in memory can be had while the other is written.
+        self.assertEqual(imageQueue.get()[0], 0)
+        release.set()
+        putter.join(5)
+        self.assertImagesOut(imageQueue, [(1, 1)])
+
+    def test_stop_wakes_get(self):
+        imageQueue = self.makeQueue(float("inf"))
+        imageQueue.put(0, self.images[0], {})
+        results = []
+
+        def getTwice():
+            results.extend([imageQueue.get(), imageQueue.get()])
+
+        getter = threading.Thread(target=getTwice)
+        getter.start()
+        imageQueue.stop()
+        getter.join(5)
+        self.assertFalse(getter.is_alive())
+        self.assertEqual(results[0][0], 0)
+        self.assertIsNone(results[1])
+
+
+class TestWriters(unittest.TestCase):
+    planeShape = (6, 8)
+
+    def setUp(self):
+        header = cockpit.util.datadoc.makeHeaderForShape(
+            (1, 1, 4) + self.planeShape, numpy.uint16
+        )
+        header.NumIntegers = 8
+        header.NumFloats = 32
+        header.next = 4 * 40 * 4
+        self.handle = tempfile.TemporaryFile()
+        self.addCleanup(self.handle.close)
+        self.headers = [header]
+        rng = numpy.random.default_rng(0)
+        self.images = [
+            # Full size, narrower, shorter, and not uint16.
+            rng.integers(0, 2**16, self.planeShape, dtype=numpy.uint16),
+            rng.integers(0, 2**16, (4, 5), dtype=numpy.uint16),
+            rng.integers(0, 2**16, (3, 8), dtype=numpy.uint16),
+            rng.integers(0, 2**16, (6, 3), dtype=numpy.int32),
+        ]
+
+    def assertPlanesWritten(self, writer):
+        self.addCleanup(writer.close)
+        floats = numpy.arange(32, dtype=numpy.float32)
+        for i, image in enumerate(self.images):
+            writer.writePlane(0, i, floats, image)
+        writer.flush()
+        self.handle.seek(1024 + int(self.headers[0].next))
+        planes = numpy.frombuffer(self.handle.read(), numpy.uint16)
+        planes = planes.reshape((4,) + self.planeShape)
+        for plane, image in zip(planes, self.images):
+            expected = numpy.zeros(self.planeShape, numpy.uint16)
+            expected[: image.shape[0], : image.shape[1]] = image
+            numpy.testing.assert_array_equal(plane, expected)
+
+    def test_seek_writer(self):
+        self.assertPlanesWritten(
+            dataSaver.SeekWriter([self.handle], self.headers, self.planeShape)
+        )
+
+    def test_positional_writer(self):
+        self.assertPlanesWritten(
+            dataSaver.PositionalWriter(
+                [self.handle], self.headers, self.planeShape, 2
+            )
+        )
+
+    def test_full_planes_are_not_copied(self):
+        writer = dataSaver.SeekWriter(
+            [self.handle], self.headers, self.planeShape
+        )
+        self.addCleanup(writer.close)
+        chunks, paddedBuffer = writer.getPlaneChunks(0, self.images[0])
+        self.assertIsNone(paddedBuffer)
+        self.assertIs(chunks[0][1], self.images[0])
+
+    @unittest.skipUnless(hasattr(os, "pwritev"), "needs os.pwritev")
+    def test_narrow_planes_are_written_at_once(self):
+        writer = dataSaver.PositionalWriter(
+            [self.handle], self.headers, self.planeShape, 1
+        )
+        self.addCleanup(writer.close)
+        chunks, paddedBuffer = writer.getPlaneChunks(0, self.images[1])
+        self.assertIsNone(paddedBuffer)
+        self.assertEqual(len(chunks), 1)
+        # Four rows, with the padding of the first three in between.
+        self.assertEqual(len(chunks[0][1]), 7)
+
+
+class TestHistogramStatistics(unittest.TestCase):
+    def test_median_matches_numpy(self):
+        rng = numpy.random.default_rng(0)
+        for size in (1, 2, 7, 1000, 1001):
+            image = rng.integers(0, 2**16, size, dtype=numpy.uint16)
+            counts = dataSaver.getImageHistogram(image)
+            self.assertEqual(
+                cockpit.util.Mrc.histogramMedian(counts), numpy.median(image)
+            )
+
+    def test_histogram_of_other_types(self):
+        image = numpy.array([[0, 3], [3, 2**16 + 5]], dtype=numpy.int32)
+        counts = dataSaver.getImageHistogram(image)
+        self.assertEqual(counts.shape, (2**16,))
+        self.assertEqual(counts[3], 2)
+        self.assertEqual(counts[5], 1)
+
+
+class TestFilePerCameraPaths(unittest.TestCase):
+    def setUp(self):
+        self.camera = unittest.mock.Mock()
+        self.camera.name = "Andor"
+
+    def test_camera_path(self):
+        self.assertEqual(
+            dataSaver.getCameraPath("/data/run.dv", self.camera),
+            "/data/run_Andor.dv",
+        )
+        self.assertEqual(
+            dataSaver.getCameraPath("/data/run", self.camera),
+            "/data/run_Andor",
+        )
+
+    def test_manifest_path(self):
+        self.assertEqual(
+            dataSaver.getManifestPath("/data/run.dv"), "/data/run.json"
+        )
+
+
+class TestSaveTelemetry(unittest.TestCase):
+    def setUp(self):
+        self.imageQueue = dataSaver.ImageQueue(2, float("inf"))
+        self.addCleanup(self.imageQueue.close)
+        self.logDir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.logDir.cleanup)
+        self.logPath = dataSaver.getTelemetryPath(
+            self.logDir.name + "/data.dv"
+        )
+        self.telemetry = dataSaver.SaveTelemetry(
+            ["a", "b"], [4, 2], self.imageQueue, self.logPath
+        )
+        self.addCleanup(self.telemetry.close)
+
+    def test_snapshot(self):
+        self.imageQueue.put(0, numpy.zeros(10, numpy.uint16), {})
+        self.telemetry.recordImage(0, 100, 0.0015)
+        self.telemetry.recordImage(0, 100, 10.0)
+        self.telemetry.recordImage(0, 0, None)
+        snapshot = self.telemetry.getSnapshot()
+        self.assertEqual(snapshot["queue_depth"], 1)
+        self.assertEqual(snapshot["queue_bytes"], 20)
+        self.assertEqual([c["images"] for c in snapshot["cameras"]], [3, 0])
+        counts = snapshot["latency_counts"]
+        self.assertEqual(sum(counts), 2)
+        self.assertEqual(counts[1], 1)
+        self.assertEqual(counts[-1], 1)
+        self.assertGreaterEqual(snapshot["since_last_image"], 0.0)
+        # Camera "b" has no images yet, so there is no telling when it
+        # will be done.
+        self.assertIsNone(snapshot["projected_finish"])
+
+    def test_rates_since_previous_snapshot(self):
+        self.telemetry.recordImage(1, 2**20, 0.0)
+        self.telemetry.getSnapshot()
+        snapshot = self.telemetry.getSnapshot()
+        self.assertEqual(snapshot["cameras"][1]["fps"], 0.0)
+        self.assertEqual(snapshot["cameras"][1]["mbps"], 0.0)
+
+    def test_projected_finish(self):
+        for cameraIndex in (0, 0, 1, 1):
+            self.telemetry.recordImage(cameraIndex, 0, 0.0)
+        snapshot = self.telemetry.getSnapshot()
+        # "b" is done, so only "a" is still to finish.
+        self.assertGreater(snapshot["projected_finish"], snapshot["time"])
+        self.telemetry.recordImage(0, 0, 0.0)
+        self.telemetry.recordImage(0, 0, 0.0)
+        snapshot = self.telemetry.getSnapshot()
+        self.assertEqual(snapshot["projected_finish"], snapshot["time"])
+
+    def test_log(self):
+        self.telemetry.recordImage(0, 100, 0.0)
+        self.telemetry.log(self.telemetry.getSnapshot())
+        self.telemetry.log(self.telemetry.getSnapshot())
+        self.telemetry.close()
+        with open(self.logPath) as fh:
+            lines = [line.rstrip("\n").split(";") for line in fh]
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(lines[0][:2], ["timestamp", "queue depth"])
+        self.assertIn("a MB/s", lines[0])
+        for line in lines[1:]:
+            self.assertEqual(len(line), len(lines[0]))
+
+    def test_telemetry_path(self):
+        self.assertEqual(
+            dataSaver.getTelemetryPath("/data/run.dv"),
+            "/data/run_saving.log",
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## Copyright (C) 2026 University of Oxford
+##
+## This file is part of Cockpit.
+##
+## Cockpit is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## Cockpit is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Cockpit.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+
+import numpy
+
+from cockpit.util import decimation
+
+
+class TestGetFactor(unittest.TestCase):
+    def test_factor(self):
+        self.assertEqual(decimation.getFactor((2048, 2048), (512, 512), 1), 4)
+        self.assertEqual(decimation.getFactor((4096, 4096), (700, 600), 1), 4)
+        self.assertEqual(decimation.getFactor((2048, 1024), (512, 512), 2), 2)
+
+    def test_zoomed_in(self):
+        self.assertEqual(decimation.getFactor((512, 512), (512, 512), 1), 1)
+        self.assertEqual(decimation.getFactor((2048, 2048), (512, 512), 8), 1)
+
+
+class TestGetVisibleRegion(unittest.TestCase):
+    def test_whole_image(self):
+        self.assertEqual(
+            decimation.getVisibleRegion((100, 200), 1, (0, 0)),
+            (0, 100, 0, 200),
+        )
+
+    def test_zoomed_in(self):
+        # Zoomed in 4 times, the middle quarter of each axis, plus a
+        # margin of a quarter of that on each side, is visible.
+        self.assertEqual(
+            decimation.getVisibleRegion((400, 400), 4, (0, 0)),
+            (125, 275, 125, 275),
+        )
+        self.assertEqual(
+            decimation.getVisibleRegion((400, 400), 4, (0, 0), margin=0),
+            (150, 250, 150, 250),
+        )
+
+    def test_panned(self):
+        # Panning right shows the left of the image, and panning up
+        # shows the bottom.
+        y0, y1, x0, x1 = decimation.getVisibleRegion(
+            (400, 400), 4, (0.5, 0.5), margin=0
+        )
+        self.assertEqual((x0, x1), (50, 150))
+        self.assertEqual((y0, y1), (250, 350))
+
+    def test_aligned(self):
+        y0, y1, x0, x1 = decimation.getVisibleRegion(
+            (1000, 1000), 3, (0.01, 0), factor=4
+        )
+        self.assertTrue(all(v % 4 == 0 for v in (y0, y1, x0, x1)))
+
+    def test_not_visible(self):
+        self.assertEqual(
+            decimation.getVisibleRegion((100, 100), 4, (10, 0)),
+            (0, 100, 0, 100),
+        )
+
+
+class TestDecimate(unittest.TestCase):
+    def test_bins(self):
+        data = numpy.arange(36, dtype=numpy.uint16).reshape(6, 6)
+        binned = decimation.decimate(data, 2)
+        self.assertEqual(binned.dtype, numpy.uint16)
+        expected = data.reshape(3, 2, 3, 2).mean(axis=(1, 3)).astype(int)
+        numpy.testing.assert_array_equal(binned, expected)
+
+    def test_no_overflow(self):
+        data = numpy.full((8, 8), 65535, numpy.uint16)
+        numpy.testing.assert_array_equal(
+            decimation.decimate(data, 8), [[65535]]
+        )
+
+    def test_remainder(self):
+        data = numpy.ones((9, 7), numpy.float32)
+        binned = decimation.decimate(data, 4)
+        self.assertEqual(binned.shape, (2, 1))
+        self.assertEqual(binned.dtype, numpy.float32)
+
+    def test_factor_one(self):
+        data = numpy.zeros((4, 4))
+        self.assertIs(decimation.decimate(data, 1), data)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -18,6 +18,7 @@
 ## You should have received a copy of the GNU General Public License
 ## along with Cockpit.  If not, see <http://www.gnu.org/licenses/>.
 
+import threading
 import unittest
 import unittest.mock
 
@@ -101,6 +102,143 @@ class TestSubscriptions(TestEvents):
         for subscriber in [self.subscriber] + extra_subscribers:
             subscriber.assert_called_once()
 
+    def test_subscribe_while_publishing(self):
+        """Subscribers added during publication are called from the next"""
+        late_subscriber = unittest.mock.Mock()
+
+        def subscribe_late():
+            cockpit.events.subscribe(self.event_name, late_subscriber)
+
+        cockpit.events.subscribe(self.event_name, subscribe_late)
+        cockpit.events.publish(self.event_name)
+        late_subscriber.assert_not_called()
+        cockpit.events.publish(self.event_name)
+        late_subscriber.assert_called_once_with()
+
+
+class TestAsyncSubscriptions(TestEvents):
+    def setUp(self):
+        super().setUp()
+        self.received = []
+        self.started = threading.Semaphore(0)
+        self.release = threading.Event()
+        self.done = threading.Semaphore(0)
+
+    def slow_subscriber(self, value):
+        self.started.release()
+        self.release.wait(5)
+        self.received.append(value)
+        self.done.release()
+
+    def subscribe(self, queue_size, overflow):
+        cockpit.events.subscribe(
+            self.event_name,
+            self.slow_subscriber,
+            queue_size=queue_size,
+            overflow=overflow,
+        )
+        self.addCleanup(
+            cockpit.events.unsubscribe, self.event_name, self.slow_subscriber
+        )
+        self.addCleanup(self.release.set)
+
+    def publish_while_busy(self, values):
+        """Publish the first value, and the rest while it is handled."""
+        cockpit.events.publish(self.event_name, values[0])
+        self.assertTrue(self.started.acquire(timeout=5))
+        for value in values[1:]:
+            cockpit.events.publish(self.event_name, value)
+
+    def wait_for_calls(self, count):
+        self.release.set()
+        for i in range(count):
+            self.assertTrue(self.done.acquire(timeout=5))
+
+    def test_publish_does_not_wait(self):
+        self.subscribe(4, cockpit.events.OVERFLOW_DROP_OLDEST)
+        self.publish_while_busy([0, 1, 2])
+        self.assertEqual(self.received, [])
+        self.wait_for_calls(3)
+        self.assertEqual(self.received, [0, 1, 2])
+
+    def test_drop_oldest(self):
+        self.subscribe(2, cockpit.events.OVERFLOW_DROP_OLDEST)
+        self.publish_while_busy([0, 1, 2, 3, 4])
+        self.wait_for_calls(3)
+        self.assertEqual(self.received, [0, 3, 4])
+
+    def test_latest_only(self):
+        self.subscribe(10, cockpit.events.OVERFLOW_LATEST_ONLY)
+        self.publish_while_busy([0, 1, 2, 3, 4])
+        self.wait_for_calls(2)
+        self.assertEqual(self.received, [0, 4])
+
+    def test_block(self):
+        self.subscribe(1, cockpit.events.OVERFLOW_BLOCK)
+        self.publish_while_busy([0, 1])
+        publisher = threading.Thread(
+            target=cockpit.events.publish, args=(self.event_name, 2)
+        )
+        publisher.start()
+        publisher.join(0.1)
+        self.assertTrue(publisher.is_alive())
+        self.wait_for_calls(3)
+        publisher.join(5)
+        self.assertEqual(self.received, [0, 1, 2])
+
+    def test_unsubscribe(self):
+        self.subscribe(4, cockpit.events.OVERFLOW_DROP_OLDEST)
+        self.publish_while_busy([0, 1])
+        cockpit.events.unsubscribe(self.event_name, self.slow_subscriber)
+        cockpit.events.publish(self.event_name, 2)
+        # Events still queued are discarded.
+        self.wait_for_calls(1)
+        self.assertEqual(self.received, [0])
+
+    def test_invalid_overflow(self):
+        with self.assertRaises(ValueError):
+            self.subscribe(1, "drop newest")
+
+
+class TestProfiling(TestEvents):
+    def setUp(self):
+        super().setUp()
+        cockpit.events.subscribe(self.event_name, self.subscriber)
+        self.addCleanup(cockpit.events.stop_profiling)
+
+    def test_not_profiling(self):
+        self.assertIsNone(cockpit.events.stop_profiling())
+
+    def test_counts(self):
+        cockpit.events.oneShotSubscribe(self.event_name, self.subscriber)
+        profiler = cockpit.events.start_profiling()
+        for i in range(3):
+            cockpit.events.publish(self.event_name)
+        cockpit.events.publish("other " + self.event_name)
+        snapshot = profiler.snapshot()
+        self.assertEqual(
+            snapshot["publish_counts"],
+            {self.event_name: 3, "other " + self.event_name: 1},
+        )
+        [stats] = snapshot["subscribers"]
+        self.assertEqual(stats["event"], self.event_name)
+        self.assertEqual(stats["calls"], 4)
+        self.assertEqual(sum(stats["histogram"]), 4)
+        self.assertGreaterEqual(stats["max"], stats["mean"])
+        self.assertIn(stats["subscriber"], profiler.format_report())
+
+    def test_stop(self):
+        profiler = cockpit.events.start_profiling()
+        cockpit.events.publish(self.event_name)
+        self.assertIs(cockpit.events.stop_profiling(), profiler)
+        cockpit.events.publish(self.event_name)
+        self.assertEqual(profiler.snapshot()["subscribers"][0]["calls"], 1)
+
+    def test_slow_subscriber_warning(self):
+        cockpit.events.start_profiling(slow_threshold=0.0)
+        with self.assertLogs("cockpit.events", "WARNING"):
+            cockpit.events.publish(self.event_name)
+
 
 class TestOneShotSubscriptions(TestEvents):
     def setUp(self):
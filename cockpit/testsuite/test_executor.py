@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## Copyright (C) 2026 University of Oxford
+##
+## This file is part of Cockpit.
+##
+## Cockpit is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## Cockpit is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Cockpit.  If not, see <http://www.gnu.org/licenses/>.
+
+import decimal
+import unittest
+import unittest.mock
+
+import numpy
+import numpy.testing
+
+import cockpit.devices.executorDevices
+import cockpit.experiment.actionTable
+import cockpit.handlers.executor
+
+
+def _makeClient(name):
+    client = unittest.mock.Mock()
+    client.name = name
+    return client
+
+
+class TestCompileTable(unittest.TestCase):
+    def setUp(self):
+        self.executor = cockpit.handlers.executor.AnalogDigitalExecutorHandler(
+            "executor",
+            "testsuite",
+            {
+                "readDigital": lambda: 0b1000,
+                "getAnalog": lambda line: 10.0 * line,
+            },
+            dlines=3,
+            alines=2,
+        )
+        self.lights = [_makeClient("light%d" % i) for i in (0, 1)]
+        for line, light in enumerate(self.lights):
+            self.executor.registerDigital(light, line)
+        self.piezo = self.executor.registerAnalog(
+            _makeClient("piezo"), 1, offset=1, gain=2
+        )
+        self.table = cockpit.experiment.actionTable.ActionTable()
+
+    def compile(self):
+        return self.executor.compileTable(self.table, 0, len(self.table))
+
+    def test_merges_simultaneous_actions(self):
+        self.table.addAction(0, self.lights[0], True)
+        self.table.addAction(0, self.lights[1], True)
+        self.table.addAction(decimal.Decimal("1.5"), self.lights[0], False)
+        self.table.addAction(decimal.Decimal("1.5"), self.piezo, 3)
+        compiled = self.compile()
+        numpy.testing.assert_array_equal(compiled.times, [0, 1.5])
+        # Clearing a line also clears line 3, which we do not have.
+        numpy.testing.assert_array_equal(compiled.digital, [0b1011, 0b0010])
+        numpy.testing.assert_array_equal(compiled.analog, [[0, 10], [0, 8]])
+
+    def test_analog_values_carry_forward(self):
+        self.table.addAction(0, self.piezo, 0)
+        self.table.addAction(1, self.lights[0], True)
+        self.table.addAction(2, self.piezo, 1)
+        compiled = self.compile()
+        numpy.testing.assert_array_equal(compiled.analog[:, 1], [2, 2, 4])
+        numpy.testing.assert_array_equal(compiled.analog[:, 0], [0, 0, 0])
+
+    def test_duplicate_actions(self):
+        self.table.addAction(0, self.lights[0], True)
+        self.table.addAction(0, self.lights[0], True)
+        self.assertEqual(len(self.compile()), 1)
+
+    def test_conflicting_actions(self):
+        self.table.addAction(0, self.lights[0], True)
+        self.table.addAction(0, self.lights[1], True)
+        self.table.addAction(0, self.lights[0], False)
+        with self.assertRaises(Exception):
+            self.compile()
+
+    def test_close_times_are_not_merged(self):
+        self.table.addAction(0, self.lights[0], True)
+        self.table.addAction(decimal.Decimal(1e-30), self.lights[0], False)
+        self.assertEqual(len(self.compile()), 2)
+
+    def test_reuses_compiled_tables(self):
+        self.table.addAction(0, self.lights[0], True)
+        self.table.addAction(1, self.piezo, 2)
+        compiled = self.compile()
+        self.assertIsNotNone(compiled.key)
+        self.assertIs(self.compile(), compiled)
+        # The same actions in a new table, as at the next site of a
+        # multi-site experiment.
+        table = cockpit.experiment.actionTable.ActionTable()
+        table.addAction(0, self.lights[0], True)
+        table.addAction(1, self.piezo, 2)
+        self.assertIs(self.executor.compileTable(table, 0, 2), compiled)
+        table[1] = (1, self.piezo, 3)
+        self.assertIsNot(self.executor.compileTable(table, 0, 2), compiled)
+
+    def test_compiled_tables_depend_on_initial_state(self):
+        self.table.addAction(0, self.piezo, 2)
+        compiled = self.compile()
+        self.executor.callbacks["getAnalog"] = lambda line: 0.0
+        self.assertIsNot(self.compile(), compiled)
+
+    def test_compiled_tables_depend_on_analog_settings(self):
+        self.table.addAction(0, self.piezo, 2)
+        self.table.addAction(1, self.piezo, (0, None))
+        self.piezo.positions = [4]
+        compiled = self.compile()
+        self.piezo.gain = 3
+        recalibrated = self.compile()
+        self.assertIsNot(recalibrated, compiled)
+        self.assertEqual(recalibrated.analog[0, 1], 9)
+        self.piezo.positions = [5]
+        self.assertIsNot(self.compile(), recalibrated)
+
+
+class TestLegacyDSPProfiles(unittest.TestCase):
+    def setUp(self):
+        # Skip the constructor, which needs a configured device.
+        self.dsp = cockpit.devices.executorDevices.LegacyDSP.__new__(
+            cockpit.devices.executorDevices.LegacyDSP
+        )
+        self.dsp.name = "dsp"
+        self.dsp.tickrate = 10
+        self.dsp.connection = unittest.mock.Mock()
+        self.dsp._currentAnalogs = [0] * 4
+        self.dsp._lastAnalogs = [0] * 4
+        self.dsp._loadedProfileKey = None
+        patcher = unittest.mock.patch("cockpit.events.executeAndWaitFor")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.table = cockpit.handlers.executor.CompiledTable(
+            numpy.array([0, 10**6, 2 * 10**6]),
+            numpy.zeros(3),
+            numpy.array([1, 0, 1]),
+            numpy.array([[0, 0, 0, 0], [5, 0, 0, 0], [5, 0, 0, 0]]),
+            key="key",
+        )
+
+    def test_profile(self):
+        self.dsp.executeTable(self.table, 0, 3, 1, None)
+        description, digitals, analogs = self.dsp._lastProfile
+        numpy.testing.assert_array_equal(digitals, [[0, 1], [10, 0], [20, 1]])
+        numpy.testing.assert_array_equal(analogs[0], [[0, 0], [10, 5]])
+        self.assertEqual(description["nAnalog"], [2, 1, 1, 1])
+        self.assertEqual(description["count"], 20)
+
+    def test_same_profile_is_not_downloaded_again(self):
+        self.dsp.executeTable(self.table, 0, 3, 1, None)
+        self.dsp.executeTable(self.table, 0, 3, 2, None)
+        self.assertEqual(self.dsp.connection.DownloadProfile.call_count, 1)
+        self.assertEqual(self.dsp.connection.InitProfile.call_count, 2)
+        self.dsp.executeTable(self.table, 0, 2, 1, None)
+        self.assertEqual(self.dsp.connection.DownloadProfile.call_count, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## Copyright (C) 2026 University of Oxford
+##
+## This file is part of Cockpit.
+##
+## Cockpit is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## Cockpit is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Cockpit.  If not, see <http://www.gnu.org/licenses/>.
+
+import configparser
+import unittest
+import unittest.mock
+
+import cockpit.depot
+import cockpit.devices.boulderSLM
+import cockpit.experiment.actionTable
+import cockpit.experiment.experiment
+import cockpit.handlers.executor
+
+
+def _makeHandler(name, deviceType=cockpit.depot.GENERIC_DEVICE):
+    handler = unittest.mock.Mock()
+    handler.name = name
+    handler.deviceType = deviceType
+    handler.callbacks = {}
+    return handler
+
+
+class TestExecutionPlan(unittest.TestCase):
+    def setUp(self):
+        self.light = _makeHandler("light")
+        self.camera = _makeHandler("camera")
+        self.stage = _makeHandler("stage", cockpit.depot.STAGE_POSITIONER)
+        self.dsp = _makeHandler("dsp")
+        self.dsp.getRunnableHandlers.return_value = {self.light, self.camera}
+        self.trigger = _makeHandler("trigger")
+        self.trigger.getRunnableHandlers.return_value = {self.camera}
+        patcher = unittest.mock.patch(
+            "cockpit.depot.getHandlersOfType",
+            return_value=[self.trigger, self.dsp],
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Skip the constructor, which needs a whole microscope.
+        self.experiment = cockpit.experiment.experiment.Experiment.__new__(
+            cockpit.experiment.experiment.Experiment
+        )
+        self.experiment._executionPlanTable = None
+        self.experiment.table = self.makeTable(
+            [self.camera, self.light, self.camera, self.stage, self.camera]
+        )
+
+    def makeTable(self, handlers):
+        table = cockpit.experiment.actionTable.ActionTable()
+        for time, handler in enumerate(handlers):
+            table.addAction(time, handler, True)
+        return table
+
+    def test_plan(self):
+        self.assertEqual(
+            self.experiment.getExecutionPlan(),
+            [(self.dsp, 0, 3), (None, 3, 4), (self.trigger, 4, 5)],
+        )
+
+    def test_plan_is_cached(self):
+        plan = self.experiment.getExecutionPlan()
+        self.assertIs(self.experiment.getExecutionPlan(), plan)
+        self.experiment.table = self.makeTable([self.light])
+        self.assertEqual(
+            self.experiment.getExecutionPlan(), [(self.dsp, 0, 1)]
+        )
+
+    def test_unrunnable_action(self):
+        self.experiment.table = self.makeTable([_makeHandler("laser")])
+        with self.assertRaises(RuntimeError):
+            self.experiment.getExecutionPlan()
+
+    def test_describe(self):
+        lines = self.experiment.describeExecutionPlan().split("\n")
+        self.assertEqual(len(lines), 3)
+        self.assertIn("software: stage", lines[1])
+
+
+class TestRepeatBlocksInDeviceHooks(unittest.TestCase):
+    def setUp(self):
+        self.camera = _makeHandler("camera", cockpit.depot.CAMERA)
+        block = cockpit.experiment.actionTable.ActionTable()
+        block.addAction(0, self.camera, True)
+        block.addAction(1, self.camera, False)
+        self.slm = cockpit.devices.boulderSLM.BoulderSLM.__new__(
+            cockpit.devices.boulderSLM.BoulderSLM
+        )
+        self.slm.handler = _makeHandler("slm")
+        self.slm.handler.addToggle.side_effect = lambda t, table: (t, 0)
+        for name in ("asproxy", "connection", "last", "wait"):
+            setattr(self.slm, name, unittest.mock.Mock())
+        self.slm.cycleToPosition = unittest.mock.Mock()
+        self.table = cockpit.experiment.actionTable.ActionTable()
+        self.table.addAction(0, self.slm.handler, (0, 0, 488))
+        self.table.addRepeat(1, block, 3, 2)
+        self.table.addAction(8, self.slm.handler, (0, 1, 488))
+
+    def test_blocks_look_like_handlers(self):
+        block = self.table[1][1]
+        self.assertIsInstance(block.name, str)
+        self.assertIsInstance(block.deviceType, str)
+        self.assertEqual(block.callbacks, {})
+        self.assertFalse(block.getIsEligibleForExperiments())
+        self.assertIn(block.name, block.getIdentifier())
+
+    def test_slm_examineActions(self):
+        with unittest.mock.patch("time.sleep"):
+            self.slm.examineActions(self.table)
+        handlers = [action[1] for action in self.table]
+        self.assertEqual(len(self.table.getRepeatBlocks()), 1)
+        self.assertIn(self.table.getRepeatBlocks()[0], handlers)
+
+
+class TestRepeatBlocksWithSimpleExecutors(unittest.TestCase):
+    def setUp(self):
+        self.camera = _makeHandler("camera", cockpit.depot.CAMERA)
+        self.simple = cockpit.handlers.executor.SimpleExecutor(
+            "simple",
+            "group",
+            True,
+            {
+                "executeTable": unittest.mock.Mock(),
+                "examineActions": unittest.mock.Mock(),
+            },
+        )
+        self.dsp = _makeHandler("dsp")
+        self.dsp.getRunnableHandlers.return_value = {self.camera}
+        self.dsp.getNumRunnableLines.side_effect = (
+            lambda table, index: len(table) - index
+        )
+        self.executors = [self.simple, self.dsp]
+        patcher = unittest.mock.patch(
+            "cockpit.depot.getHandlersOfType",
+            side_effect=lambda deviceType: self.executors,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        block = cockpit.experiment.actionTable.ActionTable()
+        block.addAction(0, self.camera, True)
+        block.addAction(1, self.camera, False)
+        self.experiment = cockpit.experiment.experiment.Experiment.__new__(
+            cockpit.experiment.experiment.Experiment
+        )
+        self.experiment._executionPlanTable = None
+        self.experiment.table = cockpit.experiment.actionTable.ActionTable()
+        self.experiment.table.addAction(0, self.simple, True)
+        self.experiment.table.addRepeat(1, block, 3, 2)
+
+    def test_repeat_executor(self):
+        self.experiment.examineActions()
+        block = self.experiment.table.getRepeatBlocks()[0]
+        self.assertIs(self.experiment.getRepeatExecutor(block), self.dsp)
+        self.assertEqual(
+            self.experiment.getExecutionPlan(),
+            [(self.simple, 0, 1), (self.dsp, 1, 2)],
+        )
+
+    def test_repeats_expanded_without_repeat_executor(self):
+        self.executors = [self.simple]
+        self.experiment.examineActions()
+        self.assertEqual(self.experiment.table.getRepeatBlocks(), [])
+        self.assertEqual(len(self.experiment.table), 7)
+
+
+class TestPreflightCheck(unittest.TestCase):
+    def setUp(self):
+        self.experiment = cockpit.experiment.experiment.Experiment.__new__(
+            cockpit.experiment.experiment.Experiment
+        )
+        self.experiment.simulate = unittest.mock.Mock()
+
+    def preflightCheck(self, enabled="yes"):
+        config = configparser.ConfigParser()
+        config.read_dict({"experiment": {"preflight-check": enabled}})
+        with unittest.mock.patch(
+            "cockpit.experiment.experiment.wx.GetApp",
+            return_value=unittest.mock.Mock(Config=config),
+        ):
+            return self.experiment.preflightCheck()
+
+    def test_turned_off(self):
+        self.assertTrue(self.preflightCheck(enabled="no"))
+        self.experiment.simulate.assert_not_called()
+
+    def test_failed_simulation(self):
+        self.experiment.simulate.side_effect = RuntimeError("no model")
+        with self.assertLogs("cockpit.experiment.experiment", "ERROR"):
+            self.assertTrue(self.preflightCheck())
+
+
+if __name__ == "__main__":
+    unittest.main()
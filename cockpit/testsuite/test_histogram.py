@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## Copyright (C) 2026 University of Oxford
+##
+## This file is part of Cockpit.
+##
+## Cockpit is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## Cockpit is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Cockpit.  If not, see <http://www.gnu.org/licenses/>.
+
+import queue
+import threading
+import unittest
+
+import numpy
+
+from cockpit.util import histogram
+
+
+def shiftedHistogram(data, nbins=64, m=4):
+    # The histogram computed over every pixel for each shift.
+    bins = numpy.linspace(data.min(), data.max(), nbins)
+    counts = numpy.zeros(nbins)
+    h = bins[1] - bins[0]
+    for i in range(m):
+        these = numpy.bincount(
+            numpy.digitize(data.flat, bins + i * h / m, right=True),
+            minlength=nbins,
+        )
+        counts += these[0:nbins]
+    return bins, counts
+
+
+class TestCompute(unittest.TestCase):
+    def setUp(self):
+        self.rng = numpy.random.default_rng(0)
+
+    def assertMatchesShifted(self, data):
+        result = histogram.compute(data)
+        bins, counts = shiftedHistogram(data)
+        self.assertEqual(result.min, data.min())
+        self.assertEqual(result.max, data.max())
+        numpy.testing.assert_array_equal(result.bins, bins)
+        numpy.testing.assert_array_equal(result.counts, counts)
+
+    def test_uint16(self):
+        self.assertMatchesShifted(
+            self.rng.integers(100, 5000, (64, 48), dtype=numpy.uint16)
+        )
+
+    def test_uint8(self):
+        self.assertMatchesShifted(
+            self.rng.integers(3, 200, (64, 48), dtype=numpy.uint8)
+        )
+
+    def test_signed(self):
+        self.assertMatchesShifted(
+            self.rng.integers(-500, 500, (64, 48), dtype=numpy.int32)
+        )
+
+    def test_large_range(self):
+        data = self.rng.integers(0, 2**30, (64, 48), dtype=numpy.int64)
+        self.assertMatchesShifted(data)
+
+    def test_float(self):
+        self.assertMatchesShifted(self.rng.normal(size=(64, 48)))
+
+    def test_constant(self):
+        result = histogram.compute(numpy.full((8, 8), 7, numpy.uint16))
+        self.assertEqual((result.min, result.max), (7, 7))
+        self.assertEqual(result.counts.sum(), 4 * 64)
+
+    def test_stride(self):
+        data = self.rng.integers(0, 4096, (64, 48), dtype=numpy.uint16)
+        result = histogram.compute(data, stride=4)
+        self.assertEqual(result.stride, 4)
+        self.assertEqual(result.max, data[::4, ::4].max())
+        bins, counts = shiftedHistogram(data[::4, ::4])
+        numpy.testing.assert_array_equal(result.counts, counts)
+
+    def test_get_stride(self):
+        self.assertEqual(histogram.getStride((1024, 1024), 2**20), 1)
+        self.assertEqual(histogram.getStride((2048, 2048), 2**20), 2)
+        self.assertEqual(histogram.getStride((4096, 4096), 2**20), 4)
+        self.assertEqual(histogram.getStride((1025, 1024), 2**20), 2)
+
+
+class TestHistogramWorker(unittest.TestCase):
+    def setUp(self):
+        self.results = queue.Queue()
+        self.worker = histogram.HistogramWorker(
+            self.results.put, maxSamples=64
+        )
+        self.addCleanup(self.worker.stop)
+
+    def test_submit(self):
+        data = numpy.arange(256, dtype=numpy.uint16).reshape(16, 16)
+        self.worker.submit(data)
+        result = self.results.get(timeout=5)
+        self.assertEqual(result.stride, 2)
+        self.assertEqual((result.min, result.max), (0, 238))
+
+    def test_latest_only(self):
+        entered = threading.Event()
+        release = threading.Event()
+        results = []
+
+        def callback(result):
+            entered.set()
+            release.wait(5)
+            results.append(result.max)
+            self.results.put(result)
+
+        self.worker.callback = callback
+        self.worker.submit(numpy.full((4, 4), 1, numpy.uint16))
+        self.assertTrue(entered.wait(5))
+        # Submitted while the first is being computed.
+        for i in range(2, 5):
+            self.worker.submit(numpy.full((4, 4), i, numpy.uint16))
+        release.set()
+        self.results.get(timeout=5)
+        self.results.get(timeout=5)
+        self.assertEqual(results, [1, 4])
+
+    def test_error(self):
+        self.worker.submit(numpy.zeros((0, 0)))
+        self.worker.submit(numpy.ones((4, 4), numpy.uint8))
+        self.assertEqual(self.results.get(timeout=5).max, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
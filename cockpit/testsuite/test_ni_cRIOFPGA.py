@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## Copyright (C) 2026 University of Oxford
+##
+## This file is part of Cockpit.
+##
+## Cockpit is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## Cockpit is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Cockpit.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import socket
+import threading
+import time
+import unittest
+import unittest.mock
+
+import numpy
+
+from cockpit.devices import ni_cRIOFPGA
+
+
+class FakeCRIO:
+    """Stands in for the RT host of a cRIO, on a local TCP port.
+
+    It understands the Json command messages of both runCommand and
+    runBinaryCommand, acknowledging each message (or binary chunk)
+    with an error cluster, and records the commands it gets as
+    (command, words) tuples.
+    """
+
+    def __init__(self):
+        self.commands = []
+        self.chunkSizes = []
+        ## Commands to reply to with an error.
+        self.failCommands = set()
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(("127.0.0.1", 0))
+        self.server.listen(1)
+        self.port = self.server.getsockname()[1]
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.close()
+
+    def reply(self, connection, command):
+        error = {
+            "status": command in self.failCommands,
+            "code": 0,
+            "source": "",
+        }
+        connection.sendall(json.dumps(error).encode())
+
+    def serve(self):
+        try:
+            connection, address = self.server.accept()
+        except OSError:
+            return
+        with connection, connection.makefile("rb") as stream:
+            try:
+                self.handle(connection, stream)
+            except OSError:
+                # The client went away, e.g. after an error reply.
+                pass
+
+    def handle(self, connection, stream):
+        for line in stream:
+            message = json.loads(line)
+            command = message["Command"]
+            length = message["Message Length"]
+            count = message["Number of Messages"]
+            if "Chunk Length" in message:
+                words = []
+                while len(words) < count:
+                    size = min(message["Chunk Length"], count - len(words))
+                    chunk = stream.read(size * length)
+                    if len(chunk) < size * length:
+                        return
+                    words.extend(numpy.frombuffer(chunk, "<u8").tolist())
+                    self.chunkSizes.append(size)
+                    self.reply(connection, command)
+            else:
+                buf = stream.read(length * count)
+                words = [
+                    int(buf[i : i + length])
+                    for i in range(0, len(buf), length)
+                ]
+                self.reply(connection, command)
+            self.commands.append((command, words))
+
+
+class FakeStatusSender:
+    """Stands in for the status broadcasts of the RT host."""
+
+    def __init__(self, port):
+        self.address = ("127.0.0.1", port)
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def close(self):
+        self.socket.close()
+
+    def send(self, status):
+        if isinstance(status, dict):
+            status = json.dumps(status).encode()
+        self.socket.sendto(status, self.address)
+
+
+class TestTableUpload(unittest.TestCase):
+    def setUp(self):
+        self.fake = FakeCRIO()
+        self.addCleanup(self.fake.close)
+        self.connection = ni_cRIOFPGA.Connection(
+            None, "127.0.0.1", self.fake.port, "127.0.0.1"
+        )
+        self.connection.connection = self.connection.createSendSocket(
+            "127.0.0.1", self.fake.port, 5
+        )
+        self.addCleanup(self.connection.connection.close)
+        self.digitals = numpy.array([[0, 1], [10, 0], [2**31, 2**32 - 1]])
+        self.analogues = [
+            numpy.array([[0, 100], [25, 65535]]),
+            numpy.array([[0, 0]]),
+        ]
+
+    def getCommands(self):
+        # The fake replies before recording the command.
+        self.connection.runCommand(0)
+        return self.fake.commands[:-1]
+
+    def test_pack_table(self):
+        words = ni_cRIOFPGA.packTable(self.digitals)
+        self.assertEqual(words.dtype, numpy.uint64)
+        expected = [
+            int(numpy.binary_repr(t, 32) + numpy.binary_repr(v, 32), 2)
+            for t, v in self.digitals
+        ]
+        self.assertEqual(words.tolist(), expected)
+
+    def test_pack_empty_table(self):
+        self.assertEqual(len(ni_cRIOFPGA.packTable([])), 0)
+
+    def test_binary_matches_decimal(self):
+        self.connection.sendTables(self.digitals, self.analogues)
+        decimal = self.getCommands()
+        self.fake.commands.clear()
+        self.connection.binaryUpload = True
+        self.connection.sendTables(self.digitals, self.analogues)
+        binary = self.getCommands()
+        commands = self.connection.commandDict
+        self.assertEqual(
+            [c for c, w in decimal],
+            [commands["flushFIFOs"], 100, 200, 201],
+        )
+        self.assertEqual(
+            [c for c, w in binary],
+            [commands["flushFIFOs"], 150, 250, 251],
+        )
+        self.assertEqual([w for c, w in decimal], [w for c, w in binary])
+
+    def test_chunks(self):
+        words = numpy.arange(10, dtype=numpy.uint64) << numpy.uint64(40)
+        self.connection.runBinaryCommand(150, words, chunkWords=4)
+        self.assertEqual(self.getCommands(), [(150, words.tolist())])
+        self.assertEqual(self.fake.chunkSizes, [4, 4, 2])
+
+    def test_error_stops_upload(self):
+        self.fake.failCommands.add(150)
+        with self.assertRaisesRegex(RuntimeError, "FPGA error"):
+            self.connection.runBinaryCommand(
+                150, numpy.arange(10, dtype=numpy.uint64), chunkWords=4
+            )
+        self.assertEqual(self.fake.chunkSizes, [4])
+
+
+class TestFPGAStatus(unittest.TestCase):
+    def setUp(self):
+        self.done = threading.Event()
+        self.parent = unittest.mock.Mock()
+        self.parent.parent.experimentDone.side_effect = self.done.set
+        self.status = ni_cRIOFPGA.FPGAStatus(self.parent, "127.0.0.1", 0)
+        self.status.start()
+        self.addCleanup(self.status.stop)
+        self.sender = FakeStatusSender(self.status.socket.getsockname()[1])
+        self.addCleanup(self.sender.close)
+
+    def waitForEvent(self, event):
+        return self.status.waitForStatus(
+            lambda status: status.get("Event") == event, timeout=5
+        )
+
+    def test_status(self):
+        self.sender.send({"Event": "", "FPGA Main State": 1})
+        self.assertTrue(
+            self.status.waitForStatus(
+                lambda status: status.get("FPGA Main State") == 1, timeout=5
+            )
+        )
+        self.assertEqual(self.status.getStatus("FPGA Main State"), 1)
+
+    def test_done_is_delivered_immediately(self):
+        # Like a sequence of hardware segments, each waiting for the
+        # previous one to be done.
+        numSegments = 10
+        start = time.perf_counter()
+        for i in range(numSegments):
+            self.done.clear()
+            self.sender.send({"Event": "done"})
+            self.assertTrue(self.done.wait(5))
+        elapsed = time.perf_counter() - start
+        # Before, each segment could wait half a heartbeat.
+        self.assertLess(
+            elapsed, numSegments * ni_cRIOFPGA.FPGA_HEARTBEAT_RATE / 2
+        )
+        self.assertEqual(
+            self.parent.parent.experimentDone.call_count, numSegments
+        )
+        # The event is reset so that it is not published twice.
+        self.assertTrue(self.waitForEvent(""))
+
+    def test_invalid_datagrams_are_ignored(self):
+        self.sender.send(b"not json")
+        self.sender.send(b"125")
+        self.sender.send({"Event": "running"})
+        self.assertTrue(self.waitForEvent("running"))
+
+    def test_waitForIdle(self):
+        connection = ni_cRIOFPGA.Connection(None, "127.0.0.1", 0, "127.0.0.1")
+        connection.status = self.status
+        self.sender.send({"Event": "", "FPGA Main State": 1})
+        with self.assertRaises(TimeoutError):
+            connection.waitForIdle(timeout=0.2)
+        self.sender.send(
+            {"Event": "", "FPGA Main State": ni_cRIOFPGA.FPGA_IDLE_STATE}
+        )
+        connection.waitForIdle()
+
+    def test_stop(self):
+        start = time.perf_counter()
+        self.status.stop()
+        self.assertFalse(self.status.is_alive())
+        self.assertLess(
+            time.perf_counter() - start, 2 * ni_cRIOFPGA.FPGA_HEARTBEAT_RATE
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
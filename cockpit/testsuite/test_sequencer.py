@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## Copyright (C) 2026 University of Oxford
+##
+## This file is part of Cockpit.
+##
+## Cockpit is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## Cockpit is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Cockpit.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+import unittest
+
+from cockpit.util import sequencer
+
+
+class TestWaitUntil(unittest.TestCase):
+    def test_never_early(self):
+        for delay in (0, 10**5, 3 * 10**6):
+            deadline = time.perf_counter_ns() + delay
+            self.assertGreaterEqual(sequencer.waitUntil(deadline), deadline)
+            self.assertGreaterEqual(time.perf_counter_ns(), deadline)
+
+    def test_past_deadline(self):
+        deadline = time.perf_counter_ns() - 10**9
+        self.assertLess(sequencer.waitUntil(deadline) - deadline, 2 * 10**9)
+
+
+class TestTimingRecord(unittest.TestCase):
+    def test_stats(self):
+        record = sequencer.TimingRecord()
+        for scheduled, actual in [(0, 1000), (5000, 8000), (9000, 11000)]:
+            record.record(scheduled, actual)
+        self.assertEqual(record.getLateness().tolist(), [1000, 3000, 2000])
+        stats = record.getStats()
+        self.assertEqual(stats["count"], 3)
+        self.assertAlmostEqual(stats["mean"], 2.0)
+        self.assertAlmostEqual(stats["max"], 3.0)
+        self.assertIn("3 timed actions", record.describe())
+
+    def test_empty(self):
+        self.assertEqual(sequencer.TimingRecord().getStats()["count"], 0)
+
+
+class TestSequencer(unittest.TestCase):
+    def setUp(self):
+        self.sequencer = sequencer.Sequencer()
+        self.addCleanup(self.sequencer.stop)
+
+    def test_run(self):
+        calls = []
+
+        def action(i):
+            return lambda: calls.append((i, threading.current_thread()))
+
+        start = time.perf_counter_ns()
+        deadlines = [start + i * 10**6 for i in range(5)]
+        record = self.sequencer.run(
+            [(deadline, action(i)) for i, deadline in enumerate(deadlines)]
+        )
+        self.assertEqual([i for i, thread in calls], list(range(5)))
+        self.assertTrue(
+            all(thread is self.sequencer._thread for i, thread in calls)
+        )
+        self.assertEqual(record.scheduled, deadlines)
+        self.assertTrue(all(record.getLateness() >= 0))
+
+    def test_wait_only(self):
+        deadline = time.perf_counter_ns() + 10**6
+        record = self.sequencer.run([(deadline, None)])
+        self.assertEqual(len(record), 1)
+        self.assertGreaterEqual(time.perf_counter_ns(), deadline)
+
+    def test_wait_does_not_hold_thread(self):
+        waiter = threading.Thread(
+            target=self.sequencer.wait,
+            args=(time.perf_counter_ns() + 10**9,),
+        )
+        waiter.start()
+        self.addCleanup(waiter.join)
+        start = time.perf_counter_ns()
+        self.sequencer.run([(start, None)])
+        self.assertLess(time.perf_counter_ns() - start, 5 * 10**8)
+        record = self.sequencer.wait(start)
+        self.assertEqual(record.scheduled, [start])
+
+    def test_error_stops_run(self):
+        calls = []
+
+        def fail():
+            raise RuntimeError("failed")
+
+        start = time.perf_counter_ns()
+        with self.assertRaisesRegex(RuntimeError, "failed"):
+            self.sequencer.run(
+                [(start, fail), (start, lambda: calls.append(1))]
+            )
+        self.assertEqual(calls, [])
+        # It still runs later steps.
+        self.sequencer.run([(start, lambda: calls.append(2))])
+        self.assertEqual(calls, [2])
+
+    def test_run_from_action(self):
+        start = time.perf_counter_ns()
+        records = []
+
+        def nested():
+            records.append(self.sequencer.run([(start, None)]))
+
+        self.sequencer.run([(start, nested)])
+        self.assertEqual(len(records[0]), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -21,6 +21,7 @@
 import unittest
 
 import numpy
+import numpy.testing
 
 import cockpit.experiment.structuredIllumination as sim
 
@@ -53,5 +54,34 @@ class PostpadTestCase(unittest.TestCase):
         self.assertEqual(padded.size, 3)
 
 
+class ZIndexMapTestCase(unittest.TestCase):
+    def makeExperiment(self, collectionOrder):
+        # Skip the constructor, which needs a whole microscope.
+        experiment = sim.SIExperiment.__new__(sim.SIExperiment)
+        experiment.collectionOrder = collectionOrder
+        experiment.numAngles = 3
+        experiment.numPhases = 5
+        experiment.numZSlices = 4
+        return experiment
+
+    def test_matches_reorder(self):
+        for collectionOrder in sim.COLLECTION_ORDERS:
+            experiment = self.makeExperiment(collectionOrder)
+            zIndexMap = experiment.getZIndexMap()
+            z_order = sim.collection_order_tuple(collectionOrder)
+            lengths = {"a": 3, "p": 5, "z": 4}
+            taken = numpy.arange(60).reshape((1, 60))
+            expected = sim.reorder_z_dim(
+                taken,
+                ("w", "z"),
+                tuple(lengths[d] for d in z_order),
+                z_order,
+                ("a", "z", "p"),
+            )
+            saved = numpy.empty(60, dtype=int)
+            saved[zIndexMap] = taken[0]
+            numpy.testing.assert_array_equal(saved, expected[0])
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## Copyright (C) 2026 University of Oxford
+##
+## This file is part of Cockpit.
+##
+## Cockpit is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## Cockpit is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Cockpit.  If not, see <http://www.gnu.org/licenses/>.
+
+import decimal
+import unittest
+import unittest.mock
+
+import cockpit.depot
+import cockpit.handlers.camera
+from cockpit.experiment import actionTable, simulator
+
+
+def _ms(time):
+    return time * actionTable.TICKS_PER_MS
+
+
+class TestSimulator(unittest.TestCase):
+    def setUp(self):
+        self.table = actionTable.ActionTable()
+        self.camera = unittest.mock.Mock(deviceType=cockpit.depot.CAMERA)
+        self.camera.name = "camera"
+        self.light = unittest.mock.Mock(deviceType=cockpit.depot.LIGHT_TOGGLE)
+        self.light.name = "light"
+
+    def makeCamera(self, mode, exposureTime=10, readoutTime=5):
+        return simulator.CameraModel(
+            "camera", mode, _ms(exposureTime), _ms(readoutTime)
+        )
+
+    def addToggles(self, times, handler=None):
+        # Like DeviceHandler.addToggle, with a toggle time of 0.1 ms.
+        for time in times:
+            time = decimal.Decimal(time)
+            handler = handler or self.camera
+            self.table.addAction(time, handler, True)
+            self.table.addAction(time + decimal.Decimal("0.1"), handler, False)
+        self.table.sort()
+
+    def test_trigger_before(self):
+        self.addToggles([0, 20, 40])
+        report = simulator.simulate(
+            self.table,
+            {
+                self.camera: self.makeCamera(
+                    cockpit.handlers.camera.TRIGGER_BEFORE
+                )
+            },
+        )
+        self.assertEqual(report.conflicts, [])
+        self.assertEqual(report.cameras["camera"]["images"], 3)
+        # Until the last image is read out.
+        self.assertEqual(report.duration, 55)
+        self.assertEqual(report.cameras["camera"]["exposed"], 30)
+        self.assertEqual(report.cameras["camera"]["dead"], 25)
+        self.assertAlmostEqual(report.cameras["camera"]["duty cycle"], 30 / 55)
+
+    def test_readout_conflict(self):
+        self.addToggles([0, 12, 40])
+        report = simulator.simulate(
+            self.table,
+            {
+                self.camera: self.makeCamera(
+                    cockpit.handlers.camera.TRIGGER_BEFORE
+                )
+            },
+        )
+        self.assertEqual(len(report.conflicts), 1)
+        self.assertIn("camera triggered", report.conflicts[0])
+        self.assertTrue(report.conflicts[0].startswith("12.0000 ms"))
+
+    def test_trigger_after(self):
+        # Exposes from each trigger to the next, so the first image is
+        # from the start.
+        self.addToggles([10, 30, 50])
+        report = simulator.simulate(
+            self.table,
+            {
+                self.camera: self.makeCamera(
+                    cockpit.handlers.camera.TRIGGER_AFTER
+                )
+            },
+        )
+        self.assertEqual(report.conflicts, [])
+        self.assertEqual(report.cameras["camera"]["images"], 3)
+        self.assertEqual(report.cameras["camera"]["exposed"], 50)
+
+    def test_trigger_duration(self):
+        for start, end in [(0, 8), (10, 30)]:
+            self.table.addAction(decimal.Decimal(start), self.camera, True)
+            self.table.addAction(decimal.Decimal(end), self.camera, False)
+        self.table.sort()
+        report = simulator.simulate(
+            self.table,
+            {
+                self.camera: self.makeCamera(
+                    cockpit.handlers.camera.TRIGGER_DURATION
+                )
+            },
+        )
+        self.assertEqual(report.cameras["camera"]["images"], 2)
+        self.assertEqual(report.cameras["camera"]["exposed"], 28)
+        # The second exposure starts 2 ms into the first readout.
+        self.assertEqual(len(report.conflicts), 1)
+
+    def test_light(self):
+        self.table.addAction(decimal.Decimal(0), self.light, True)
+        self.table.addAction(decimal.Decimal(5), self.light, False)
+        self.table.addAction(decimal.Decimal(10), self.light, True)
+        self.table.addAction(decimal.Decimal(20), self.light, False)
+        self.table.sort()
+        models = {self.light: simulator.LightModel("light")}
+        report = simulator.simulate(self.table, models)
+        self.assertEqual(report.lights["light"]["pulses"], 2)
+        self.assertEqual(report.lights["light"]["on"], 15)
+        self.assertAlmostEqual(report.lights["light"]["duty cycle"], 0.75)
+
+    def test_positioner(self):
+        stage = object()
+        for time, position in [(0, 10), (20, 11), (22, 12)]:
+            self.table.addAction(decimal.Decimal(time), stage, position)
+        self.table.sort()
+        model = simulator.PositionerModel(
+            "stage", lambda start, end: _ms(5 * abs(end - start)), 0
+        )
+        report = simulator.simulate(self.table, {stage: model})
+        self.assertEqual(report.positioners["stage"]["moves"], 3)
+        self.assertEqual(report.positioners["stage"]["moving"], 60)
+        # The first move takes until 50 ms, and the second starts
+        # before it settled, and so does the third.
+        self.assertEqual(len(report.conflicts), 2)
+        self.assertEqual(report.duration, 27)
+
+    def test_reps(self):
+        self.addToggles([0, 20])
+        models = {
+            self.camera: self.makeCamera(
+                cockpit.handlers.camera.TRIGGER_BEFORE
+            )
+        }
+        report = simulator.simulate(self.table, models, 3, 50)
+        self.assertEqual(report.conflicts, [])
+        self.assertEqual(report.cameras["camera"]["images"], 6)
+        self.assertEqual(report.numActions, 12)
+        self.assertEqual(report.duration, 135)
+
+    def test_many_reps(self):
+        # Only two reps are replayed, and the others extrapolated.
+        self.addToggles([0, 10])
+        model = self.makeCamera(cockpit.handlers.camera.TRIGGER_BEFORE)
+        with unittest.mock.patch.object(model, "act", wraps=model.act) as act:
+            report = simulator.simulate(
+                self.table, {self.camera: model}, 10**6, 50
+            )
+        self.assertEqual(act.call_count, 8)
+        self.assertEqual(report.cameras["camera"]["images"], 2 * 10**6)
+        self.assertEqual(report.cameras["camera"]["exposed"], 20 * 10**6)
+        self.assertEqual(report.numActions, 4 * 10**6)
+        self.assertEqual(report.duration, 50 * (10**6 - 1) + 25)
+        # The second trigger of each rep is before the camera is ready.
+        self.assertEqual(len(report.conflicts), 3)
+        self.assertIn("each of the other 999998 reps", report.conflicts[2])
+
+    def test_overlong_rep(self):
+        self.addToggles([0, 20])
+        models = {
+            self.camera: self.makeCamera(
+                cockpit.handlers.camera.TRIGGER_BEFORE
+            )
+        }
+        report = simulator.simulate(self.table, models, 2, 10)
+        self.assertIn("rep duration", report.conflicts[0])
+
+    def test_repeat_blocks(self):
+        block = actionTable.ActionTable()
+        block.addAction(decimal.Decimal(0), self.camera, True)
+        block.addAction(decimal.Decimal("0.1"), self.camera, False)
+        self.table.addRepeat(decimal.Decimal(0), block, 4, decimal.Decimal(20))
+        self.table.sort()
+        models = {
+            self.camera: self.makeCamera(
+                cockpit.handlers.camera.TRIGGER_BEFORE
+            )
+        }
+        report = simulator.simulate(self.table, models)
+        self.assertEqual(report.cameras["camera"]["images"], 4)
+        self.assertIn("4 images", report.describe())
+
+    def test_unmodelled_handlers_are_skipped(self):
+        self.addToggles([0, 1, 2, 3], handler=object())
+        self.assertEqual(simulator.simulate(self.table, {}).numActions, 0)
+
+    def test_make_models(self):
+        self.camera.getExposureMode.return_value = (
+            cockpit.handlers.camera.TRIGGER_BEFORE
+        )
+        self.camera.getExposureTime.return_value = decimal.Decimal("10.5")
+        self.camera.getTimeBetweenExposures.return_value = decimal.Decimal(2)
+        other = unittest.mock.Mock(deviceType=cockpit.depot.GENERIC_DEVICE)
+        models = simulator.makeModels([self.camera, self.light, other])
+        self.assertEqual(set(models), {self.camera, self.light})
+        self.assertEqual(models[self.camera].exposureTime, _ms(10.5))
+        self.assertEqual(models[self.camera].readoutTime, _ms(2))
+
+
+if __name__ == "__main__":
+    unittest.main()
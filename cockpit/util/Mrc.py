@@ -1156,6 +1156,230 @@ def adjusted_data_shape(numel, shape):
     return tuple(shape)
 
 
+## Axes of the sections, slowest first, for each ImgSequence.
+_IMG_SEQUENCE_AXES = {0: "wtz", 1: "tzw", 2: "twz"}
+
+
+def _sectionAxes(hdr, imgSequence, zLengths, zOrder, zWanted):
+    """Return the section axes of the input and output, slowest first,
+    and a dict with the length of each axis.
+    """
+    nt = max(int(hdr.NumTimes), 1)
+    nw = max(int(hdr.NumWaves), 1)
+    nz = int(hdr.Num[2]) // (nt * nw)
+    if imgSequence is None:
+        imgSequence = hdr.ImgSequence
+    axesIn = _IMG_SEQUENCE_AXES[int(hdr.ImgSequence)]
+    axesOut = _IMG_SEQUENCE_AXES[int(imgSequence)]
+    lengths = {"w": nw, "t": nt, "z": nz}
+    if zOrder is not None:
+        if sorted(zOrder) != sorted(zWanted) or set(zOrder) & {"w", "t"}:
+            raise ValueError(
+                "zOrder and zWanted must have the same axes, other than"
+                " 'w' and 't'"
+            )
+        if N.prod(zLengths) != nz:
+            raise ValueError(
+                "zLengths %s do not make up %d z sections"
+                % (tuple(zLengths), nz)
+            )
+        lengths.update(zip(zOrder, zLengths))
+        axesIn = axesIn.replace("z", "".join(zOrder))
+        axesOut = axesOut.replace("z", "".join(zWanted))
+    return axesIn, axesOut, lengths
+
+
+def planeMapping(
+    hdr, imgSequence=None, zLengths=None, zOrder=None, zWanted=None
+):
+    """return, for each section of a reordered file, the index of the
+    section of the file with header hdr it comes from
+
+    imgSequence is the ImgSequence of the reordered file
+       (0=ZTW, 1=WZT, 2=ZWT), None means the same as hdr
+    if the z axis packs more than one axis, e.g. angle, z, and phase
+    for SI, zLengths and zOrder give their lengths and order (one
+    letter per axis, slowest first) and zWanted their order in the
+    reordered file; see structuredIllumination.reorder_z_dim
+    """
+    axesIn, axesOut, lengths = _sectionAxes(
+        hdr, imgSequence, zLengths, zOrder, zWanted
+    )
+    sections = N.arange(N.prod([lengths[a] for a in axesIn]))
+    sections = sections.reshape([lengths[a] for a in axesIn])
+    sections = sections.transpose([axesIn.index(a) for a in axesOut])
+    return sections.ravel()
+
+
+def histogramMedian(counts):
+    """return the median of the values counted in a histogram, with a bin
+    per integer value from zero
+
+    Like N.median, this is the mean of the two middle values if there
+    is an even number of them.
+    """
+    cumulative = N.cumsum(counts)
+    total = cumulative[-1]
+    lower = N.searchsorted(cumulative, (total - 1) // 2, side="right")
+    upper = N.searchsorted(cumulative, total // 2, side="right")
+    return (lower + upper) / 2
+
+
+def _readHdrFrom(m):
+    """return native byte order header from the start of memmap m, and
+    whether the file is byte swapped
+    """
+    hdrArray = N.frombuffer(m[:1024].tobytes(), dtype=mrcHdr_dtype)
+    nz = hdrArray["Num"][0][0]
+    isByteSwapped = nz < 0 or nz > 10000
+    if isByteSwapped:
+        hdrArray = hdrArray.view(mrcHdr_dtype.newbyteorder())
+    return implement_hdr(hdrArray.astype(mrcHdr_dtype)), isByteSwapped
+
+
+def convert(
+    inPath,
+    outPath,
+    imgSequence=None,
+    zLengths=None,
+    zOrder=None,
+    zWanted=None,
+    crop=None,
+    dtype=None,
+    maxBytes=64 * 2**20,
+):
+    """write reordered, cropped, and/or converted copy of Mrc file
+
+    Unlike save(), the data is never all in memory: sections are copied
+    from a memmap of the input a few at a time, up to maxBytes, so this
+    works on files larger than memory.  The extended header is reordered
+    along with the sections.  outPath may be inPath; the new file is
+    written next to it and moved over it at the end.
+
+    imgSequence, zLengths, zOrder, zWanted: how to reorder the sections,
+       see planeMapping()
+    crop: (y0, y1, x0, x1) region of each section to keep, None for all
+    dtype: data type of the new file, None for the same as the input
+       values are clipped to the range of integer types
+
+    Sections missing from a truncated input are left blank (see cockpit
+    bug #289).  The min/max of each wavelength are recomputed, the
+    median of the first only for uint8 and uint16 data.
+    """
+    import os
+    import shutil
+    import tempfile
+
+    m = N.memmap(inPath, mode="r")
+    hdr, isByteSwapped = _readHdrFrom(m)
+    axesIn, axesOut, lengths = _sectionAxes(
+        hdr, imgSequence, zLengths, zOrder, zWanted
+    )
+    srcSections = planeMapping(hdr, imgSequence, zLengths, zOrder, zWanted)
+    numSections = len(srcSections)
+
+    inDtype = N.dtype(MrcMode2dtype(hdr.PixelType))
+    if isByteSwapped:
+        inDtype = inDtype.newbyteorder()
+    outDtype = (
+        N.dtype(dtype) if dtype is not None else inDtype.newbyteorder("=")
+    )
+    nx, ny = int(hdr.Num[0]), int(hdr.Num[1])
+    y0, y1, x0, x1 = crop if crop is not None else (0, ny, 0, nx)
+    if not (0 <= y0 < y1 <= ny and 0 <= x0 < x1 <= nx):
+        raise ValueError("crop %s outside of %dx%d sections" % (crop, nx, ny))
+
+    ## The file may be truncated, so only map the complete sections.
+    dataOffset = 1024 + int(hdr.next)
+    sectionBytes = nx * ny * inDtype.itemsize
+    numAvailable = max(len(m) - dataOffset, 0) // sectionBytes
+    data = m[dataOffset : dataOffset + numAvailable * sectionBytes]
+    data = data.view(inDtype).reshape((numAvailable, ny, nx))
+
+    numInts, numFloats = int(hdr.NumIntegers), int(hdr.NumFloats)
+    extDtype = N.dtype(
+        [("int", "i4", (numInts,)), ("float", "f4", (numFloats,))]
+    )
+    outExt = N.zeros(numSections, extDtype)
+    if extDtype.itemsize:
+        numExt = min(int(hdr.next) // extDtype.itemsize, numSections)
+        ext = m[1024 : 1024 + numExt * extDtype.itemsize]
+        ext = ext.view(extDtype.newbyteorder() if isByteSwapped else extDtype)
+        haveExt = srcSections < numExt
+        outExt[haveExt] = ext[srcSections[haveExt]]
+
+    outHdr = implement_hdr(hdr._array.copy())
+    outHdr.Num = (x1 - x0, y1 - y0, numSections)
+    outHdr.PixelType = dtype2MrcMode(outDtype)
+    outHdr.ImgSequence = (
+        hdr.ImgSequence if imgSequence is None else imgSequence
+    )
+    outHdr.next = outExt.nbytes
+
+    clipRange = None
+    if outDtype.kind in "iu" and outDtype != inDtype:
+        info = N.iinfo(outDtype)
+        clipRange = [info.min, info.max]
+        if inDtype.kind in "iu":
+            clipRange[0] = max(clipRange[0], N.iinfo(inDtype).min)
+            clipRange[1] = min(clipRange[1], N.iinfo(inDtype).max)
+    waves = N.unravel_index(srcSections, [lengths[a] for a in axesIn])
+    waves = waves[axesIn.index("w")]
+    minVals = N.full(lengths["w"], N.inf)
+    maxVals = N.full(lengths["w"], -N.inf)
+    histogram = None
+    if outDtype in (N.uint8, N.uint16):
+        histogram = N.zeros(2 ** (8 * outDtype.itemsize), N.int64)
+
+    outSectionBytes = (y1 - y0) * (x1 - x0) * outDtype.itemsize
+    sectionsPerChunk = max(1, maxBytes // max(sectionBytes, outSectionBytes))
+    outDir = os.path.dirname(os.path.abspath(outPath))
+    tmp = tempfile.NamedTemporaryFile(dir=outDir, suffix=".tmp", delete=False)
+    try:
+        with tmp:
+            tmp.write(outHdr._array.tobytes())
+            tmp.write(outExt.tobytes())
+            for start in range(0, numSections, sectionsPerChunk):
+                src = srcSections[start : start + sectionsPerChunk]
+                block = N.zeros((len(src), y1 - y0, x1 - x0), outDtype)
+                have = src < numAvailable
+                if have.any():
+                    sections = data[src[have], y0:y1, x0:x1]
+                    if clipRange is not None:
+                        sections = N.clip(sections, *clipRange)
+                    block[have] = sections
+                    sections = block[have]
+                    blockWaves = waves[start : start + sectionsPerChunk][have]
+                    for w in N.unique(blockWaves):
+                        waveSections = sections[blockWaves == w]
+                        minVals[w] = min(minVals[w], waveSections.min())
+                        maxVals[w] = max(maxVals[w], waveSections.max())
+                        if w == 0 and histogram is not None:
+                            histogram += N.bincount(
+                                waveSections.ravel(), minlength=len(histogram)
+                            )
+                tmp.write(block.tobytes())
+
+            noData = minVals > maxVals
+            minVals[noData] = 0
+            maxVals[noData] = 0
+            median = outHdr.mmm1[2]
+            if histogram is not None and histogram.any():
+                median = histogramMedian(histogram)
+            outHdr.mmm1 = (minVals[0], maxVals[0], median)
+            for w in range(1, min(lengths["w"], 5)):
+                setattr(outHdr, "mm%d" % (w + 1), (minVals[w], maxVals[w]))
+            tmp.seek(0)
+            tmp.write(outHdr._array.tobytes())
+        shutil.copymode(inPath, tmp.name)
+        ## Windows can't replace a file that is still mapped.
+        del data, m
+        os.replace(tmp.name, outPath)
+    except:
+        os.remove(tmp.name)
+        raise
+
+
 mrcHdr_dtype = N.dtype(
     [
         ("Num", "i4", (3,)),
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## Copyright (C) 2026 University of Oxford
+##
+## This file is part of Cockpit.
+##
+## Cockpit is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## Cockpit is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Cockpit.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Pool of reusable image plane buffers.
+
+Saving and displaying images needs scratch arrays the size of a whole
+image plane, e.g. to pad an image to the size of the planes in a file
+or to convert it before uploading it as a texture.  Allocating a new
+array for every image is slow for large images and fragments memory.
+Instead, take a buffer from the pool and give it back once done::
+
+    from cockpit.util import bufferPool
+
+    buf = bufferPool.acquire((height, width), numpy.float32)
+    try:
+        numpy.multiply(image, scale, out=buf)
+        upload(buf)
+    finally:
+        bufferPool.release(buf)
+
+Buffers are keyed by shape and dtype.  Their contents are undefined
+when acquired, unless ``zero=True`` is given.  A buffer must not be
+used after being released.
+
+Like :mod:`cockpit.events`, there is a :class:`BufferPool` class and a
+singleton instance used throughout Cockpit, with module functions
+that pass through to it.
+
+"""
+
+import collections
+import threading
+import typing
+
+import numpy
+
+
+class BufferPool:
+    """Free lists of arrays, keyed by shape and dtype.
+
+    Args:
+        maxBytes: maximum total size of the buffers kept for reuse.
+            Buffers released past this are left to be freed.
+    """
+
+    def __init__(self, maxBytes: int = 512 * 2**20) -> None:
+        self.maxBytes = maxBytes
+        # type: typing.Dict[typing.Tuple, typing.List[numpy.ndarray]]
+        self._free = collections.defaultdict(list)
+        self._freeBytes = 0
+        self._lock = threading.Lock()
+        ## Number of buffers acquired, and how many of those had to be
+        ## allocated, for monitoring.
+        self.numAcquired = 0
+        self.numAllocated = 0
+
+    def acquire(
+        self, shape: typing.Tuple[int, ...], dtype, zero: bool = False
+    ) -> numpy.ndarray:
+        """Return a C-contiguous array with given shape and dtype."""
+        dtype = numpy.dtype(dtype)
+        key = (tuple(shape), dtype)
+        with self._lock:
+            self.numAcquired += 1
+            freeList = self._free.get(key)
+            if freeList:
+                buf = freeList.pop()
+                self._freeBytes -= buf.nbytes
+            else:
+                buf = None
+                self.numAllocated += 1
+        if buf is None:
+            return (numpy.zeros if zero else numpy.empty)(shape, dtype)
+        if zero:
+            buf.fill(0)
+        return buf
+
+    def release(self, buf: numpy.ndarray) -> None:
+        """Give back a buffer returned by :meth:`acquire`."""
+        with self._lock:
+            if self._freeBytes + buf.nbytes > self.maxBytes:
+                return
+            self._free[(buf.shape, buf.dtype)].append(buf)
+            self._freeBytes += buf.nbytes
+
+    def clear(self) -> None:
+        """Drop all buffers kept for reuse."""
+        with self._lock:
+            self._free.clear()
+            self._freeBytes = 0
+
+
+# Global singleton
+_pool = BufferPool()
+
+
+def acquire(
+    shape: typing.Tuple[int, ...], dtype, zero: bool = False
+) -> numpy.ndarray:
+    return _pool.acquire(shape, dtype, zero)
+
+
+def release(buf: numpy.ndarray) -> None:
+    _pool.release(buf)
+
+
+def clear() -> None:
+    _pool.clear()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## Copyright (C) 2026 University of Oxford
+##
+## This file is part of Cockpit.
+##
+## Cockpit is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## Cockpit is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Cockpit.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Reduce images to the resolution they are displayed at.
+
+A camera view is usually much smaller than the camera sensor, so most
+of the pixels of a large image are never seen.  Instead of uploading
+all of them, the image can be binned down to about the resolution of
+the screen, and, when zoomed in, cropped to the part that is visible::
+
+    factor = decimation.getFactor(image.shape, viewShape, zoom)
+    y0, y1, x0, x1 = decimation.getVisibleRegion(
+        image.shape, zoom, pan, factor
+    )
+    display = decimation.decimate(image[y0:y1, x0:x1], factor)
+
+Views are as in :class:`cockpit.gui.imageViewer.viewCanvas.ViewCanvas`:
+at a zoom of 1, the longest edge of the image fills the view, and the
+pan is in GL co-ordinates, where the view spans -1 to 1.
+
+"""
+
+import math
+import typing
+
+import numpy
+
+
+def getFactor(
+    imageShape: typing.Tuple[int, int],
+    viewShape: typing.Tuple[int, int],
+    zoom: float,
+) -> int:
+    """Return how much to decimate an image by, for a view.
+
+    This is the largest power of two that is no more than the number
+    of image pixels per screen pixel, so that at least as many pixels
+    as there are on the screen are kept, and images with edges that
+    are powers of two are binned exactly.
+    """
+    ratio = max(imageShape) / (zoom * max(viewShape))
+    if ratio < 2:
+        return 1
+    return 2 ** int(math.log2(ratio))
+
+
+def getVisibleRegion(
+    imageShape: typing.Tuple[int, int],
+    zoom: float,
+    pan: typing.Tuple[float, float],
+    factor: int = 1,
+    margin: float = 0.25,
+) -> typing.Tuple[int, int, int, int]:
+    """Return the (y0, y1, x0, x1) region of an image that is visible.
+
+    The region includes a margin, as a fraction of the view on each
+    side, so that small pans do not show the edges of the region
+    before it is updated.  It is aligned to multiples of factor, so
+    that bins do not change as the view is panned.  If none of the
+    image is visible, this is the whole image.
+    """
+    height, width = imageShape
+    size = max(imageShape)
+    hlim = width / size
+    vlim = height / size
+    extent = (1 + 2 * margin) / zoom
+    x0 = (-extent - pan[0] + hlim) * size / 2
+    x1 = (extent - pan[0] + hlim) * size / 2
+    y0 = (vlim - extent + pan[1]) * size / 2
+    y1 = (vlim + extent + pan[1]) * size / 2
+    x0 = max(0, math.floor(x0 / factor) * factor)
+    y0 = max(0, math.floor(y0 / factor) * factor)
+    x1 = min(width, math.ceil(x1 / factor) * factor)
+    y1 = min(height, math.ceil(y1 / factor) * factor)
+    if x1 - x0 < factor or y1 - y0 < factor:
+        return (0, height, 0, width)
+    return (y0, y1, x0, x1)
+
+
+def decimate(data: numpy.ndarray, factor: int) -> numpy.ndarray:
+    """Bin an image by factor along each axis, keeping its dtype.
+
+    Each pixel of the result is the mean of factor x factor pixels.
+    Rows and columns past the last whole bin are dropped.
+    """
+    if factor == 1:
+        return data
+    rows = data.shape[0] // factor
+    cols = data.shape[1] // factor
+    if data.dtype.kind == "u" and data.dtype.itemsize <= 2:
+        total = numpy.uint32
+    elif data.dtype.kind in "iu":
+        total = numpy.int64
+    else:
+        total = numpy.float64
+    binned = numpy.zeros((rows, cols), total)
+    # Adding strided views, one for each position in the bins, is much
+    # faster than summing over axes of the bins.
+    for i in range(factor):
+        for j in range(factor):
+            numpy.add(
+                binned,
+                data[i : rows * factor : factor, j : cols * factor : factor],
+                out=binned,
+            )
+    if data.dtype.kind in "iu":
+        binned //= factor * factor
+    else:
+        binned /= factor * factor
+    return binned.astype(data.dtype, copy=False)
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## Copyright (C) 2026 University of Oxford
+##
+## This file is part of Cockpit.
+##
+## Cockpit is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## Cockpit is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Cockpit.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Histograms of images for display.
+
+The histograms shown under camera views are shifted average histograms,
+i.e. the average of several histograms whose bins are shifted by a
+fraction of the bin width, which avoids binning artefacts.  Computing
+each of those over all pixels is slow for large images.  Instead, for
+integer images, :func:`compute` counts each pixel value once, and gets
+the minimum, maximum, and the shifted histograms from those counts::
+
+    result = histogram.compute(image)
+    print(result.min, result.max, result.counts)
+
+For live images, the count can be of every few rows and columns only,
+and a :class:`HistogramWorker` computes histograms on its own thread,
+only ever of the latest image given to it.
+
+"""
+
+import logging
+import math
+import threading
+import typing
+
+import numpy
+
+
+_logger = logging.getLogger(__name__)
+
+
+## Largest range of integer values to count individually.  Images with
+# a larger range are binned like floating point images.
+MAX_COUNTED_RANGE = 2**20
+
+## Default maximum number of pixels to sample in a HistogramWorker.
+DEFAULT_MAX_SAMPLES = 2**20
+
+
+class HistogramData:
+    """Minimum, maximum, and shifted average histogram of an image.
+
+    Attributes:
+        min: minimum of the sampled pixels.
+        max: maximum of the sampled pixels.
+        bins: lower edges of the bins, from min to max.
+        counts: number of pixels in each bin, summed over the shifted
+            histograms.
+        stride: step between sampled rows and columns.
+    """
+
+    def __init__(
+        self,
+        dmin: float,
+        dmax: float,
+        bins: numpy.ndarray,
+        counts: numpy.ndarray,
+        stride: int = 1,
+    ) -> None:
+        self.min = dmin
+        self.max = dmax
+        self.bins = bins
+        self.counts = counts
+        self.stride = stride
+
+
+def getStride(shape: typing.Tuple[int, ...], maxSamples: int) -> int:
+    """Return the smallest stride that samples at most maxSamples."""
+    stride = max(1, int(math.sqrt(numpy.prod(shape) / maxSamples)))
+    while numpy.prod([math.ceil(n / stride) for n in shape]) > maxSamples:
+        stride += 1
+    return stride
+
+
+def _countValues(
+    data: numpy.ndarray,
+) -> typing.Optional[typing.Tuple[int, numpy.ndarray]]:
+    """Count each value of an integer array.
+
+    Returns the smallest value and the counts of each value from it,
+    or None if the data is not integer or its range is too large.
+    """
+    if data.dtype.kind == "u" and data.dtype.itemsize <= 2:
+        # Count raw values, and get the range from the counts, all in
+        # one pass over the data.
+        valueCounts = numpy.bincount(data.ravel())
+        nonzero = numpy.flatnonzero(valueCounts)
+        return int(nonzero[0]), valueCounts[nonzero[0] : nonzero[-1] + 1]
+    elif data.dtype.kind in "iu":
+        dmin, dmax = int(data.min()), int(data.max())
+        if dmax - dmin >= MAX_COUNTED_RANGE:
+            return None
+        return dmin, numpy.bincount((data.ravel() - dmin).astype(numpy.intp))
+    return None
+
+
+def compute(
+    data: numpy.ndarray,
+    numBins: int = 64,
+    numShifts: int = 4,
+    stride: int = 1,
+) -> HistogramData:
+    """Return the shifted average histogram of an image.
+
+    There are numBins bins, of equal width, with lower edges from the
+    minimum to the maximum of the data.  numShifts histograms, with
+    bins shifted by multiples of 1/numShifts of the bin width, are
+    summed.  Only every stride rows and columns are sampled.
+    """
+    sample = data[(slice(None, None, stride),) * data.ndim]
+    if not sample.size:
+        raise ValueError("no data to compute histogram of")
+    counted = _countValues(sample)
+    if counted is not None:
+        offset, valueCounts = counted
+        dmin, dmax = offset, offset + len(valueCounts) - 1
+    else:
+        dmin, dmax = sample.min(), sample.max()
+    bins = numpy.linspace(dmin, dmax, numBins)
+    counts = numpy.zeros(numBins)
+    h = bins[1] - bins[0] if numBins > 1 else 0
+    if counted is not None:
+        values = numpy.flatnonzero(valueCounts)
+        weights = valueCounts[values]
+        values += offset
+    for i in range(numShifts):
+        # Bin i holds values in (edge i - 1, edge i], and values past
+        # the last edge are dropped.
+        edges = bins + i * h / numShifts
+        if counted is not None:
+            these = numpy.bincount(
+                numpy.searchsorted(edges, values, side="left"),
+                weights=weights,
+                minlength=numBins,
+            )
+        else:
+            these = numpy.bincount(
+                numpy.digitize(sample.flat, edges, right=True),
+                minlength=numBins,
+            )
+        counts += these[:numBins]
+    return HistogramData(dmin, dmax, bins, counts, stride)
+
+
+class HistogramWorker:
+    """Computes histograms of images on a dedicated thread.
+
+    Images are given with :meth:`submit`, and each histogram is passed
+    to `callback`, from the worker thread.  If images are submitted
+    faster than their histograms are computed, the older ones are
+    skipped.
+
+    Args:
+        callback: called with each :class:`HistogramData`.
+        maxSamples: number of pixels to sample from each image, at
+            most.  Larger images are sampled with a stride.
+        numBins: number of bins of the histograms.
+        numShifts: number of shifted histograms to average.
+    """
+
+    def __init__(
+        self,
+        callback: typing.Callable[[HistogramData], None],
+        maxSamples: int = DEFAULT_MAX_SAMPLES,
+        numBins: int = 64,
+        numShifts: int = 4,
+    ) -> None:
+        self.callback = callback
+        self.maxSamples = maxSamples
+        self.numBins = numBins
+        self.numShifts = numShifts
+        self._pending = None
+        self._isStopped = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(
+            target=self._run, name="histogram", daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, data: numpy.ndarray) -> None:
+        """Compute the histogram of an image, instead of any pending."""
+        with self._condition:
+            self._pending = data
+            self._condition.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while self._pending is None and not self._isStopped:
+                    self._condition.wait()
+                if self._isStopped:
+                    return
+                data, self._pending = self._pending, None
+            try:
+                stride = getStride(data.shape, self.maxSamples)
+                self.callback(
+                    compute(data, self.numBins, self.numShifts, stride)
+                )
+            except Exception:
+                _logger.exception("failed to compute histogram")
+
+    def stop(self) -> None:
+        """Stop the thread, skipping any pending image."""
+        with self._condition:
+            self._isStopped = True
+            self._condition.notify()
+        if threading.current_thread() is not self._thread:
+            self._thread.join()
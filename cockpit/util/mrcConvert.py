@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## Copyright (C) 2026 University of Oxford
+##
+## This file is part of Cockpit.
+##
+## Cockpit is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## Cockpit is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Cockpit.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Reorder, crop, and convert MRC files from the command line.
+
+This is a command line interface to :func:`cockpit.util.Mrc.convert`,
+which works on files larger than memory.  For example, to put the
+sections of SI data collected in z-angle-phase order into the
+angle-z-phase order that reconstruction programs need::
+
+    cockpit-mrc-convert --z-order zap --z-lengths 31,3,5 \\
+        --z-wanted azp data.dv
+
+Several files can be converted at once, in parallel with ``--jobs``.
+
+"""
+
+import argparse
+import concurrent.futures
+import os.path
+import sys
+from typing import List
+
+import numpy
+
+from cockpit.util import Mrc
+
+
+## Maps the ImgSequence names to their values in the header.
+_IMG_SEQUENCES = {"ZTW": 0, "WZT": 1, "ZWT": 2}
+
+
+def _parse_cmd_line_args(cmd_line_args: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="cockpit-mrc-convert",
+        description="Reorder, crop, and convert MRC files.",
+    )
+    parser.add_argument("files", nargs="+", metavar="FILE")
+    parser.add_argument(
+        "--output",
+        help="Path of the converted file, if there is only one FILE",
+    )
+    parser.add_argument(
+        "--suffix",
+        default="",
+        help=(
+            "Add suffix to the name of each converted file, before the"
+            " extension.  If empty, and there is no --output, files are"
+            " converted in place"
+        ),
+    )
+    parser.add_argument(
+        "--img-sequence",
+        choices=sorted(_IMG_SEQUENCES),
+        help="Order of the Z, wavelength, and time axes, fastest first",
+    )
+    parser.add_argument(
+        "--z-order",
+        help="Axes packed in the Z axis, slowest first, e.g. 'zap' for SI",
+    )
+    parser.add_argument(
+        "--z-lengths",
+        help="Comma separated lengths of the axes in --z-order",
+    )
+    parser.add_argument(
+        "--z-wanted",
+        help="Order of the axes packed in the Z axis in the output",
+    )
+    parser.add_argument(
+        "--crop",
+        nargs=4,
+        type=int,
+        metavar=("Y0", "Y1", "X0", "X1"),
+        help="Region of each section to keep",
+    )
+    parser.add_argument(
+        "--dtype",
+        help="Data type of the output, e.g. 'uint16' or 'float32'",
+    )
+    parser.add_argument(
+        "--memory",
+        type=int,
+        default=64,
+        help="Megabytes of sections to copy at a time, per job",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of files to convert in parallel",
+    )
+    args = parser.parse_args(cmd_line_args[1:])
+
+    zOptions = (args.z_order, args.z_lengths, args.z_wanted)
+    if any(o is not None for o in zOptions):
+        if any(o is None for o in zOptions):
+            parser.error("--z-order, --z-lengths, and --z-wanted go together")
+        args.z_lengths = [int(n) for n in args.z_lengths.split(",")]
+        if len(args.z_lengths) != len(args.z_order):
+            parser.error("--z-lengths needs a length for each --z-order axis")
+    if args.output is not None and len(args.files) > 1:
+        parser.error("--output can only be used with a single FILE")
+    if args.dtype is not None:
+        try:
+            args.dtype = numpy.dtype(args.dtype)
+        except TypeError as e:
+            parser.error(str(e))
+    return args
+
+
+def _output_path(path: str, args: argparse.Namespace) -> str:
+    if args.output is not None:
+        return args.output
+    root, ext = os.path.splitext(path)
+    return root + args.suffix + ext
+
+
+def _convert(path: str, args: argparse.Namespace) -> str:
+    outPath = _output_path(path, args)
+    imgSequence = None
+    if args.img_sequence is not None:
+        imgSequence = _IMG_SEQUENCES[args.img_sequence]
+    Mrc.convert(
+        path,
+        outPath,
+        imgSequence=imgSequence,
+        zLengths=args.z_lengths,
+        zOrder=args.z_order,
+        zWanted=args.z_wanted,
+        crop=args.crop,
+        dtype=args.dtype,
+        maxBytes=args.memory * 2**20,
+    )
+    return outPath
+
+
+def main(argv: List[str]) -> int:
+    args = _parse_cmd_line_args(argv)
+    status = 0
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=max(args.jobs, 1)
+    ) as executor:
+        futures = {
+            executor.submit(_convert, path, args): path for path in args.files
+        }
+        for future in concurrent.futures.as_completed(futures):
+            path = futures[future]
+            try:
+                outPath = future.result()
+            except Exception as e:
+                print("%s: %s" % (path, e), file=sys.stderr)
+                status = 1
+            else:
+                print("%s -> %s" % (path, outPath))
+    return status
+
+
+def _setuptools_entry_point() -> int:
+    # Like cockpit's own entry point, main takes argv as argument so
+    # that it can be called from other programs.
+    return main(sys.argv)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## Copyright (C) 2026 University of Oxford
+##
+## This file is part of Cockpit.
+##
+## Cockpit is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## Cockpit is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Cockpit.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Software timing of actions, for when there is no hardware to do it.
+
+``time.sleep`` may return a millisecond or more after it was asked to,
+and a sequence of relative sleeps accumulates those errors.  Instead,
+the :class:`Sequencer` runs each action at an absolute deadline on the
+:func:`time.perf_counter_ns` clock.  It sleeps until shortly before
+the deadline and then spins until it is due, from a dedicated thread
+which may have realtime priority.  How late each action ran is
+recorded in a :class:`TimingRecord`, so that software timed
+experiments can be quantified.
+
+Cockpit shares one sequencer, from :func:`getSequencer`::
+
+    start = time.perf_counter_ns()
+    record = sequencer.getSequencer().run(
+        [(start + 10**6, openShutter), (start + 11 * 10**6, closeShutter)]
+    )
+    print(record.describe())
+
+Waits with no action are done with :meth:`Sequencer.wait`, from the
+calling thread, so that they do not hold up the shared thread.
+
+"""
+
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+import typing
+
+import numpy
+
+
+_logger = logging.getLogger(__name__)
+
+
+## Default time, in nanoseconds, before a deadline from which to spin
+# instead of sleeping.  It should be longer than the usual lateness of
+# sleep on the system.
+DEFAULT_SPIN_NS = 2 * 10**6
+
+_Step = typing.Tuple[int, typing.Optional[typing.Callable[[], None]]]
+
+
+def waitUntil(deadline: int, spinTime: int = DEFAULT_SPIN_NS) -> int:
+    """Wait until a time of the perf_counter_ns clock, and return it.
+
+    This sleeps until `spinTime` nanoseconds before the deadline, and
+    then spins until it is due.  Returns the time at which the wait
+    ended, which is never before the deadline.
+    """
+    now = time.perf_counter_ns()
+    while deadline - now > spinTime:
+        time.sleep((deadline - now - spinTime) / 1e9)
+        now = time.perf_counter_ns()
+    while now < deadline:
+        now = time.perf_counter_ns()
+    return now
+
+
+class TimingRecord:
+    """Scheduled and actual times, in nanoseconds, of timed actions."""
+
+    def __init__(self) -> None:
+        self.scheduled: typing.List[int] = []
+        self.actual: typing.List[int] = []
+
+    def __len__(self) -> int:
+        return len(self.scheduled)
+
+    def record(self, scheduled: int, actual: int) -> None:
+        self.scheduled.append(scheduled)
+        self.actual.append(actual)
+
+    def extend(self, other: "TimingRecord") -> None:
+        self.scheduled.extend(other.scheduled)
+        self.actual.extend(other.actual)
+
+    def getLateness(self) -> numpy.ndarray:
+        """Return how late each action ran, in nanoseconds."""
+        return numpy.array(self.actual, dtype=numpy.int64) - numpy.array(
+            self.scheduled, dtype=numpy.int64
+        )
+
+    def getStats(self) -> typing.Dict[str, float]:
+        """Return the count, and the mean, standard deviation, and
+        maximum of how late actions ran, in microseconds.
+        """
+        lateness = self.getLateness() / 1e3
+        if not len(lateness):
+            return {"count": 0, "mean": 0.0, "std": 0.0, "max": 0.0}
+        return {
+            "count": len(lateness),
+            "mean": float(lateness.mean()),
+            "std": float(lateness.std()),
+            "max": float(lateness.max()),
+        }
+
+    def describe(self) -> str:
+        stats = self.getStats()
+        return "%d timed actions, late by %.1f +/- %.1f us (max %.1f us)" % (
+            stats["count"],
+            stats["mean"],
+            stats["std"],
+            stats["max"],
+        )
+
+
+def _setRealtimePriority() -> bool:
+    """Try to give the calling thread realtime priority."""
+    try:
+        if hasattr(os, "sched_setscheduler"):
+            # On Linux, pid 0 is the calling thread.
+            priority = os.sched_get_priority_min(os.SCHED_FIFO)
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+            return True
+        elif sys.platform == "win32":
+            import ctypes
+
+            THREAD_PRIORITY_TIME_CRITICAL = 15
+            kernel32 = ctypes.windll.kernel32
+            return bool(
+                kernel32.SetThreadPriority(
+                    kernel32.GetCurrentThread(), THREAD_PRIORITY_TIME_CRITICAL
+                )
+            )
+    except (OSError, AttributeError) as e:
+        _logger.warning("failed to set realtime priority: %s", e)
+    return False
+
+
+class Sequencer:
+    """Runs actions at deadlines, from a dedicated thread.
+
+    Args:
+        realtime: whether to try to give the thread realtime priority.
+            This usually needs special permissions, and is skipped
+            with a warning without them.
+        spinTime: nanoseconds before each deadline from which to spin
+            instead of sleeping.
+    """
+
+    def __init__(
+        self, realtime: bool = False, spinTime: int = DEFAULT_SPIN_NS
+    ) -> None:
+        self.realtime = realtime
+        self.spinTime = spinTime
+        ## Whether the thread did get realtime priority.
+        self.isRealtime = False
+        self._jobs = queue.Queue()
+        self._thread = threading.Thread(
+            target=self._serve, name="sequencer", daemon=True
+        )
+        self._thread.start()
+
+    def _serve(self) -> None:
+        if self.realtime:
+            self.isRealtime = _setRealtimePriority()
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            steps, record, done = job
+            try:
+                self._runSteps(steps, record)
+            except BaseException as e:
+                done.error = e
+            done.set()
+
+    def _runSteps(self, steps: typing.Iterable[_Step], record) -> None:
+        for deadline, action in steps:
+            record.record(deadline, waitUntil(deadline, self.spinTime))
+            if action is not None:
+                action()
+
+    def run(self, steps: typing.Iterable[_Step]) -> TimingRecord:
+        """Run actions at their deadlines, and wait for them to finish.
+
+        Each step is a tuple of a deadline on the perf_counter_ns
+        clock and a callable, which may be None to only wait.  Steps
+        are run in order, so deadlines should be sorted, and a step
+        that is already late runs straight away.  Returns the record of
+        when the steps ran.  If an action raises, the remaining steps
+        are skipped, and the exception raised here.
+        """
+        record = TimingRecord()
+        if threading.current_thread() is self._thread:
+            # Called from one of our own actions.
+            self._runSteps(steps, record)
+            return record
+        done = threading.Event()
+        done.error = None
+        self._jobs.put((steps, record, done))
+        done.wait()
+        if done.error is not None:
+            raise done.error
+        return record
+
+    def wait(self, deadline: int) -> TimingRecord:
+        """Wait until a deadline, from the calling thread.
+
+        Waits without an action do not need the sequencer thread, so
+        they do not hold up the actions of others while they wait.
+        Returns the record of when the wait ended.
+        """
+        record = TimingRecord()
+        record.record(deadline, waitUntil(deadline, self.spinTime))
+        return record
+
+    def stop(self) -> None:
+        """Stop the thread, after any steps already queued."""
+        self._jobs.put(None)
+        self._thread.join()
+
+
+_sequencer: typing.Optional[Sequencer] = None
+_sequencerLock = threading.Lock()
+
+
+def getSequencer() -> Sequencer:
+    """Return the shared sequencer, starting it if needed."""
+    global _sequencer
+    with _sequencerLock:
+        if _sequencer is None:
+            _sequencer = Sequencer()
+        return _sequencer
+
+
+def configure(realtime: bool = False, spinTime: int = DEFAULT_SPIN_NS):
+    """Replace the shared sequencer with one with these settings."""
+    global _sequencer
+    with _sequencerLock:
+        if _sequencer is not None:
+            _sequencer.stop()
+        _sequencer = Sequencer(realtime, spinTime)
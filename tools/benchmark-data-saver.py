@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## Copyright (C) 2026 University of Oxford
+##
+## This file is part of Cockpit.
+##
+## Cockpit is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## Cockpit is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Cockpit.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Benchmark how fast the DataSaver can save images.
+
+Fake cameras publish ``NEW_IMAGE`` events at a fixed rate, each from
+its own thread as images from real cameras would arrive, and a
+DataSaver saves them as during an experiment.  At the end, this
+reports the sustained rate at which images were saved, the latency of
+each image from being published to being handed to the writer, how
+far the save queue grew, and the peak memory use.  For example, two
+2048x2048 cameras at 100 frames per second for 10 seconds::
+
+    python tools/benchmark-data-saver.py --cameras 2 --shape 2048 2048 \\
+        --fps 100 --seconds 10 --writer-threads 4
+
+No wx.App is needed, so this can run on a machine without a display,
+but wxPython must still be installed since cockpit imports it.
+
+"""
+
+import argparse
+import os
+import os.path
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy
+
+from cockpit import events
+from cockpit.experiment import dataSaver
+
+
+class FakeCamera:
+    """Stands in for a CameraHandler, as far as DataSaver cares."""
+
+    def __init__(self, name, shape, wavelength):
+        self.name = name
+        self.dye = None
+        self.wavelength = wavelength
+        self.shape = shape
+
+    def getImageSize(self):
+        return self.shape[1], self.shape[0]
+
+
+class FakeObjectives:
+    """Stands in for the app's Objectives."""
+
+    class _Objective:
+        lens_ID = 0
+
+    def GetPixelSize(self):
+        return 0.1
+
+    def GetCurrent(self):
+        return self._Objective()
+
+
+class TimedDataSaver(dataSaver.DataSaver):
+    """DataSaver that records how long each image took to be written."""
+
+    def __init__(self, *args, **kwargs):
+        ## Seconds from each image being published until written.
+        self.latencies = []
+        super().__init__(*args, **kwargs)
+
+    def writeImage(self, cameraIndex, imageData, timestamp, arrivalTime):
+        super().writeImage(cameraIndex, imageData, timestamp, arrivalTime)
+        if imageData is not None:
+            # Not dropped from the queue.
+            latency = time.time() - arrivalTime
+            self.latencies.append(latency)
+
+
+def publish_images(camera, fps, num_images, seed):
+    """Publish images from a camera at a fixed rate."""
+    rng = numpy.random.default_rng(seed)
+    ## A few different images, copied before publishing since a real
+    ## camera gives us a new array for each image.
+    images = [
+        rng.integers(0, 2**16, camera.shape, dtype=numpy.uint16)
+        for i in range(4)
+    ]
+    start = time.perf_counter()
+    for i in range(num_images):
+        delay = start + i / fps - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        events.publish(
+            events.NEW_IMAGE % camera.name,
+            images[i % len(images)].copy(),
+            {"timestamp": time.time()},
+        )
+
+
+def peak_rss_megabytes():
+    """Return the peak resident memory of this process, or None."""
+    try:
+        import resource
+    except ImportError:
+        # Not available on Windows.
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # In bytes on macOS and in kilobytes elsewhere.
+    if os.uname().sysname == "Darwin":
+        return maxrss / 2**20
+    return maxrss / 2**10
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--cameras", type=int, default=1)
+    parser.add_argument(
+        "--shape",
+        type=int,
+        nargs=2,
+        default=(2048, 2048),
+        metavar=("HEIGHT", "WIDTH"),
+    )
+    parser.add_argument(
+        "--fps", type=float, default=50.0, help="Frames per second per camera"
+    )
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--writer-threads", type=int, default=4)
+    parser.add_argument("--memory-map", action="store_true")
+    parser.add_argument(
+        "--queue-memory", type=int, help="In megabytes, default no limit"
+    )
+    parser.add_argument("--spill-dir", default=None)
+    parser.add_argument(
+        "--spill-size", type=int, default=16384, help="In megabytes"
+    )
+    parser.add_argument("--file-per-camera", action="store_true")
+    parser.add_argument(
+        "--sync",
+        action="store_true",
+        help="Include flushing the files to disk in the time taken",
+    )
+    parser.add_argument(
+        "--output-dir",
+        default=None,
+        help="Where to save, instead of a temporary directory",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    num_images = max(int(args.fps * args.seconds), 1)
+    shape = tuple(args.shape)
+    cameras = [
+        FakeCamera("camera%d" % i, shape, 500 + 50 * i)
+        for i in range(args.cameras)
+    ]
+
+    output_dir = args.output_dir
+    if output_dir is None:
+        output_dir = tempfile.mkdtemp(prefix="cockpit-benchmark-")
+    try:
+        publishers = [
+            threading.Thread(
+                target=publish_images,
+                args=(camera, args.fps, num_images, i),
+                name="publish-" + camera.name,
+            )
+            for i, camera in enumerate(cameras)
+        ]
+
+        # The "experiment" lasts until all the images are published.
+        def run():
+            for thread in publishers:
+                thread.join()
+
+        run_thread = threading.Thread(target=run)
+        maxQueueBytes = float("inf")
+        if args.queue_memory is not None:
+            maxQueueBytes = args.queue_memory * 2**20
+        # One image per rep, so that large runs are split into files
+        # like a long timelapse would be.
+        saver = TimedDataSaver(
+            cameras,
+            num_images,
+            1.0 / args.fps,
+            {c: 1 for c in cameras},
+            {c: set() for c in cameras},
+            run_thread,
+            os.path.join(output_dir, "benchmark.dv"),
+            0.1,
+            ["benchmark"],
+            {c: 488.0 for c in cameras},
+            writerThreads=args.writer_threads,
+            useMemmap=args.memory_map,
+            maxQueueBytes=maxQueueBytes,
+            spillDir=args.spill_dir,
+            spillBytes=args.spill_size * 2**20,
+            filePerCamera=args.file_per_camera,
+            objectives=FakeObjectives(),
+        )
+        saver.startCollecting()
+        start = time.perf_counter()
+        for thread in publishers:
+            thread.start()
+        run_thread.start()
+        saver.executeAndSave()
+        if args.sync:
+            for filename in saver.getFilenames():
+                with open(filename, "rb+") as fh:
+                    os.fsync(fh.fileno())
+        elapsed = time.perf_counter() - start
+    finally:
+        if args.output_dir is None:
+            shutil.rmtree(output_dir)
+
+    num_saved = len(saver.latencies)
+    total_bytes = num_saved * numpy.prod(shape) * 2
+    offered = args.cameras * args.fps * numpy.prod(shape) * 2 / 2**20
+    print(
+        "%d cameras, %dx%d, %g fps: offered %.1f MB/s"
+        % (args.cameras, shape[1], shape[0], args.fps, offered)
+    )
+    print(
+        "saved %d of %d images in %.2f s: %.1f MB/s, %.1f images/s"
+        % (
+            num_saved,
+            num_images * args.cameras,
+            elapsed,
+            total_bytes / 2**20 / elapsed,
+            num_saved / elapsed,
+        )
+    )
+    if num_saved:
+        p50, p90, p99, p100 = numpy.percentile(
+            saver.latencies, [50, 90, 99, 100]
+        )
+        print(
+            "latency (ms): p50 %.1f, p90 %.1f, p99 %.1f, max %.1f"
+            % (1e3 * p50, 1e3 * p90, 1e3 * p99, 1e3 * p100)
+        )
+    imageQueue = saver.imageQueue
+    print(
+        "peak queue: %d images, %.1f MB; spilled %d, dropped %d"
+        % (
+            imageQueue.maxDepth,
+            imageQueue.maxBytesQueued / 2**20,
+            sum(imageQueue.numSpilled),
+            sum(imageQueue.numDropped),
+        )
+    )
+    rss = peak_rss_megabytes()
+    if rss is not None:
+        print("peak RSS: %.1f MB" % rss)
+
+
+if __name__ == "__main__":
+    main()